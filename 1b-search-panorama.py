@@ -1,5 +1,6 @@
 import os
 import time
+import random
 import sqlite3
 import streetview
 import concurrent.futures
@@ -14,6 +15,11 @@ COUNT_NONE_FOUND_AS_SEARCHED = True
 
 WORKERS = 72
 
+# Multiplicative hash of the coord id. Coords are inserted row by row from a
+# grid, so batches are taken in hash order to spread them over the whole area.
+ID_HASH = "((id * 2654435761) % 4294967296)"
+ID_HASH_RANGE = 4294967296
+
 
 ########################################
 # MARK: Database setup
@@ -47,6 +53,12 @@ def setup_database():
     """
     )
 
+    # Partial index of the unsearched coords in hash order, so a batch is
+    # read without sorting or scanning the coords that are done
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_sample_coords_unsearched ON sample_coords({ID_HASH}) WHERE searched = 0"
+    )
+
     conn.commit()
     conn.close()
 
@@ -60,12 +72,20 @@ def get_unsearched_coords(batch_size: int) -> dict[int, tuple[float, float]]:
     conn = sqlite3.connect(DB_PATH)
     coords: dict[int, tuple[float, float]] = {}
 
+    # Start at a random hash and wrap around
+    start = random.randrange(ID_HASH_RANGE)
     cursor = conn.execute(
-        "SELECT id, lat, lon, label, searched FROM sample_coords WHERE searched = 0 ORDER BY RANDOM() LIMIT ?",
-        [batch_size],
+        f"SELECT id, lat, lon, label, searched FROM sample_coords WHERE searched = 0 AND {ID_HASH} >= ? ORDER BY {ID_HASH} LIMIT ?",
+        [start, batch_size],
     )
 
     rows = cursor.fetchall()
+    if len(rows) < batch_size:
+        cursor = conn.execute(
+            f"SELECT id, lat, lon, label, searched FROM sample_coords WHERE searched = 0 AND {ID_HASH} < ? ORDER BY {ID_HASH} LIMIT ?",
+            [start, batch_size - len(rows)],
+        )
+        rows += cursor.fetchall()
 
     print(f"Found {len(rows)} unsearched coords")
 
@@ -5,6 +5,7 @@ import streetview
 import concurrent.futures
 import os
 from dotenv import load_dotenv
+from util.db_operations import get_n_pano_id_where
 
 load_dotenv()
 
@@ -16,6 +17,11 @@ if GOOGLE_MAP_API_KEY is None:
 
 SEARCH_BATCH_SIZE = 100000
 
+# Same predicate as the partial index, SQLite only uses the index if it matches
+WITHOUT_DATE_AND_COPYRIGHT = (
+    "(date IS NULL OR date = '' OR copyright IS NULL OR copyright = '')"
+)
+
 
 ########################################
 # MARK: Database setup
@@ -49,6 +55,12 @@ def setup_database():
     """
     )
 
+    # Partial index of the panoramas missing metadata, so a batch is read
+    # without sorting or scanning the panoramas that are done
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_search_panoramas_without_date_and_copyright ON search_panoramas(pano_id) WHERE {WITHOUT_DATE_AND_COPYRIGHT}"
+    )
+
     conn.commit()
     conn.close()
 
@@ -60,20 +72,12 @@ def setup_database():
 
 def get_panoramas_without_date_and_copyright(batch_size: int) -> list[str]:
     conn = sqlite3.connect(DB_PATH)
-    panoramas = []
-
-    cursor = conn.execute(
-        "SELECT * FROM search_panoramas WHERE date IS NULL OR date = '' OR copyright IS NULL OR copyright = '' ORDER BY RANDOM() LIMIT ?",
-        [batch_size],
-    )
-
-    rows = cursor.fetchall()
 
-    print(f"Found {len(rows)} panoramas without date and copyright")
+    # Pano ids are random, so starting at a random one and wrapping around
+    # spreads the batch over the whole area
+    panoramas = get_n_pano_id_where(conn, WITHOUT_DATE_AND_COPYRIGHT, batch_size)
 
-    for row in rows:
-        (pano_id, lat, lon, date, copyright, heading, pitch, roll) = row
-        panoramas.append(pano_id)
+    print(f"Found {len(panoramas)} panoramas without date and copyright")
 
     conn.close()
 
@@ -0,0 +1,100 @@
+import os
+import time
+import sqlite3
+import argparse
+import concurrent.futures
+from dotenv import load_dotenv
+from util.db_operations import get_n_pano_id_without_ocr
+from util.panorama_cache import PanoramaCache
+from util.panorama_options import add_panorama_arguments, get_perspectives
+from util.streetview_ocr import download_panorama
+
+load_dotenv()
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "gsv.db")
+
+parser = argparse.ArgumentParser(
+    description="Download panoramas into the on-disk panorama cache, so OCR can run offline"
+)
+parser.add_argument(
+    "--cache-dir", required=True, help="Directory of the panorama cache"
+)
+parser.add_argument(
+    "--cache-size-gb",
+    type=float,
+    default=50,
+    help="Size cap of the panorama cache, least recently used panoramas are evicted",
+)
+parser.add_argument(
+    "--limit", type=int, default=1000, help="Number of panoramas to prefetch"
+)
+parser.add_argument("--workers", type=int, default=16, help="Parallel downloads")
+# Pass the same --perspectives, --crop-panorama and --adaptive-zoom as to
+# 2-pano-ocr.py, otherwise the prefetched panoramas don't match its lookups
+add_panorama_arguments(parser)
+
+args = parser.parse_args()
+
+PERSPECTIVES = get_perspectives(args.perspectives)
+
+
+########################################
+# MARK: Get panoramas to prefetch
+########################################
+
+
+def get_pano_ids_without_ocr(limit: int) -> list[str]:
+    # Same partial index as the OCR workers' claims, without claiming: the
+    # panoramas stay free for the workers, which then find them in the cache
+    conn = sqlite3.connect(DATABASE_PATH)
+    pano_ids = get_n_pano_id_without_ocr(conn, limit)
+    conn.close()
+    return pano_ids
+
+
+########################################
+# MARK: Prefetch
+########################################
+
+
+def prefetch(pano_id: str, cache: PanoramaCache):
+    download_panorama(
+        pano_id,
+        PERSPECTIVES,
+        crop_panorama=args.crop_panorama,
+        adaptive_zoom=args.adaptive_zoom,
+        cache=cache,
+    )
+
+
+if __name__ == "__main__":
+    cache = PanoramaCache(args.cache_dir, int(args.cache_size_gb * 1024**3))
+
+    pano_ids = get_pano_ids_without_ocr(args.limit)
+    pano_count = len(pano_ids)
+    print(f"Prefetching {pano_count} panoramas into {args.cache_dir}")
+
+    progress = 0
+    begin_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(prefetch, pano_id, cache): pano_id for pano_id in pano_ids
+        }
+
+        for future in concurrent.futures.as_completed(futures):
+            pano_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error prefetching panorama {pano_id}")
+                print(e)
+            progress += 1
+            total_speed = progress / (time.time() - begin_time)
+            print(
+                "Prefetch Progress: %d/%d (%.2f panoramas/sec)"
+                % (progress, pano_count, total_speed)
+            )
+
+    print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+    print(f"Cache size: {cache.total_bytes() / 1024**3:.2f} GB")
+    cache.close()
@@ -0,0 +1,103 @@
+import argparse
+import panoocr as po
+from panoocr.ocr.inference_server import DEFAULT_ADDRESS, DEFAULT_MAX_WAIT_SECONDS
+from panoocr.ocr.model_store import DEFAULT_MODEL_ROOT, DEFAULT_OFFLINE
+from util.ocr_engines import OCR_ENGINE_NAMES, get_ocr_engine_config
+
+parser = argparse.ArgumentParser(
+    description="Host one OCR engine for all the 2-pano-ocr.py workers of this machine, run them with --ocr-engine remote"
+)
+parser.add_argument(
+    "--ocr-engine",
+    choices=[name for name in OCR_ENGINE_NAMES if name != "remote"],
+    default="macocr",
+    help="Choose OCR engine",
+)
+parser.add_argument(
+    "--address",
+    default=DEFAULT_ADDRESS,
+    help="Unix socket path or host:port to listen on",
+)
+parser.add_argument(
+    "--max-batch-size",
+    type=int,
+    default=None,
+    help="Images recognized per model call, defaults to the engine's preferred batch size",
+)
+parser.add_argument(
+    "--max-wait-ms",
+    type=float,
+    default=DEFAULT_MAX_WAIT_SECONDS * 1000,
+    help="How long a batch waits for images of other clients before it runs",
+)
+parser.add_argument(
+    "--florence-profile",
+    choices=["accurate", "cpu"],
+    default="accurate",
+    help="Florence-2 performance profile, cpu uses greedy decoding and int8 weights",
+)
+parser.add_argument(
+    "--onnx-model-dir",
+    default=None,
+    help="Directory with the det.onnx, rec.onnx and dict.txt of the onnx engine, defaults to onnx/ in --model-root",
+)
+parser.add_argument(
+    "--onnx-threads",
+    type=int,
+    default=None,
+    help="Intra-op threads of the onnx engine, 0 for all cores, defaults to --threads",
+)
+parser.add_argument(
+    "--model-root",
+    default=DEFAULT_MODEL_ROOT,
+    help="Directory the engines download their models to (env PANOOCR_MODEL_ROOT)",
+)
+parser.add_argument(
+    "--offline",
+    action="store_true",
+    default=DEFAULT_OFFLINE,
+    help="Only use the models already in --model-root, fail instead of downloading (env PANOOCR_OFFLINE=1)",
+)
+parser.add_argument(
+    "--threads",
+    type=int,
+    default=None,
+    help="Threads of the OCR engine and OpenCV, defaults to all cores",
+)
+parser.add_argument(
+    "--cpus",
+    default=None,
+    help="Comma separated CPUs to pin the server to, e.g. to keep cores free for the workers",
+)
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    ocr_engine_type, ocr_engine_config = get_ocr_engine_config(
+        args.ocr_engine,
+        batch_size=args.max_batch_size,
+        florence_profile=po.Florence2PerformanceProfile(args.florence_profile),
+        onnx_model_dir=args.onnx_model_dir,
+        onnx_threads=args.onnx_threads,
+        model_root=args.model_root,
+        offline=args.offline,
+        threads=args.threads,
+        cpu_affinity=(
+            None if args.cpus is None else [int(cpu) for cpu in args.cpus.split(",")]
+        ),
+    )
+    ocr_engine = po.create_ocr_engine(ocr_engine_type, ocr_engine_config)
+    print(f"OCR engine warmed up in {ocr_engine.warmup():.1f}s")
+
+    server = po.OCRInferenceServer(
+        ocr_engine,
+        address=args.address,
+        max_batch_size=args.max_batch_size,
+        max_wait_seconds=args.max_wait_ms / 1000,
+        engine_config=ocr_engine_config,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"OCR inference server: {server.report()}")
@@ -1,17 +1,26 @@
 from util.streetview_ocr import (
     download_and_ocr_google_streetview_from_id,
-    get_streetview_image,
+    download_panorama,
     ocr_google_streetview_from_id,
 )
+from util.panorama_cache import PanoramaCache
+from util.panorama_options import add_panorama_arguments, get_perspectives
+from util.ocr_engines import OCR_ENGINE_NAMES, get_ocr_engine_config
+from panoocr.ocr.inference_server import DEFAULT_ADDRESS as DEFAULT_OCR_SERVER_ADDRESS
+from panoocr.ocr.model_store import DEFAULT_MODEL_ROOT, DEFAULT_OFFLINE
+from util.pipeline import OCRPipeline, PipelineConfig
 from util.db_operations import (
-    get_n_pano_id_without_ocr,
+    claim_pano_ids_without_ocr,
+    renew_lease,
     insert_ocr_result,
     add_one_to_download_count,
     setup_database,
+    DATABASE_TIMEOUT_SECONDS,
 )
 import panoocr as po
 import json
 import signal
+import multiprocessing
 from functools import wraps
 import sqlite3
 from typing import Any
@@ -51,25 +60,192 @@ def timeout_handler(seconds):
 
 
 @timeout_handler(5)
-def get_streetview_image_with_timeout(pano_id):
-    return get_streetview_image(pano_id)
+def download_panorama_with_timeout(
+    pano_id, perspectives, crop_panorama=False, adaptive_zoom=False, cache=None
+):
+    return download_panorama(pano_id, perspectives, crop_panorama, adaptive_zoom, cache)
 
 
 parser = argparse.ArgumentParser(description="Run OCR process")
 parser.add_argument("--debug", action="store_true", help="Enable debug mode")
 parser.add_argument(
     "--ocr-engine",
-    choices=["macocr", "florence2", "paddleocr", "easyocr"],
+    choices=OCR_ENGINE_NAMES,
     default="macocr",
     help="Choose OCR engine",
 )
+parser.add_argument(
+    "--ocr-batch-size",
+    type=int,
+    default=None,
+    help="Perspectives recognized per model call by batched engines (florence2, paddleocr, easyocr, onnx, remote), defaults to the engine's preferred batch size",
+)
+parser.add_argument(
+    "--florence-profile",
+    choices=["accurate", "cpu"],
+    default="accurate",
+    help="Florence-2 performance profile, cpu uses greedy decoding and int8 weights",
+)
+parser.add_argument(
+    "--onnx-model-dir",
+    default=None,
+    help="Directory with the det.onnx, rec.onnx and dict.txt of the onnx engine, defaults to onnx/ in --model-root",
+)
+parser.add_argument(
+    "--onnx-threads",
+    type=int,
+    default=None,
+    help="Intra-op threads of the onnx engine, 0 for all cores, defaults to --threads",
+)
+parser.add_argument(
+    "--ocr-server",
+    default=DEFAULT_OCR_SERVER_ADDRESS,
+    help="Unix socket path or host:port of the inference server used by the remote engine, see 2-ocr-server.py",
+)
+parser.add_argument(
+    "--text-prefilter",
+    choices=["none", "edge_density", "mser"],
+    default="none",
+    help="Skip recognition of perspectives unlikely to contain text",
+)
+parser.add_argument(
+    "--text-prefilter-threshold",
+    type=float,
+    default=None,
+    help="Minimum text presence score to recognize a perspective, defaults per prefilter",
+)
+parser.add_argument(
+    "--ocr-cache",
+    default=None,
+    help="SQLite file caching OCR results by perspective pixels and engine config, disabled by default",
+)
+parser.add_argument(
+    "--ocr-cache-size-gb",
+    type=float,
+    default=1,
+    help="Size of the cached OCR results before the least recently used are evicted",
+)
 parser.add_argument("--save-result", action="store_true", help="Save OCR result")
+parser.add_argument(
+    "--plan-dir",
+    default=None,
+    help="Directory to persist precomputed perspective plans, so new processes start warm",
+)
+add_panorama_arguments(parser)
+parser.add_argument(
+    "--panorama-cache-dir",
+    default=None,
+    help="Directory of the on-disk panorama cache, consulted before downloading",
+)
+parser.add_argument(
+    "--panorama-cache-size-gb",
+    type=float,
+    default=50,
+    help="Size cap of the panorama cache, least recently used panoramas are evicted",
+)
+parser.add_argument(
+    "--e2p-workers",
+    type=int,
+    default=None,
+    help="Threads used to project perspectives (defaults to one per perspective, capped by CPU count)",
+)
+parser.add_argument(
+    "--serial",
+    action="store_true",
+    help="Download, project, OCR and save one panorama at a time instead of running the staged pipeline",
+)
+parser.add_argument(
+    "--download-workers",
+    type=int,
+    default=4,
+    help="Parallel downloads in the pipeline",
+)
+parser.add_argument(
+    "--pipeline-e2p-workers",
+    type=int,
+    default=1,
+    help="Panoramas projected at the same time in the pipeline",
+)
+parser.add_argument(
+    "--queue-depth",
+    default="4",
+    help="Panoramas waiting in front of each pipeline stage, either one number for all stages or per stage, e.g. 'download=8,e2p=2,ocr=2,dup=4,write=4'",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="OCR processes to run, each with its own engine, sharing the work through leases in the database",
+)
+parser.add_argument(
+    "--model-root",
+    default=DEFAULT_MODEL_ROOT,
+    help="Directory the engines download their models to (env PANOOCR_MODEL_ROOT)",
+)
+parser.add_argument(
+    "--offline",
+    action="store_true",
+    default=DEFAULT_OFFLINE,
+    help="Only use the models already in --model-root, fail instead of downloading (env PANOOCR_OFFLINE=1)",
+)
+parser.add_argument(
+    "--threads",
+    type=int,
+    default=None,
+    help="Threads of the OCR engine and OpenCV in each worker, defaults to all cores, or to the worker's cores with --pin-workers",
+)
+parser.add_argument(
+    "--pin-workers",
+    action="store_true",
+    help="Give each worker its own share of the CPU cores, so workers don't oversubscribe them",
+)
+parser.add_argument(
+    "--lease-minutes",
+    type=float,
+    default=30,
+    help="How long a worker owns a claimed panorama before other workers can reclaim it",
+)
 
 args = parser.parse_args()
 
 DEBUG_MODE = args.debug
 OCR_ENGINE_NAME = args.ocr_engine
+OCR_BATCH_SIZE = args.ocr_batch_size
+OCR_SERVER_ADDRESS = args.ocr_server
+FLORENCE_PROFILE = po.Florence2PerformanceProfile(args.florence_profile)
+ONNX_MODEL_DIR = args.onnx_model_dir
+ONNX_THREADS = args.onnx_threads
+MODEL_ROOT = args.model_root
+OFFLINE = args.offline
+TEXT_PREFILTER_METHOD = (
+    None
+    if args.text_prefilter == "none"
+    else po.TextPresenceMethod(args.text_prefilter)
+)
+TEXT_PREFILTER_THRESHOLD = args.text_prefilter_threshold
+OCR_CACHE_PATH = args.ocr_cache
+OCR_CACHE_MAX_BYTES = int(args.ocr_cache_size_gb * 1024**3)
 SAVE_RESULT = True if DEBUG_MODE else args.save_result
+PLAN_DIR = args.plan_dir
+E2P_WORKERS = args.e2p_workers
+PERSPECTIVES = get_perspectives(args.perspectives)
+CROP_PANORAMA = args.crop_panorama
+ADAPTIVE_ZOOM = args.adaptive_zoom
+PANORAMA_CACHE_DIR = args.panorama_cache_dir
+PANORAMA_CACHE_MAX_BYTES = int(args.panorama_cache_size_gb * 1024**3)
+SERIAL = args.serial
+DOWNLOAD_WORKERS = args.download_workers
+PIPELINE_E2P_WORKERS = args.pipeline_e2p_workers
+QUEUE_DEPTH = args.queue_depth
+WORKERS = args.workers
+THREADS = args.threads
+PIN_WORKERS = args.pin_workers
+LEASE_SECONDS = args.lease_minutes * 60
+# Idle time before claiming again when there is nothing left to claim
+NO_WORK_SLEEP_SECONDS = 30
+
+# CPUs of this worker with --pin-workers, set by `run_worker`
+WORKER_CPU_AFFINITY = None
 
 UNIQUE_ID = uuid.uuid4()
 print(f"UUID / {UNIQUE_ID}")
@@ -92,6 +268,45 @@ def clear_console():
         _ = os.system("clear")
 
 
+def create_panorama_cache():
+    if PANORAMA_CACHE_DIR is None:
+        return None
+    return PanoramaCache(PANORAMA_CACHE_DIR, PANORAMA_CACHE_MAX_BYTES)
+
+
+def create_text_prefilter():
+    if TEXT_PREFILTER_METHOD is None:
+        return None
+    text_prefilter = po.TextPresencePrefilter(
+        TEXT_PREFILTER_METHOD, threshold=TEXT_PREFILTER_THRESHOLD
+    )
+    print(f"TEXT_PREFILTER: {TEXT_PREFILTER_METHOD.value} ({text_prefilter.report()})")
+    return text_prefilter
+
+
+def parse_queue_depths(queue_depth: str) -> dict[str, int]:
+    stages = ["download", "e2p", "ocr", "dup", "write"]
+    if "=" not in queue_depth:
+        return {stage: int(queue_depth) for stage in stages}
+
+    depths = {stage: 4 for stage in stages}
+    for entry in queue_depth.split(","):
+        stage, depth = entry.split("=")
+        if stage.strip() not in depths:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+        depths[stage.strip()] = int(depth)
+    return depths
+
+
+def claim_panoramas(co, n):
+    print(f"{WORKER_ID}\tClaiming {n} panoramas in all boroughs")
+    pano_ids = claim_pano_ids_without_ocr(co, WORKER_ID, n, LEASE_SECONDS)
+    if len(pano_ids) == 0:
+        print(f"No panoramas left to claim, waiting {NO_WORK_SLEEP_SECONDS} seconds")
+        time.sleep(NO_WORK_SLEEP_SECONDS)
+    return pano_ids
+
+
 def start_debug_process(co, ocr_engine, duplication_detection_engine, perspectives):
     pano_ids = [
         "UPnf7-KYannHcUI03oHZ5A",  # TIMES SQUARE
@@ -104,6 +319,12 @@ def start_debug_process(co, ocr_engine, duplication_detection_engine, perspectiv
             perspectives,
             ocr_engine,
             duplication_detection_engine,
+            plan_dir=PLAN_DIR,
+            e2p_workers=E2P_WORKERS,
+            cache=PANORAMA_CACHE,
+            text_prefilter=TEXT_PREFILTER,
+            crop_panorama=CROP_PANORAMA,
+            adaptive_zoom=ADAPTIVE_ZOOM,
         )
 
         if SAVE_RESULT:
@@ -111,51 +332,51 @@ def start_debug_process(co, ocr_engine, duplication_detection_engine, perspectiv
 
 
 def main(co: sqlite3.Connection):
-    if OCR_ENGINE_NAME == "macocr":
-        OCR_ENGINE = po.create_ocr_engine(
-            po.OCREngineType.MACOCR,
+    OCR_ENGINE_TYPE, OCR_ENGINE_CONFIG = get_ocr_engine_config(
+        OCR_ENGINE_NAME,
+        batch_size=OCR_BATCH_SIZE,
+        florence_profile=FLORENCE_PROFILE,
+        onnx_model_dir=ONNX_MODEL_DIR,
+        onnx_threads=ONNX_THREADS,
+        server_address=OCR_SERVER_ADDRESS,
+        model_root=MODEL_ROOT,
+        offline=OFFLINE,
+        threads=THREADS,
+        cpu_affinity=WORKER_CPU_AFFINITY,
+    )
+    OCR_ENGINE = po.create_ocr_engine(OCR_ENGINE_TYPE, OCR_ENGINE_CONFIG)
+    print(f"OCR engine warmed up in {OCR_ENGINE.warmup():.1f}s")
+    if OCR_CACHE_PATH is not None:
+        # Shared by the workers, SQLite serializes their writes
+        OCR_ENGINE = po.CachedOCREngine(
             {
-                "language_preference": [
-                    po.MacOCRLanguageCode.ENGLISH_US,
-                ],
-                "recognition_level": po.MacOCRRecognitionLevel.ACCURATE,
-            },
+                "engine": OCR_ENGINE,
+                "engine_config": OCR_ENGINE_CONFIG,
+                "path": OCR_CACHE_PATH,
+                "max_bytes": OCR_CACHE_MAX_BYTES,
+            }
         )
-    elif OCR_ENGINE_NAME == "florence2":
-        OCR_ENGINE = po.create_ocr_engine(
-            po.OCREngineType.FLORENCE,
-            {},
-        )
-    elif OCR_ENGINE_NAME == "paddle":
-        OCR_ENGINE = po.create_ocr_engine(
-            engine_type=po.OCREngineType.PADDLEOCR,
-            config={
-                "language_preference": po.PaddleOCRLanguageCode.ENGLISH,
-                "recognize_upside_down": False,
-                "use_v4_server": True,
-            },
-        )
-    elif OCR_ENGINE_NAME == "easyocr":
-        OCR_ENGINE = po.create_ocr_engine(
-            engine_type=po.OCREngineType.EASYOCR,
-            config={},
-        )
-    else:
-        raise ValueError("Invalid OCR engine")
-
-    DUPLICATION_DETECTION_ENGINE = po.SphereOCRDuplicationDetectionEngine()
-    PERSPECTIVES = po.DEFAULT_IMAGE_PERSPECTIVES
 
+    DUPLICATION_DETECTION_ENGINE = po.SphereOCRDuplicationDetectionEngine(
+        intersection_mode=po.IntersectionMode.ANALYTIC
+    )
     if DEBUG_MODE:
         start_debug_process(co, OCR_ENGINE, DUPLICATION_DETECTION_ENGINE, PERSPECTIVES)
     else:
         while True:
             try:
                 if co is None:
-                    co = sqlite3.connect(DATABASE_PATH)
-                start_process(
-                    co, OCR_ENGINE, DUPLICATION_DETECTION_ENGINE, PERSPECTIVES
-                )
+                    co = sqlite3.connect(
+                        DATABASE_PATH, timeout=DATABASE_TIMEOUT_SECONDS
+                    )
+                if SERIAL:
+                    start_process(
+                        co, OCR_ENGINE, DUPLICATION_DETECTION_ENGINE, PERSPECTIVES
+                    )
+                else:
+                    start_pipeline_process(
+                        co, OCR_ENGINE, DUPLICATION_DETECTION_ENGINE, PERSPECTIVES
+                    )
             except Exception as e:
                 print(f"Error: {e}")
                 continue
@@ -171,9 +392,7 @@ def start_process(co, ocr_engine, duplication_detection_engine, perspectives):
 
     N = 100
 
-    print(f"Getting {N} panoramas in all boroughs")
-
-    pano_ids = get_n_pano_id_without_ocr(co, N)
+    pano_ids = claim_panoramas(co, N)
 
     for i, pano_id in enumerate(pano_ids):
         if sum_success > 0:
@@ -188,16 +407,27 @@ def start_process(co, ocr_engine, duplication_detection_engine, perspectives):
             )
             pano_per_minute = 60 / avg_total_time
             print(f"Panoramas per minute: {pano_per_minute:.3f}")
+            if isinstance(ocr_engine, po.CachedOCREngine):
+                print(f"OCR cache: {ocr_engine.report()}")
 
         print(f"Processing {i + 1}/{N}")
         try:
             download_time = 0
             current_time = time.time()
+            if not renew_lease(co, pano_id, WORKER_ID, LEASE_SECONDS):
+                print(f"{pano_id}\tLease lost to another worker, skipping...")
+                continue
             print(f"{pano_id}\tDownloading")
             add_one_to_download_count(pano_id, co)
 
             try:
-                panorama_pil_image = get_streetview_image_with_timeout(pano_id)
+                panorama_pil_image, panorama_crop = download_panorama_with_timeout(
+                    pano_id,
+                    perspectives,
+                    CROP_PANORAMA,
+                    ADAPTIVE_ZOOM,
+                    PANORAMA_CACHE,
+                )
             except TimeoutError:
                 print(f"{pano_id}\tDownload timed out after 5 seconds, skipping...")
                 continue
@@ -209,6 +439,10 @@ def start_process(co, ocr_engine, duplication_detection_engine, perspectives):
                 perspectives,
                 ocr_engine,
                 duplication_detection_engine,
+                plan_dir=PLAN_DIR,
+                e2p_workers=E2P_WORKERS,
+                panorama_crop=panorama_crop,
+                text_prefilter=TEXT_PREFILTER,
             )
 
             insert_ocr_result(co, result)
@@ -230,18 +464,91 @@ def start_process(co, ocr_engine, duplication_detection_engine, perspectives):
             print(f"UUID / {UNIQUE_ID}")
 
 
-if __name__ == "__main__":
-    print("Setting up database")
-    setup_database(DATABASE_PATH)
+def start_pipeline_process(
+    co, ocr_engine, duplication_detection_engine, perspectives
+):
+    N = 100
+
+    pano_ids = claim_panoramas(co, N)
+    if len(pano_ids) == 0:
+        return
+
+    queue_depths = parse_queue_depths(QUEUE_DEPTH)
+    config = PipelineConfig(
+        download_workers=DOWNLOAD_WORKERS,
+        e2p_workers=PIPELINE_E2P_WORKERS,
+        e2p_threads=E2P_WORKERS,
+        download_queue_depth=queue_depths["download"],
+        e2p_queue_depth=queue_depths["e2p"],
+        ocr_queue_depth=queue_depths["ocr"],
+        duplication_queue_depth=queue_depths["dup"],
+        writer_queue_depth=queue_depths["write"],
+        plan_dir=PLAN_DIR,
+        worker_id=WORKER_ID,
+        lease_seconds=LEASE_SECONDS,
+    )
+
+    def on_result(result):
+        if isinstance(ocr_engine, po.CachedOCREngine):
+            print(f"{result.panorama_id}\tOCR cache: {ocr_engine.report()}")
+        if SAVE_RESULT:
+            result.save_to_dir("./temp")
+
+    pipeline = OCRPipeline(
+        DATABASE_PATH,
+        lambda pano_id: download_panorama(
+            pano_id, perspectives, CROP_PANORAMA, ADAPTIVE_ZOOM, PANORAMA_CACHE
+        ),
+        perspectives,
+        ocr_engine,
+        duplication_detection_engine,
+        config=config,
+        on_result=on_result,
+        text_prefilter=TEXT_PREFILTER,
+    )
+    pipeline.run(pano_ids)
+
+
+def run_worker(worker_index: int):
+    global WORKER_ID, PANORAMA_CACHE, TEXT_PREFILTER, WORKER_CPU_AFFINITY
+
+    # Unique across processes, so each lease belongs to exactly one worker
+    WORKER_ID = f"{UNIQUE_ID}/{worker_index}/{os.getpid()}"
+    print(f"Starting worker {WORKER_ID}")
+    if PIN_WORKERS:
+        WORKER_CPU_AFFINITY = po.partition_cpus(WORKERS)[worker_index]
+        print(f"Worker {worker_index} pinned to CPUs {WORKER_CPU_AFFINITY}")
 
     print("Connecting to database")
-    CONNECTION = sqlite3.connect(DATABASE_PATH)
+    connection = sqlite3.connect(DATABASE_PATH, timeout=DATABASE_TIMEOUT_SECONDS)
+    PANORAMA_CACHE = create_panorama_cache()
+    TEXT_PREFILTER = create_text_prefilter()
     try:
-        main(CONNECTION)
+        main(connection)
     finally:
         print("Closing database connection")
-        CONNECTION.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    print("Setting up database")
+    setup_database(DATABASE_PATH)
 
+    try:
+        if WORKERS <= 1:
+            run_worker(0)
+        else:
+            # Each process loads its own OCR engine, the database is the only
+            # thing they share
+            processes = [
+                multiprocessing.Process(target=run_worker, args=(worker_index,))
+                for worker_index in range(WORKERS)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+    finally:
         print("Removing temp directory")
         if os.name == "nt":
             os.system(f"rmdir /s /q {TEMP_DIR}")
@@ -0,0 +1,72 @@
+import os
+import time
+import sqlite3
+import argparse
+from dotenv import load_dotenv
+from util.sign_entities import (
+    SignEntityClusterer,
+    setup_sign_entity_tables,
+    load_ocr_hits,
+    replace_sign_entities,
+    MAX_SIGN_DISTANCE_METER,
+    TEXT_SIMILARITY_THRESHOLD,
+    MIN_TEXT_LENGTH,
+)
+
+load_dotenv()
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "gsv.db")
+
+parser = argparse.ArgumentParser(
+    description="Cluster the OCR results of neighbouring panoramas into sign entities, so search returns one row per physical sign"
+)
+parser.add_argument(
+    "--max-sign-distance",
+    type=float,
+    default=MAX_SIGN_DISTANCE_METER,
+    help="Maximum distance in meters between a panorama and the signs it reads",
+)
+parser.add_argument(
+    "--text-similarity",
+    type=float,
+    default=TEXT_SIMILARITY_THRESHOLD,
+    help="Minimum Levenshtein similarity of two texts to be the same sign",
+)
+parser.add_argument(
+    "--min-text-length",
+    type=int,
+    default=MIN_TEXT_LENGTH,
+    help="Shorter texts are never linked across panoramas",
+)
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DATABASE_PATH)
+    setup_sign_entity_tables(conn)
+
+    begin_time = time.time()
+    hits = load_ocr_hits(conn)
+    print(f"Loaded {len(hits):,} OCR results in {time.time() - begin_time:.2f}s")
+
+    clusterer = SignEntityClusterer(
+        max_sign_distance=args.max_sign_distance,
+        text_similarity_threshold=args.text_similarity,
+        min_text_length=args.min_text_length,
+    )
+
+    begin_time = time.time()
+    entities = clusterer.cluster(hits)
+    print(
+        f"Clustered into {len(entities):,} sign entities in {time.time() - begin_time:.2f}s"
+    )
+
+    located = sum(1 for entity in entities if entity.lat is not None)
+    print(f"Entities seen from several panoramas: {located:,}")
+
+    begin_time = time.time()
+    replace_sign_entities(conn, entities)
+    print(f"Saved sign entities in {time.time() - begin_time:.2f}s")
+
+    conn.close()
@@ -0,0 +1,162 @@
+"""
+Batch-fetch latency of the "not yet done" queries, ORDER BY RANDOM() versus the
+partial-index cursors used by 1b, 1c and util/db_operations.py.
+
+    python -m benchmarks.batch_selection --rows 1000000,10000000
+"""
+
+import io
+import os
+import time
+import random
+import string
+import sqlite3
+import argparse
+import tempfile
+import importlib
+import statistics
+import contextlib
+from util.db_operations import (
+    setup_database,
+    get_n_pano_id_without_ocr,
+    claim_pano_ids_without_ocr,
+    WITHOUT_OCR,
+)
+
+# 1c checks for its API key on import, the benchmark never calls the API
+os.environ.setdefault("GOOGLE_MAP_API_KEY", "benchmark")
+search_panorama = importlib.import_module("1b-search-panorama")
+search_date_and_copyright = importlib.import_module("1c-search-date-and-copyright")
+
+parser = argparse.ArgumentParser(description="Benchmark batch selection queries")
+parser.add_argument(
+    "--rows",
+    default="1000000,10000000",
+    help="Comma separated table sizes to benchmark",
+)
+parser.add_argument("--batch-size", type=int, default=100, help="Rows per batch")
+parser.add_argument(
+    "--done-ratio",
+    type=float,
+    default=0.5,
+    help="Fraction of the rows already processed",
+)
+parser.add_argument("--repeat", type=int, default=5, help="Batches per measurement")
+parser.add_argument(
+    "--skip-random",
+    action="store_true",
+    help="Skip the ORDER BY RANDOM() baseline, which is slow on large tables",
+)
+args = parser.parse_args()
+
+PANO_ID_ALPHABET = string.ascii_letters + string.digits + "-_"
+
+
+def create_database(path: str, rows: int, done_ratio: float):
+    # The tables and indexes of the scripts, which read and write DB_PATH
+    search_panorama.DB_PATH = path
+    search_date_and_copyright.DB_PATH = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        search_panorama.setup_database()
+        search_date_and_copyright.setup_database()
+
+    conn = sqlite3.connect(path)
+    rng = random.Random(0)
+    conn.executemany(
+        "INSERT INTO sample_coords (lat, lon, label, searched) VALUES (?, ?, ?, ?)",
+        (
+            (40 + i * 1e-6, -74 + i * 1e-6, "bench", rng.random() < done_ratio)
+            for i in range(rows)
+        ),
+    )
+
+    def panoramas():
+        for i in range(rows):
+            pano_id = "".join(rng.choice(PANO_ID_ALPHABET) for _ in range(22))
+            done = rng.random() < done_ratio
+            yield (
+                pano_id,
+                40.0,
+                -74.0,
+                "2024-01" if done else None,
+                "Google" if done else None,
+                0.0,
+                0.0,
+                0.0,
+                done,
+                0,
+            )
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO search_panoramas (pano_id, lat, lon, date, copyright, heading, pitch, roll, computed_ocr, download_attempted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        panoramas(),
+    )
+    conn.commit()
+    conn.close()
+
+    setup_database(path)
+
+
+def measure(function, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        # 1b and 1c print the size of each batch
+        with contextlib.redirect_stdout(io.StringIO()):
+            begin_time = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - begin_time)
+    return statistics.median(durations) * 1000
+
+
+if __name__ == "__main__":
+    batch_size = args.batch_size
+
+    for rows in [int(r) for r in args.rows.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.db")
+            print(f"Creating database with {rows} rows")
+            begin_time = time.time()
+            create_database(path, rows, args.done_ratio)
+            print(f"Created in {time.time() - begin_time:.1f}s")
+
+            conn = sqlite3.connect(path)
+            benchmarks = {
+                "1b unsearched coords": (
+                    lambda: conn.execute(
+                        "SELECT id, lat, lon, label, searched FROM sample_coords WHERE searched = 0 ORDER BY RANDOM() LIMIT ?",
+                        [batch_size],
+                    ).fetchall(),
+                    lambda: search_panorama.get_unsearched_coords(batch_size),
+                ),
+                "1c missing metadata": (
+                    lambda: conn.execute(
+                        f"SELECT pano_id FROM search_panoramas WHERE {search_date_and_copyright.WITHOUT_DATE_AND_COPYRIGHT} ORDER BY RANDOM() LIMIT ?",
+                        [batch_size],
+                    ).fetchall(),
+                    lambda: search_date_and_copyright.get_panoramas_without_date_and_copyright(
+                        batch_size
+                    ),
+                ),
+                "2 without ocr": (
+                    lambda: conn.execute(
+                        f"SELECT pano_id FROM search_panoramas WHERE {WITHOUT_OCR} ORDER BY RANDOM() LIMIT ?",
+                        [batch_size],
+                    ).fetchall(),
+                    lambda: get_n_pano_id_without_ocr(conn, batch_size),
+                ),
+                "2 claim (lease)": (
+                    None,
+                    lambda: claim_pano_ids_without_ocr(conn, "bench", batch_size),
+                ),
+            }
+
+            print(f"rows={rows} batch={batch_size} (median ms of {args.repeat})")
+            print("query\t\t\tRANDOM()\tcursor")
+            for name, (random_query, cursor_query) in benchmarks.items():
+                if random_query is None or args.skip_random:
+                    random_ms = "-"
+                else:
+                    random_ms = f"{measure(random_query, args.repeat):.1f}"
+                cursor_ms = measure(cursor_query, args.repeat)
+                print(f"{name:<24}{random_ms}\t\t{cursor_ms:.2f}")
+            conn.close()
@@ -0,0 +1,163 @@
+"""
+Text similarity used by the duplication detection, textdistance versus
+panoocr.ocr.text_similarity, on OCR output.
+
+Texts are read from the ocr_result table of the database (DATABASE_PATH), or
+from the *_ocr.json files saved by 2-pano-ocr.py --save-result.
+
+    python -m benchmarks.text_similarity --texts 1000
+    python -m benchmarks.text_similarity --json-dir ./temp
+"""
+
+import os
+import glob
+import json
+import time
+import random
+import sqlite3
+import argparse
+import textdistance
+from dotenv import load_dotenv
+from panoocr.ocr.text_similarity import (
+    encode_text,
+    get_text_similarity,
+    get_text_overlap,
+    get_similarity_matrices,
+)
+
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Benchmark text similarity")
+parser.add_argument("--texts", type=int, default=500, help="Number of texts to sample")
+parser.add_argument(
+    "--json-dir", default=None, help="Read texts from *_ocr.json files instead"
+)
+args = parser.parse_args()
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "gsv.db")
+
+# Used when no OCR output is available
+SAMPLE_TEXTS = [
+    "PIZZA",
+    "PIZZ",
+    "FAMOUS PIZZA",
+    "DELI",
+    "DELI & GROCERY",
+    "GROCERY",
+    "ONE WAY",
+    "ONEWAY",
+    "NO PARKING",
+    "NO PARKING ANYTIME",
+    "BUS STOP",
+    "PHARMACY",
+    "PHARMAC",
+    "BANK OF AMERICA",
+    "CHASE",
+    "OPEN 24 HOURS",
+    "OPEN",
+    "W 42 ST",
+    "BROADWAY",
+    "Broadway",
+    "STOP",
+    "LAUNDROMAT",
+    "NAILS & SPA",
+    "HAIR SALON",
+    "LIQUORS",
+    "WINE & LIQUORS",
+    "FOR RENT",
+    "212-555-0199",
+    "Dunkin'",
+    "DUNKIN",
+    "Starbucks",
+    "STARBUCKS COFFEE",
+]
+
+
+def load_texts(count: int) -> list[str]:
+    texts = []
+    if args.json_dir is not None:
+        for path in glob.glob(os.path.join(args.json_dir, "*_ocr.json")):
+            with open(path) as f:
+                texts.extend(result["text"] for result in json.load(f))
+    elif os.path.exists(DATABASE_PATH):
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            texts = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT text FROM ocr_result LIMIT ?", [count * 10]
+                ).fetchall()
+            ]
+        except sqlite3.OperationalError:
+            texts = []
+        conn.close()
+
+    if len(texts) == 0:
+        print("No OCR output found, using sample texts")
+        texts = SAMPLE_TEXTS
+
+    rng = random.Random(0)
+    return [rng.choice(texts) for _ in range(count)]
+
+
+def measure(function) -> float:
+    begin_time = time.perf_counter()
+    function()
+    return time.perf_counter() - begin_time
+
+
+if __name__ == "__main__":
+    texts = load_texts(args.texts)
+    pairs = len(texts) ** 2
+    print(f"{len(texts)} texts, {pairs} pairs")
+
+    def textdistance_path():
+        for text_1 in texts:
+            for text_2 in texts:
+                textdistance.levenshtein.normalized_similarity(text_1, text_2)
+                textdistance.overlap.normalized_similarity(text_1, text_2)
+
+    def pairwise_path():
+        for text_1 in texts:
+            for text_2 in texts:
+                get_text_similarity(text_1, text_2)
+                get_text_overlap(text_1, text_2)
+
+    def matrix_path():
+        get_similarity_matrices(texts, texts)
+
+    results = {}
+    for name, function in [
+        ("textdistance", textdistance_path),
+        ("text_similarity (pairs)", pairwise_path),
+        ("text_similarity (matrix)", matrix_path),
+    ]:
+        encode_text.cache_clear()
+        results[name] = measure(function)
+
+    baseline = results["textdistance"]
+    print("path\t\t\t\ttotal (s)\tper pair (us)\tspeedup")
+    for name, duration in results.items():
+        print(
+            f"{name:<32}{duration:.3f}\t\t{duration / pairs * 1e6:.2f}\t\t{baseline / duration:.1f}x"
+        )
+
+    # Same values as textdistance
+    similarity, overlap = get_similarity_matrices(texts[:100], texts[:100])
+    for i, text_1 in enumerate(texts[:100]):
+        for j, text_2 in enumerate(texts[:100]):
+            assert (
+                abs(
+                    similarity[i, j]
+                    - textdistance.levenshtein.normalized_similarity(text_1, text_2)
+                )
+                < 1e-12
+            )
+            assert (
+                abs(
+                    overlap[i, j]
+                    - textdistance.overlap.normalized_similarity(text_1, text_2)
+                )
+                < 1e-12
+            )
+    print("Results match textdistance")
@@ -0,0 +1,186 @@
+"""
+OCR throughput of a machine for splits of its cores into worker processes and
+threads per worker, to pick --workers, --threads and --pin-workers for
+2-pano-ocr.py.
+
+Each worker is a fresh process started with the thread variables of its
+share of the cores, so OpenMP and BLAS size their pools before numpy is
+imported, and loads its own engine pinned to those cores. Then all workers
+recognize the same perspective images at once. Images are read from
+--image-dir (e.g. perspectives saved while debugging), or rendered signs.
+
+    python -m benchmarks.thread_split --ocr-engine onnx --workers 1,2,4,8
+    python -m benchmarks.thread_split --ocr-engine paddleocr --threads 2,4 --no-pin
+"""
+
+import os
+import glob
+import time
+import argparse
+import multiprocessing
+from PIL import Image, ImageDraw, ImageFont
+import panoocr as po
+from panoocr.ocr.threads import THREAD_ENVIRONMENT_VARIABLES
+from util.ocr_engines import OCR_ENGINE_NAMES, get_ocr_engine_config
+
+parser = argparse.ArgumentParser(description="Benchmark workers x threads splits")
+parser.add_argument(
+    "--ocr-engine",
+    choices=[name for name in OCR_ENGINE_NAMES if name != "remote"],
+    default="onnx",
+    help="Choose OCR engine",
+)
+parser.add_argument(
+    "--workers",
+    default="1,2,4",
+    help="Comma separated worker counts to benchmark",
+)
+parser.add_argument(
+    "--threads",
+    default=None,
+    help="Comma separated threads per worker, defaults to the cores of each worker",
+)
+parser.add_argument(
+    "--no-pin",
+    action="store_true",
+    help="Don't pin the workers to their share of the cores",
+)
+parser.add_argument(
+    "--images", type=int, default=32, help="Images recognized by each worker"
+)
+parser.add_argument(
+    "--image-dir", default=None, help="Read *.jpg and *.png images from this directory"
+)
+parser.add_argument(
+    "--onnx-model-dir",
+    default=None,
+    help="Directory with the det.onnx, rec.onnx and dict.txt of the onnx engine, defaults to onnx/ in --model-root",
+)
+args = parser.parse_args()
+
+# Same size as the default perspectives, with text of the same height as on
+# the 1000px images the texts were laid out for
+SAMPLE_PERSPECTIVE = po.DEFAULT_IMAGE_PERSPECTIVES[0]
+SAMPLE_IMAGE_SIZE = (SAMPLE_PERSPECTIVE.pixel_width, SAMPLE_PERSPECTIVE.pixel_height)
+SAMPLE_SCALE = SAMPLE_IMAGE_SIZE[1] / 1000
+SAMPLE_TEXTS = ["OPEN 24 HOURS", "PHARMACY", "NO PARKING", "Main St", "CAFE & BAR"]
+
+
+def load_images(count: int):
+    if args.image_dir is not None:
+        paths = sorted(
+            glob.glob(os.path.join(args.image_dir, "*.jpg"))
+            + glob.glob(os.path.join(args.image_dir, "*.png"))
+        )
+        if len(paths) == 0:
+            raise ValueError(f"No images in {args.image_dir}")
+        return [Image.open(paths[i % len(paths)]).convert("RGB") for i in range(count)]
+
+    font = ImageFont.load_default(size=round(48 * SAMPLE_SCALE))
+    images = []
+    for i in range(count):
+        image = Image.new("RGB", SAMPLE_IMAGE_SIZE, (120 + i % 50, 130, 140))
+        draw = ImageDraw.Draw(image)
+        for j, text in enumerate(SAMPLE_TEXTS):
+            position = (80 + 40 * (i % 5), 100 + 160 * j)
+            draw.text(
+                tuple(round(v * SAMPLE_SCALE) for v in position),
+                text,
+                fill=0,
+                font=font,
+            )
+        po.set_image_fov(
+            image, SAMPLE_PERSPECTIVE.horizontal_fov, SAMPLE_PERSPECTIVE.vertical_fov
+        )
+        images.append(image)
+    return images
+
+
+def run_worker(threads, cpu_affinity, barrier, results):
+    ocr_engine_type, ocr_engine_config = get_ocr_engine_config(
+        args.ocr_engine,
+        onnx_model_dir=args.onnx_model_dir,
+        threads=threads,
+        cpu_affinity=cpu_affinity,
+    )
+    ocr_engine = po.create_ocr_engine(ocr_engine_type, ocr_engine_config)
+    images = load_images(args.images)
+    ocr_engine.warmup()
+
+    barrier.wait()
+    for begin in range(0, len(images), ocr_engine.preferred_batch_size):
+        ocr_engine.recognize_batch(
+            images[begin : begin + ocr_engine.preferred_batch_size]
+        )
+    results.put(time.time())
+
+
+def start_with_thread_environment(process: multiprocessing.Process, threads: int):
+    """Start a spawned process with the thread variables set for its imports"""
+    environment = {
+        variable: os.environ.get(variable)
+        for variable in THREAD_ENVIRONMENT_VARIABLES
+    }
+    try:
+        for variable in environment:
+            os.environ[variable] = str(threads)
+        process.start()
+    finally:
+        for variable, value in environment.items():
+            if value is None:
+                del os.environ[variable]
+            else:
+                os.environ[variable] = value
+
+
+def measure(workers: int, threads: int | None) -> float:
+    """Returns the images per second of all the workers together"""
+    partitions = po.partition_cpus(workers)
+    # Forked workers would inherit the pools numpy already started here
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = []
+    for i in range(workers):
+        worker_threads = threads or len(partitions[i])
+        process = context.Process(
+            target=run_worker,
+            args=(
+                worker_threads,
+                None if args.no_pin else partitions[i],
+                barrier,
+                results,
+            ),
+        )
+        start_with_thread_environment(process, worker_threads)
+        processes.append(process)
+
+    barrier.wait()
+    begin_time = time.time()
+    end_time = max(results.get() for _ in range(workers))
+    for process in processes:
+        process.join()
+    return workers * args.images / (end_time - begin_time)
+
+
+if __name__ == "__main__":
+    cpus = po.get_available_cpus()
+    print(f"{len(cpus)} CPUs, {args.ocr_engine}, {args.images} images per worker")
+
+    thread_counts = (
+        [None] if args.threads is None else [int(t) for t in args.threads.split(",")]
+    )
+    measurements = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        for threads in thread_counts:
+            threads_per_worker = threads or len(po.partition_cpus(workers)[0])
+            images_per_second = measure(workers, threads)
+            measurements.append((images_per_second, workers, threads_per_worker))
+            print(
+                f"workers {workers}\tthreads {threads_per_worker}\t{images_per_second:.2f} images/sec"
+            )
+
+    images_per_second, workers, threads = max(measurements)
+    print(
+        f"Best: --workers {workers} --threads {threads}{'' if args.no_pin else ' --pin-workers'} ({images_per_second:.2f} images/sec)"
+    )
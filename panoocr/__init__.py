@@ -1,6 +1,24 @@
 __version__ = "0.0.1"
 
-from .image.models import PanoramaImage, PerspectiveImage, PerspectiveMetadata
+from .image.models import (
+    PanoramaImage,
+    PerspectiveImage,
+    PerspectiveMetadata,
+    PerspectivePlan,
+    PanoramaCrop,
+)
+from .image.coverage import (
+    get_sampled_pitch_range,
+    get_tile_crop,
+    get_required_pixels_per_degree,
+    get_required_panorama_width,
+)
+from .image.plan import (
+    get_perspective_plans,
+    save_perspective_plan,
+    load_perspective_plan,
+)
+from .image.e2p import set_remap_cache_max_bytes
 from .image.constants import (
     DEFAULT_IMAGE_PERSPECTIVES,
     ZOOMED_IN_IMAGE_PERSPECTIVES,
@@ -9,12 +27,28 @@ from .image.constants import (
 )
 
 from .ocr.models import FlatOCRResult, SphereOCRResult
-from .ocr.engine import OCREngine
+from .ocr.batch import (
+    SphereOCRBatch,
+    SphereOCRRecord,
+    flat_ocr_results_to_sphere,
+    flat_ocr_results_to_sphere_for_each_perspective,
+)
+from .ocr.engine import OCREngine, set_image_fov, get_image_fov
+from .ocr.threads import ThreadConfig, partition_cpus, get_available_cpus
+from .ocr.model_store import ModelStore, ModelArtifact
+from .ocr.prefilter import TextPresencePrefilter, TextPresenceMethod
 from .ocr.engines.macocr_engine import (
     MacOCRLanguageCode,
     MacOCRRecognitionLevel,
 )
 
+from .ocr.engines.florence2_engine import Florence2PerformanceProfile
+
+from .ocr.engines.onnx_engine import ONNXGraphOptimizationLevel
+from .ocr.engines.cached_engine import CachedOCREngine
+from .ocr.engines.remote_engine import RemoteOCREngine
+from .ocr.inference_server import OCRInferenceServer
+
 from .ocr.engines.paddleocr_engine import (
     PaddleOCREngine,
     PaddleOCRLanguageCode,
@@ -33,4 +67,7 @@ from .ocr.utils import (
     visualize_sphere_ocr_results,
 )
 
-from .ocr.duplication_detection import SphereOCRDuplicationDetectionEngine
+from .ocr.duplication_detection import (
+    SphereOCRDuplicationDetectionEngine,
+    IntersectionMode,
+)
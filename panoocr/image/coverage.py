@@ -0,0 +1,124 @@
+import math
+import numpy as np
+from typing import List, Tuple
+
+from . import utils
+from .models import PerspectiveMetadata, PanoramaCrop
+
+COVERAGE_GRID_SIZE = 65
+DEFAULT_PITCH_MARGIN = 1.0
+
+
+def get_sampled_pitch_range(
+    perspectives: List[PerspectiveMetadata],
+    margin: float = DEFAULT_PITCH_MARGIN,
+) -> Tuple[float, float]:
+    """
+    Get the range of pitch (in degrees) of the equirectangular image that is
+    sampled by e2p for a list of perspectives.
+
+    The rays of each perspective are evaluated on a coarse grid covering its
+    edges, the same way `e2p.compute_remap_maps` evaluates every pixel.
+
+    Returns:
+        Tuple[float, float]: (min_pitch, max_pitch), widened by `margin`
+    """
+    if len(perspectives) == 0:
+        raise ValueError("At least one perspective is required")
+
+    min_pitch = 90.0
+    max_pitch = -90.0
+
+    for perspective in perspectives:
+        xyz = utils.xyzpers(
+            np.deg2rad(perspective.horizontal_fov),
+            np.deg2rad(perspective.vertical_fov),
+            -np.deg2rad(perspective.yaw_offset),
+            np.deg2rad(perspective.pitch_offset),
+            (COVERAGE_GRID_SIZE, COVERAGE_GRID_SIZE),
+            0,
+        )
+        v = np.rad2deg(utils.xyz2uv(xyz)[..., 1])
+        min_pitch = min(min_pitch, float(v.min()))
+        max_pitch = max(max_pitch, float(v.max()))
+
+    return max(min_pitch - margin, -90.0), min(max_pitch + margin, 90.0)
+
+
+def pitch_range_to_rows(
+    pitch_range: Tuple[float, float], full_height: int
+) -> Tuple[int, int]:
+    """
+    Convert a pitch range to the band of rows [top, bottom) of an equirectangular
+    image of height `full_height`, using the same mapping as `utils.uv2coor`.
+    One extra row is kept on each side for bilinear interpolation.
+    """
+    min_pitch, max_pitch = pitch_range
+    top = math.floor((0.5 - max_pitch / 180) * (full_height - 1)) - 1
+    bottom = math.ceil((0.5 - min_pitch / 180) * (full_height - 1)) + 2
+    return max(top, 0), min(bottom, full_height)
+
+
+def get_tile_rows(
+    pitch_range: Tuple[float, float], full_height: int, tile_height: int
+) -> Tuple[int, int]:
+    """
+    Get the tile rows [first, last] covering a pitch range of an equirectangular
+    image made of tiles of height `tile_height`.
+    """
+    top, bottom = pitch_range_to_rows(pitch_range, full_height)
+    return top // tile_height, (bottom - 1) // tile_height
+
+
+def get_tile_crop(
+    pitch_range: Tuple[float, float],
+    full_width: int,
+    full_height: int,
+    tile_height: int,
+) -> PanoramaCrop:
+    """
+    Get the crop of a panorama stitched from whole tile rows covering a pitch range.
+    """
+    first_row, last_row = get_tile_rows(pitch_range, full_height, tile_height)
+    return PanoramaCrop(
+        full_width=full_width,
+        full_height=full_height,
+        top=first_row * tile_height,
+        bottom=min((last_row + 1) * tile_height, full_height),
+    )
+
+
+def get_required_pixels_per_degree(perspectives: List[PerspectiveMetadata]) -> float:
+    """
+    Get the angular resolution (pixels per degree) an equirectangular image must
+    have so that e2p does not upsample any of the perspectives.
+
+    The densest part of a perspective is its center, where one degree spans
+    `pixel_width / (2 * tan(horizontal_fov / 2))` pixels per radian.
+    """
+    if len(perspectives) == 0:
+        raise ValueError("At least one perspective is required")
+
+    pixels_per_radian = 0.0
+    for perspective in perspectives:
+        horizontal = perspective.pixel_width / (
+            2 * math.tan(math.radians(perspective.horizontal_fov) / 2)
+        )
+        vertical = perspective.pixel_height / (
+            2 * math.tan(math.radians(perspective.vertical_fov) / 2)
+        )
+        pixels_per_radian = max(pixels_per_radian, horizontal, vertical)
+
+    return pixels_per_radian * math.pi / 180
+
+
+def get_required_panorama_width(
+    perspectives: List[PerspectiveMetadata], resolution_ratio: float = 1.0
+) -> int:
+    """
+    Get the smallest equirectangular width (covering 360 degrees) that meets
+    `resolution_ratio` times the resolution required by the perspectives.
+    """
+    return math.ceil(
+        get_required_pixels_per_degree(perspectives) * 360 * resolution_ratio
+    )
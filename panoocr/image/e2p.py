@@ -1,19 +1,104 @@
 import numpy as np
 import cv2
+import threading
+from collections import OrderedDict
 
 from . import utils
 
 
-def e2p(e_img, fov_deg, u_deg, v_deg, out_hw, in_rot_deg=0, mode="bilinear"):
+DEFAULT_REMAP_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class RemapCache:
     """
-    e_img:   ndarray in shape of [H, W, C]
-    fov_deg: scalar or (scalar, scalar) field of view in degrees
-    u_deg:   horizontal viewing angle in range [-180, 180]
-    v_deg:   vertical viewing angle in range [-90, 90]
+    A process-wide LRU cache of the remap grids used by `e2p`.
+
+    The grids only depend on the projection parameters and the size of the
+    equirectangular image, so they can be reused for every panorama of the same
+    resolution. The cache is bounded by the total number of bytes of the stored
+    maps and evicts the least recently used entries first.
     """
-    assert e_img.ndim == 3, "Input image must have shape [H, W, C]"
-    h, w = e_img.shape[:2]
 
+    max_bytes: int
+    current_bytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = DEFAULT_REMAP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            maps = self._entries.get(key)
+            if maps is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return maps
+
+    def put(self, key, maps):
+        size = sum(m.nbytes for m in maps)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            # maps larger than the whole cache are not worth keeping
+            if size > self.max_bytes:
+                return
+            self._entries[key] = maps
+            self.current_bytes += size
+            self.__evict()
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted_maps = self._entries.popitem(last=False)
+            self.current_bytes -= sum(m.nbytes for m in evicted_maps)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+REMAP_CACHE = RemapCache()
+
+
+def set_remap_cache_max_bytes(max_bytes: int):
+    """Set the memory budget of the process-wide remap cache. 0 disables caching."""
+    REMAP_CACHE.set_max_bytes(max_bytes)
+
+
+def get_interpolation(mode):
+    if mode == "bilinear":
+        return cv2.INTER_LINEAR
+    elif mode == "nearest":
+        return cv2.INTER_NEAREST
+    else:
+        raise NotImplementedError("Unknown mode: {}".format(mode))
+
+
+def compute_remap_maps(h, w, fov_deg, u_deg, v_deg, out_hw, in_rot_deg=0, top=0):
+    """
+    Compute the float32 `map_x`, `map_y` used by `cv2.remap` to sample a
+    perspective view from an equirectangular image of size [h, w].
+
+    top: first row of the full equirectangular image that is present in the
+         image being sampled, for panoramas cropped to the rows in use
+    """
     # Convert degrees to radians
     try:
         h_fov = np.deg2rad(fov_deg[0])
@@ -22,14 +107,6 @@ def e2p(e_img, fov_deg, u_deg, v_deg, out_hw, in_rot_deg=0, mode="bilinear"):
         h_fov = v_fov = np.deg2rad(fov_deg)
     in_rot = np.deg2rad(in_rot_deg)
 
-    # Set interpolation mode
-    if mode == "bilinear":
-        interpolation = cv2.INTER_LINEAR
-    elif mode == "nearest":
-        interpolation = cv2.INTER_NEAREST
-    else:
-        raise NotImplementedError("Unknown mode: {}".format(mode))
-
     # Compute viewing angles in radians
     u = -np.deg2rad(u_deg)
     v = np.deg2rad(v_deg)
@@ -44,8 +121,77 @@ def e2p(e_img, fov_deg, u_deg, v_deg, out_hw, in_rot_deg=0, mode="bilinear"):
     coor_xy = utils.uv2coor(uv, h, w)
 
     # Adjust coordinates for OpenCV (requires float32)
-    map_x = coor_xy[..., 0].astype(np.float32)
-    map_y = coor_xy[..., 1].astype(np.float32)
+    map_x = np.ascontiguousarray(coor_xy[..., 0], dtype=np.float32)
+    map_y = np.ascontiguousarray(coor_xy[..., 1], dtype=np.float32)
+    if top:
+        map_y -= top
+
+    return map_x, map_y
+
+
+def get_remap_maps(
+    h, w, fov_deg, u_deg, v_deg, out_hw, in_rot_deg=0, mode="bilinear", top=0
+):
+    """
+    Same as `compute_remap_maps`, but served from the process-wide `REMAP_CACHE`.
+    """
+    try:
+        fov_key = (float(fov_deg[0]), float(fov_deg[1]))
+    except TypeError:
+        fov_key = (float(fov_deg), float(fov_deg))
+
+    key = (
+        h,
+        w,
+        fov_key,
+        float(u_deg),
+        float(v_deg),
+        tuple(out_hw),
+        float(in_rot_deg),
+        mode,
+        top,
+    )
+
+    maps = REMAP_CACHE.get(key)
+    if maps is None:
+        maps = compute_remap_maps(
+            h, w, fov_deg, u_deg, v_deg, out_hw, in_rot_deg, top
+        )
+        REMAP_CACHE.put(key, maps)
+    return maps
+
+
+def e2p(
+    e_img,
+    fov_deg,
+    u_deg,
+    v_deg,
+    out_hw,
+    in_rot_deg=0,
+    mode="bilinear",
+    full_hw=None,
+    top=0,
+):
+    """
+    e_img:   ndarray in shape of [H, W, C]
+    fov_deg: scalar or (scalar, scalar) field of view in degrees
+    u_deg:   horizontal viewing angle in range [-180, 180]
+    v_deg:   vertical viewing angle in range [-90, 90]
+    full_hw: size of the full equirectangular image if e_img is a band of rows
+             of it, starting at row `top`
+    """
+    assert e_img.ndim == 3, "Input image must have shape [H, W, C]"
+    if full_hw is None:
+        h, w = e_img.shape[:2]
+    else:
+        h, w = full_hw
+
+    # Set interpolation mode
+    interpolation = get_interpolation(mode)
+
+    map_x, map_y = get_remap_maps(
+        h, w, fov_deg, u_deg, v_deg, out_hw, in_rot_deg, mode, top
+    )
 
     # Use OpenCV's remap function for efficient sampling
     pers_img = cv2.remap(e_img, map_x, map_y, interpolation, borderMode=cv2.BORDER_WRAP)
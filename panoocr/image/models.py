@@ -1,7 +1,11 @@
+import os
+import threading
 import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor, Future
 from dataclasses import dataclass
 from PIL import Image
-from typing import List, Any, Union, Optional
+from typing import List, Any, Union, Optional, Iterator
 from . import e2p
 
 
@@ -21,26 +25,184 @@ class PerspectiveMetadata:
         return f"{self.pixel_width}_{self.pixel_height}_{self.horizontal_fov}_{self.vertical_fov}_{self.yaw_offset}_{self.pitch_offset}"
 
 
+@dataclass(frozen=True)
+class PanoramaCrop:
+    """
+    Describes a panorama that only contains the rows [top, bottom) of the full
+    equirectangular image, e.g. when the sky and ground tiles were not downloaded.
+    """
+
+    full_width: int
+    full_height: int
+    top: int
+    bottom: int
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+    def to_file_suffix(self):
+        return f"{self.top}-{self.bottom}"
+
+
+class PerspectivePlan:
+    """
+    Precomputed e2p projection of one perspective for a given panorama size.
+
+    The remap grids are converted once into OpenCV fixed-point maps
+    (`CV_16SC2` coordinates + `CV_16UC1` interpolation table), which are more
+    compact than two float32 planes and faster to sample with `cv2.remap`.
+    """
+
+    __slots__ = (
+        "perspective_metadata",
+        "panorama_height",
+        "panorama_width",
+        "mode",
+        "crop",
+        "map1",
+        "map2",
+    )
+
+    perspective_metadata: PerspectiveMetadata
+    panorama_height: int
+    panorama_width: int
+    mode: str
+    crop: PanoramaCrop | None
+    map1: np.ndarray
+    map2: np.ndarray | None
+
+    def __init__(
+        self,
+        perspective_metadata: PerspectiveMetadata,
+        panorama_height: int,
+        panorama_width: int,
+        mode: str = "bilinear",
+        map1: np.ndarray | None = None,
+        map2: np.ndarray | None = None,
+        crop: PanoramaCrop | None = None,
+    ):
+        """
+        panorama_height, panorama_width: size of the full equirectangular image
+        crop: set if the plan samples a panorama cropped to a band of rows
+        """
+        self.perspective_metadata = perspective_metadata
+        self.panorama_height = panorama_height
+        self.panorama_width = panorama_width
+        self.mode = mode
+        self.crop = crop
+
+        if map1 is None:
+            map_x, map_y = e2p.compute_remap_maps(
+                h=panorama_height,
+                w=panorama_width,
+                fov_deg=(
+                    perspective_metadata.horizontal_fov,
+                    perspective_metadata.vertical_fov,
+                ),
+                u_deg=perspective_metadata.yaw_offset,
+                v_deg=perspective_metadata.pitch_offset,
+                out_hw=(
+                    perspective_metadata.pixel_height,
+                    perspective_metadata.pixel_width,
+                ),
+                in_rot_deg=0,
+                top=0 if crop is None else crop.top,
+            )
+            map1, map2 = cv2.convertMaps(
+                map_x,
+                map_y,
+                cv2.CV_16SC2,
+                nninterpolation=(mode == "nearest"),
+            )
+            # nearest neighbour maps have no interpolation table
+            if map2 is not None and map2.size == 0:
+                map2 = None
+
+        self.map1 = map1
+        self.map2 = map2
+
+    @property
+    def nbytes(self) -> int:
+        return self.map1.nbytes + (0 if self.map2 is None else self.map2.nbytes)
+
+    def matches(self, image_height: int, image_width: int) -> bool:
+        """Check that an image array of the given size can be sampled by this plan"""
+        expected_height = (
+            self.panorama_height if self.crop is None else self.crop.height
+        )
+        return expected_height == image_height and self.panorama_width == image_width
+
+    def remap(self, panorama_image_array: np.ndarray) -> np.ndarray:
+        h, w = panorama_image_array.shape[:2]
+        if not self.matches(h, w):
+            raise ValueError(
+                f"Plan was computed for a {self.panorama_width}x{self.panorama_height} panorama (crop: {self.crop}), got {w}x{h}"
+            )
+
+        return cv2.remap(
+            panorama_image_array,
+            self.map1,
+            self.map2,
+            e2p.get_interpolation(self.mode),
+            borderMode=cv2.BORDER_WRAP,
+        )
+
+
+def array_to_image(array: np.ndarray) -> Image.Image:
+    """
+    Wrap an image array as a PIL image, sharing the array buffer when the
+    layout allows it instead of copying the pixels. PIL stores RGB with a
+    padding byte per pixel, so only single channel and RGBA arrays can be
+    shared; other layouts are copied.
+    """
+    if array.dtype == np.uint8 and array.flags["C_CONTIGUOUS"]:
+        height, width = array.shape[:2]
+        if array.ndim == 2:
+            return Image.frombuffer("L", (width, height), array, "raw", "L", 0, 1)
+        if array.ndim == 3 and array.shape[2] == 4:
+            return Image.frombuffer(
+                "RGBA", (width, height), array, "raw", "RGBA", 0, 1
+            )
+
+    return Image.fromarray(array)
+
+
 class PerspectiveImage:
+    __slots__ = (
+        "source_panorama_image_array",
+        "panorama_id",
+        "perspective_metadata",
+        "_perspective_image_array",
+        "_perspective_image",
+    )
+
     source_panorama_image_array: np.ndarray
     panorama_id: str
     perspective_metadata: PerspectiveMetadata
 
-    perspective_image_array: np.ndarray = None
-    perspective_image: Image.Image = None
-
     def __init__(
         self,
         panorama_id: str,
         source_panorama_image_array: np.ndarray,
         perspective_metadata: PerspectiveMetadata,
+        perspective_plan: PerspectivePlan | None = None,
+        panorama_crop: PanoramaCrop | None = None,
     ):
 
         self.source_panorama_image_array = source_panorama_image_array
         self.panorama_id = panorama_id
         self.perspective_metadata = perspective_metadata
+        # The PIL image is only created when requested, see `perspective_image`
+        self._perspective_image = None
+
+        if perspective_plan is not None:
+            self._perspective_image_array = perspective_plan.remap(
+                self.source_panorama_image_array
+            )
+            return
 
-        self.perspective_image_array = e2p.e2p(
+        self._perspective_image_array = e2p.e2p(
             e_img=self.source_panorama_image_array,
             fov_deg=(
                 self.perspective_metadata.horizontal_fov,
@@ -54,9 +216,23 @@ class PerspectiveImage:
             ),
             in_rot_deg=0,
             mode="bilinear",
+            full_hw=(
+                None
+                if panorama_crop is None
+                else (panorama_crop.full_height, panorama_crop.full_width)
+            ),
+            top=0 if panorama_crop is None else panorama_crop.top,
         )
 
-        self.perspective_image = Image.fromarray(self.perspective_image_array)
+    @property
+    def perspective_image_array(self) -> np.ndarray:
+        return self._perspective_image_array
+
+    @property
+    def perspective_image(self) -> Image.Image:
+        if self._perspective_image is None:
+            self._perspective_image = array_to_image(self._perspective_image_array)
+        return self._perspective_image
 
     def get_perspective_metadata(self):
         return self.perspective_metadata
@@ -68,41 +244,148 @@ class PerspectiveImage:
         return self.perspective_image
 
 
+class PerspectiveImageSequence:
+    """
+    A sequence of perspective images that are being projected in the background.
+    Accessing an item blocks until that perspective is ready, so consumers can
+    start working on the first views while the others are still projecting.
+    """
+
+    def __init__(self, futures: List[Future]):
+        self._futures = futures
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def __getitem__(self, index: int) -> PerspectiveImage:
+        return self._futures[index].result()
+
+    def __iter__(self) -> Iterator[PerspectiveImage]:
+        for future in self._futures:
+            yield future.result()
+
+    def cancel(self) -> None:
+        for future in self._futures:
+            future.cancel()
+
+
 class PanoramaImage:
+    __slots__ = (
+        "panorama_id",
+        "crop",
+        "_loaded_image",
+        "_loaded_image_array",
+        "_conversion_lock",
+    )
+
     panorama_id: str
-    loaded_image: Image.Image | None = None
-    loaded_image_array: np.ndarray | None = None
+    crop: PanoramaCrop | None
 
     def __init__(
         self,
         panorama_id: str,
         image: Union[str, Image.Image, np.ndarray],
+        crop: PanoramaCrop | None = None,
     ):
+        """
+        crop: set if `image` only contains a band of rows of the full panorama
+        """
         self.panorama_id = panorama_id
+        self.crop = crop
+        self._loaded_image = None
+        self._loaded_image_array = None
+        self._conversion_lock = threading.Lock()
+
+        # Only keep one representation: the given one until the array is needed,
+        # then the array, since holding both doubles the memory of the panorama
         if isinstance(image, str):
-            self.loaded_image = Image.open(image)
-            self.loaded_image_array = np.array(self.loaded_image)
+            self._loaded_image = Image.open(image)
 
         elif isinstance(image, Image.Image):
-            self.loaded_image = image
-            self.loaded_image_array = np.array(self.loaded_image)
+            self._loaded_image = image
 
         elif isinstance(image, np.ndarray):
-            self.loaded_image_array = image
-            self.loaded_image = Image.fromarray(self.loaded_image_array)
+            self._loaded_image_array = image
 
         else:
             raise ValueError(
                 "Input image must be a path to an image or a PIL Image object"
             )
 
-    def generate_perspective_image(self, perspective: PerspectiveMetadata):
-        if self.loaded_image is None:
+    @property
+    def loaded_image(self) -> Image.Image | None:
+        """Once the array exists, a PIL image wrapping it, which is not kept"""
+        if self._loaded_image is None and self._loaded_image_array is not None:
+            return array_to_image(self._loaded_image_array)
+        return self._loaded_image
+
+    @property
+    def loaded_image_array(self) -> np.ndarray | None:
+        if self._loaded_image_array is None:
+            # Projections read it from several threads, convert only once
+            with self._conversion_lock:
+                if self._loaded_image_array is None and self._loaded_image is not None:
+                    # np.asarray copies the pixels out of PIL, release its copy
+                    self._loaded_image_array = np.asarray(self._loaded_image)
+                    self._loaded_image = None
+        return self._loaded_image_array
+
+    def is_loaded(self) -> bool:
+        return self._loaded_image is not None or self._loaded_image_array is not None
+
+    def generate_perspective_image(
+        self, perspective: Union[PerspectiveMetadata, PerspectivePlan]
+    ):
+        if not self.is_loaded():
             raise ValueError("Image has not been loaded")
 
+        if isinstance(perspective, PerspectivePlan):
+            if perspective.crop != self.crop:
+                raise ValueError(
+                    f"Plan was computed for crop {perspective.crop}, panorama has crop {self.crop}"
+                )
+            perspective_image = PerspectiveImage(
+                source_panorama_image_array=self.loaded_image_array,
+                panorama_id=self.panorama_id,
+                perspective_metadata=perspective.perspective_metadata,
+                perspective_plan=perspective,
+            )
+            return perspective_image
+
         perspective_image = PerspectiveImage(
             source_panorama_image_array=self.loaded_image_array,
             panorama_id=self.panorama_id,
             perspective_metadata=perspective,
+            panorama_crop=self.crop,
         )
         return perspective_image
+
+    def generate_perspective_images(
+        self,
+        perspectives: List[Union[PerspectiveMetadata, PerspectivePlan]],
+        workers: int | None = None,
+    ) -> PerspectiveImageSequence:
+        """
+        Project all perspectives concurrently on a thread pool. `cv2.remap`
+        releases the GIL, so the projections run in parallel with each other
+        and with whatever the caller does with the views that are ready.
+        """
+        if not self.is_loaded():
+            raise ValueError("Image has not been loaded")
+
+        if workers is None:
+            workers = min(len(perspectives), os.cpu_count() or 1)
+        workers = max(1, workers)
+
+        # Convert a PIL panorama before the threads share it
+        self.loaded_image_array
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [
+            executor.submit(self.generate_perspective_image, perspective)
+            for perspective in perspectives
+        ]
+        # Let the submitted projections finish; the threads exit once done
+        executor.shutdown(wait=False)
+
+        return PerspectiveImageSequence(futures)
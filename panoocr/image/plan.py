@@ -0,0 +1,155 @@
+import os
+import numpy as np
+from typing import List
+
+from .models import PerspectiveMetadata, PerspectivePlan, PanoramaCrop
+from .e2p import REMAP_CACHE
+
+
+def get_plan_file_prefix(
+    perspective: PerspectiveMetadata,
+    panorama_height: int,
+    panorama_width: int,
+    mode: str = "bilinear",
+    crop: PanoramaCrop | None = None,
+) -> str:
+    prefix = f"{panorama_width}x{panorama_height}"
+    if crop is not None:
+        prefix += f"_{crop.to_file_suffix()}"
+    return f"{prefix}_{perspective.to_file_suffix()}_{mode}"
+
+
+def save_perspective_plan(plan: PerspectivePlan, directory: str) -> None:
+    """
+    Save the fixed-point maps of a plan as `.npy` files in `directory`.
+    Files are written to a temporary name first and renamed, so concurrent
+    workers never read a half-written plan.
+    """
+    os.makedirs(directory, exist_ok=True)
+    prefix = get_plan_file_prefix(
+        plan.perspective_metadata,
+        plan.panorama_height,
+        plan.panorama_width,
+        plan.mode,
+        plan.crop,
+    )
+
+    arrays = {"map1": plan.map1}
+    if plan.map2 is not None:
+        arrays["map2"] = plan.map2
+
+    for name, array in arrays.items():
+        path = os.path.join(directory, f"{prefix}_{name}.npy")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+
+def load_perspective_plan(
+    perspective: PerspectiveMetadata,
+    panorama_height: int,
+    panorama_width: int,
+    directory: str,
+    mode: str = "bilinear",
+    crop: PanoramaCrop | None = None,
+) -> PerspectivePlan | None:
+    """
+    Load a plan saved with `save_perspective_plan`. The maps are memory-mapped,
+    so processes loading the same plan share its pages. Returns None if the
+    plan has not been saved yet.
+    """
+    prefix = get_plan_file_prefix(
+        perspective, panorama_height, panorama_width, mode, crop
+    )
+    map1_path = os.path.join(directory, f"{prefix}_map1.npy")
+    map2_path = os.path.join(directory, f"{prefix}_map2.npy")
+
+    if not os.path.exists(map1_path):
+        return None
+    if mode != "nearest" and not os.path.exists(map2_path):
+        return None
+
+    map1 = np.load(map1_path, mmap_mode="r")
+    map2 = np.load(map2_path, mmap_mode="r") if mode != "nearest" else None
+
+    return PerspectivePlan(
+        perspective_metadata=perspective,
+        panorama_height=panorama_height,
+        panorama_width=panorama_width,
+        mode=mode,
+        map1=map1,
+        map2=map2,
+        crop=crop,
+    )
+
+
+def get_perspective_plans(
+    perspectives: List[PerspectiveMetadata],
+    panorama_height: int,
+    panorama_width: int,
+    plan_dir: str | None = None,
+    mode: str = "bilinear",
+    crop: PanoramaCrop | None = None,
+) -> List[PerspectivePlan]:
+    """
+    Get the plans of a perspective set for a panorama size (and crop, if the
+    panorama only contains a band of rows).
+
+    The maps of the plans are kept in the process-wide `REMAP_CACHE`, within
+    its memory budget, so panoramas of many sizes or crops don't grow the
+    process without bound. If `plan_dir` is given, plans are loaded from it
+    when available and saved to it otherwise, so new worker processes start
+    warm.
+    """
+    plans = []
+    for perspective in perspectives:
+        key = (
+            "plan",
+            perspective.to_file_suffix(),
+            panorama_height,
+            panorama_width,
+            mode,
+            crop,
+        )
+        plan = None
+        maps = REMAP_CACHE.get(key)
+        if maps is not None:
+            plan = PerspectivePlan(
+                perspective_metadata=perspective,
+                panorama_height=panorama_height,
+                panorama_width=panorama_width,
+                mode=mode,
+                map1=maps[0],
+                map2=maps[1] if len(maps) > 1 else None,
+                crop=crop,
+            )
+
+        if plan is None and plan_dir is not None:
+            plan = load_perspective_plan(
+                perspective, panorama_height, panorama_width, plan_dir, mode, crop
+            )
+
+        if plan is None:
+            plan = PerspectivePlan(
+                perspective_metadata=perspective,
+                panorama_height=panorama_height,
+                panorama_width=panorama_width,
+                mode=mode,
+                crop=crop,
+            )
+            if plan_dir is not None:
+                save_perspective_plan(plan, plan_dir)
+
+        if plan.map2 is None:
+            REMAP_CACHE.put(key, (plan.map1,))
+        else:
+            REMAP_CACHE.put(key, (plan.map1, plan.map2))
+        plans.append(plan)
+
+    return plans
+
+
+def clear_perspective_plan_cache() -> None:
+    """Plans share `REMAP_CACHE` with the remap grids, this clears both"""
+    REMAP_CACHE.clear()
@@ -0,0 +1,432 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from .models import FlatOCRResult, SphereOCRResult
+
+
+def uv_to_yaw_pitch(
+    horizontal_fov, vertical_fov, u: np.ndarray, v: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized `FlatOCRResult.__uv_to_yaw_pitch`: convert UV coordinates to yaw
+    and pitch using the camera parameters. All the parameters are in degrees,
+    the FOVs are scalars or arrays broadcastable with the coordinates.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the converted yaws and pitches
+    """
+    horizontal_fov = np.asarray(horizontal_fov, dtype=np.float64)
+    vertical_fov = np.asarray(vertical_fov, dtype=np.float64)
+    if np.any(horizontal_fov < 0) or np.any(vertical_fov < 0):
+        raise ValueError("FOV must be positive")
+
+    # Translate the origin to the center of the image
+    u = np.asarray(u, dtype=np.float64) - 0.5
+    v = 0.5 - np.asarray(v, dtype=np.float64)
+
+    # atan2(x, 1) is atan(x)
+    yaw = np.arctan(2 * u * np.tan(np.radians(horizontal_fov) / 2))
+    pitch = np.arctan(2 * v * np.tan(np.radians(vertical_fov) / 2))
+
+    return np.degrees(yaw), np.degrees(pitch)
+
+
+def flat_boxes_to_sphere(
+    left: np.ndarray,
+    top: np.ndarray,
+    right: np.ndarray,
+    bottom: np.ndarray,
+    horizontal_fov,
+    vertical_fov,
+    yaw_offset,
+    pitch_offset,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized `FlatOCRResult.to_sphere` for the bounding boxes only. The camera
+    parameters are scalars for boxes of one perspective, or arrays with one
+    value per box for boxes of several perspectives.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: yaw, pitch,
+        width and height of the boxes on the sphere, in degrees
+    """
+    left = np.asarray(left, dtype=np.float64)
+    top = np.asarray(top, dtype=np.float64)
+    right = np.asarray(right, dtype=np.float64)
+    bottom = np.asarray(bottom, dtype=np.float64)
+
+    # Same three conversions as to_sphere: center, top-left and bottom-right
+    u = np.stack([(left + right) * 0.5, left, right])
+    v = np.stack([(top + bottom) * 0.5, top, bottom])
+    yaws, pitches = uv_to_yaw_pitch(horizontal_fov, vertical_fov, u, v)
+    center_yaw, left_yaw, right_yaw = yaws
+    center_pitch, top_pitch, bottom_pitch = pitches
+
+    return (
+        center_yaw + yaw_offset,
+        center_pitch + pitch_offset,
+        right_yaw - left_yaw,
+        top_pitch - bottom_pitch,
+    )
+
+
+# One record per result: the strings are indices into the string tables of
+# the batch, 52 bytes per result instead of a dataclass, its dict and its floats
+SPHERE_OCR_RECORD_DTYPE = np.dtype(
+    [
+        ("text_index", np.int32),
+        ("engine_index", np.int32),
+        ("perspective_index", np.int32),
+        ("confidence", np.float64),
+        ("yaw", np.float64),
+        ("pitch", np.float64),
+        ("width", np.float64),
+        ("height", np.float64),
+    ]
+)
+
+
+def intern_strings(strings: Sequence) -> Tuple[np.ndarray, list]:
+    """Indices of the strings into a table of the distinct strings"""
+    table_indices = {}
+    indices = np.fromiter(
+        (table_indices.setdefault(string, len(table_indices)) for string in strings),
+        dtype=np.int32,
+        count=len(strings),
+    )
+    return indices, list(table_indices)
+
+
+class SphereOCRRecord:
+    """
+    Lightweight read-only view of one result of a SphereOCRBatch, with the
+    same attributes as SphereOCRResult. Nothing is copied until read.
+    """
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch: "SphereOCRBatch", index: int):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def text(self) -> str:
+        return self.batch.text_table[self.batch.records["text_index"][self.index]]
+
+    @property
+    def engine(self) -> str | None:
+        return self.batch.engine_table[self.batch.records["engine_index"][self.index]]
+
+    @property
+    def perspective_index(self) -> int:
+        return int(self.batch.records["perspective_index"][self.index])
+
+    @property
+    def confidence(self) -> float:
+        return float(self.batch.records["confidence"][self.index])
+
+    @property
+    def yaw(self) -> float:
+        return float(self.batch.records["yaw"][self.index])
+
+    @property
+    def pitch(self) -> float:
+        return float(self.batch.records["pitch"][self.index])
+
+    @property
+    def width(self) -> float:
+        return float(self.batch.records["width"][self.index])
+
+    @property
+    def height(self) -> float:
+        return float(self.batch.records["height"][self.index])
+
+    def to_dict(self):
+        return self.to_sphere_ocr_result().to_dict()
+
+    def to_sphere_ocr_result(self) -> SphereOCRResult:
+        return SphereOCRResult(
+            text=self.text,
+            confidence=self.confidence,
+            yaw=self.yaw,
+            pitch=self.pitch,
+            width=self.width,
+            height=self.height,
+            engine=self.engine,
+        )
+
+    def __repr__(self):
+        return f"SphereOCRRecord(text={self.text!r}, confidence={self.confidence}, yaw={self.yaw}, pitch={self.pitch}, width={self.width}, height={self.height}, engine={self.engine!r})"
+
+
+class SphereOCRBatch:
+    """
+    Columnar SphereOCRResults: a NumPy structured array with one record per
+    result (see SPHERE_OCR_RECORD_DTYPE) and the tables of the strings they
+    refer to, so batches are converted, concatenated, deduplicated and written
+    with NumPy. The numeric fields (`yaw`, `confidence`, ...) are views of the
+    records. Indexing a batch with an int gives a SphereOCRRecord, so it can be
+    used wherever a list of SphereOCRResult is read.
+    """
+
+    __slots__ = ("records", "text_table", "engine_table")
+
+    records: np.ndarray
+    text_table: List[str]
+    engine_table: List[str | None]
+
+    def __init__(
+        self,
+        records: np.ndarray,
+        text_table: List[str],
+        engine_table: List[str | None],
+    ):
+        self.records = records
+        self.text_table = text_table
+        self.engine_table = engine_table
+
+    @classmethod
+    def from_arrays(
+        cls,
+        texts: Sequence[str],
+        confidence,
+        yaw,
+        pitch,
+        width,
+        height,
+        engines: Sequence[str | None],
+        perspective_index=-1,
+    ) -> "SphereOCRBatch":
+        records = np.empty(len(texts), dtype=SPHERE_OCR_RECORD_DTYPE)
+        records["text_index"], text_table = intern_strings(texts)
+        records["engine_index"], engine_table = intern_strings(engines)
+        records["perspective_index"] = perspective_index
+        records["confidence"] = confidence
+        records["yaw"] = yaw
+        records["pitch"] = pitch
+        records["width"] = width
+        records["height"] = height
+        return cls(records, text_table, engine_table)
+
+    @classmethod
+    def empty(cls) -> "SphereOCRBatch":
+        return cls(np.empty(0, dtype=SPHERE_OCR_RECORD_DTYPE), [], [])
+
+    @classmethod
+    def from_sphere_ocr_results(
+        cls, sphere_ocr_results: Sequence[SphereOCRResult], perspective_index: int = -1
+    ) -> "SphereOCRBatch":
+        return cls.from_arrays(
+            texts=[r.text for r in sphere_ocr_results],
+            confidence=[r.confidence for r in sphere_ocr_results],
+            yaw=[r.yaw for r in sphere_ocr_results],
+            pitch=[r.pitch for r in sphere_ocr_results],
+            width=[r.width for r in sphere_ocr_results],
+            height=[r.height for r in sphere_ocr_results],
+            engines=[r.engine for r in sphere_ocr_results],
+            perspective_index=perspective_index,
+        )
+
+    @classmethod
+    def concatenate(cls, batches: Sequence["SphereOCRBatch"]) -> "SphereOCRBatch":
+        """Concatenate the batches, their string tables are appended one after the other"""
+        if len(batches) == 0:
+            return cls.empty()
+
+        records = np.concatenate([batch.records for batch in batches])
+        text_table, engine_table = [], []
+        begin = 0
+        for batch in batches:
+            end = begin + len(batch)
+            records["text_index"][begin:end] += len(text_table)
+            records["engine_index"][begin:end] += len(engine_table)
+            text_table.extend(batch.text_table)
+            engine_table.extend(batch.engine_table)
+            begin = end
+        return cls(records, text_table, engine_table)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index: int) -> SphereOCRRecord:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SphereOCRBatch index out of range")
+        return SphereOCRRecord(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield SphereOCRRecord(self, index)
+
+    @property
+    def texts(self) -> List[str]:
+        text_table = self.text_table
+        return [text_table[i] for i in self.records["text_index"].tolist()]
+
+    @property
+    def engines(self) -> List[str | None]:
+        engine_table = self.engine_table
+        return [engine_table[i] for i in self.records["engine_index"].tolist()]
+
+    @property
+    def perspective_index(self) -> np.ndarray:
+        return self.records["perspective_index"]
+
+    @property
+    def confidence(self) -> np.ndarray:
+        return self.records["confidence"]
+
+    @property
+    def yaw(self) -> np.ndarray:
+        return self.records["yaw"]
+
+    @property
+    def pitch(self) -> np.ndarray:
+        return self.records["pitch"]
+
+    @property
+    def width(self) -> np.ndarray:
+        return self.records["width"]
+
+    @property
+    def height(self) -> np.ndarray:
+        return self.records["height"]
+
+    def select(self, indices: Sequence[int]) -> "SphereOCRBatch":
+        """Results at `indices`, sharing the string tables of this batch"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return SphereOCRBatch(self.records[indices], self.text_table, self.engine_table)
+
+    def to_sphere_ocr_results(self) -> List[SphereOCRResult]:
+        return [
+            SphereOCRResult(
+                text=text,
+                confidence=confidence,
+                yaw=yaw,
+                pitch=pitch,
+                width=width,
+                height=height,
+                engine=engine,
+            )
+            for text, confidence, yaw, pitch, width, height, engine in zip(
+                self.texts,
+                self.confidence.tolist(),
+                self.yaw.tolist(),
+                self.pitch.tolist(),
+                self.width.tolist(),
+                self.height.tolist(),
+                self.engines,
+            )
+        ]
+
+    def to_dicts(self) -> List[dict]:
+        return [r.to_dict() for r in self.to_sphere_ocr_results()]
+
+    def to_rows(self, panorama_id: str) -> List[tuple]:
+        """
+        Rows of the ocr_result table, in the column order of
+        (pano_id, text, confidence, yaw, pitch, width, height, engine)
+        """
+        return list(
+            zip(
+                [panorama_id] * len(self),
+                self.texts,
+                self.confidence.tolist(),
+                self.yaw.tolist(),
+                self.pitch.tolist(),
+                self.width.tolist(),
+                self.height.tolist(),
+                self.engines,
+            )
+        )
+
+
+def flat_ocr_results_to_sphere(
+    flat_ocr_results: Sequence[FlatOCRResult],
+    horizontal_fov: float,
+    vertical_fov: float,
+    yaw_offset: float,
+    pitch_offset: float,
+    perspective_index=-1,
+) -> SphereOCRBatch:
+    """
+    Convert all the flat OCR results of one perspective to the sphere at once,
+    same as calling `FlatOCRResult.to_sphere` on each of them.
+    """
+    if (
+        horizontal_fov is None
+        or vertical_fov is None
+        or yaw_offset is None
+        or pitch_offset is None
+    ):
+        raise ValueError("Missing parameters")
+
+    boxes = np.array(
+        [
+            (
+                r.bounding_box.left,
+                r.bounding_box.top,
+                r.bounding_box.right,
+                r.bounding_box.bottom,
+            )
+            for r in flat_ocr_results
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+
+    yaw, pitch, width, height = flat_boxes_to_sphere(
+        boxes[:, 0],
+        boxes[:, 1],
+        boxes[:, 2],
+        boxes[:, 3],
+        horizontal_fov,
+        vertical_fov,
+        yaw_offset,
+        pitch_offset,
+    )
+
+    return SphereOCRBatch.from_arrays(
+        texts=[r.text for r in flat_ocr_results],
+        confidence=[r.confidence for r in flat_ocr_results],
+        yaw=yaw,
+        pitch=pitch,
+        width=width,
+        height=height,
+        engines=[r.engine for r in flat_ocr_results],
+        perspective_index=perspective_index,
+    )
+
+
+def flat_ocr_results_to_sphere_for_each_perspective(
+    flat_ocr_results_for_each_perspective: Sequence[Sequence[FlatOCRResult]],
+    perspectives: Sequence,
+) -> SphereOCRBatch:
+    """
+    Convert the flat OCR results of all the perspectives of a panorama in a
+    single pass, each box with the camera parameters of its perspective
+    (`PerspectiveMetadata`).
+    """
+    if len(flat_ocr_results_for_each_perspective) != len(perspectives):
+        raise ValueError("One list of OCR results is needed per perspective")
+
+    counts = [len(r) for r in flat_ocr_results_for_each_perspective]
+    flat_ocr_results = [
+        r for results in flat_ocr_results_for_each_perspective for r in results
+    ]
+
+    def per_result(attribute: str) -> np.ndarray:
+        values = [getattr(perspective, attribute) for perspective in perspectives]
+        if any(value is None for value in values):
+            raise ValueError("Missing parameters")
+        return np.repeat(np.array(values, dtype=np.float64), counts)
+
+    return flat_ocr_results_to_sphere(
+        flat_ocr_results,
+        per_result("horizontal_fov"),
+        per_result("vertical_fov"),
+        per_result("yaw_offset"),
+        per_result("pitch_offset"),
+        perspective_index=np.repeat(np.arange(len(perspectives)), counts),
+    )
@@ -1,10 +1,13 @@
 from .models import SphereOCRResult
+from .batch import SphereOCRBatch
+from .text_similarity import get_text_similarity, get_text_overlap
 from dataclasses import dataclass
-from typing import List
+from enum import Enum
+from typing import List, Tuple
 
+import numpy as np
 import geopandas as gpd
 from shapely.geometry import Polygon
-import textdistance
 
 
 @dataclass
@@ -15,6 +18,16 @@ class RegionIntersection:
     intersection_ratio: float
 
 
+class IntersectionMode(Enum):
+    # shapely polygons reprojected to EPSG:3857 and intersected with gpd.overlay
+    GEOMETRIC = "geometric"
+    # the same EPSG:3857 areas in closed form, for all pairs at once with numpy
+    ANALYTIC = "analytic"
+
+
+# Web Mercator is undefined at the poles, EPSG:3857 is clipped to this latitude
+MAX_MERCATOR_LATITUDE = 85.0511287798
+
 DEFAULT_MIN_TEXT_SIMILARITY = 0.5
 DEFAULT_MIN_INTERSECTION_RATIO_FOR_SIMILAR_TEXT = 0.5
 DEFAULT_MIN_TEXT_OVERLAP = 0.5
@@ -28,6 +41,8 @@ class SphereOCRDuplicationDetectionEngine:
     min_text_overlap: float
     min_intersection_ratio_for_overlapping_text: float
     min_intersection_ratio: float
+    intersection_mode: IntersectionMode
+    spherical_area: bool
 
     def __init__(
         self,
@@ -36,7 +51,15 @@ class SphereOCRDuplicationDetectionEngine:
         min_text_overlap=DEFAULT_MIN_TEXT_OVERLAP,
         min_intersection_ratio_for_overlapping_text=DEFAULT_MIN_INTERSECTION_RATIO_FOR_OVERLAPPING_TEXT,
         min_intersection_ratio=DEFAULT_MIN_INTERSECTION_RATIO,
+        intersection_mode=IntersectionMode.GEOMETRIC,
+        spherical_area=False,
     ):
+        """
+        intersection_mode: how the intersection ratio of two boxes is computed
+        spherical_area: with IntersectionMode.ANALYTIC, weigh areas by their true
+            area on the sphere instead of their Web Mercator area, which inflates
+            boxes far from the horizon
+        """
         self.min_text_similarity = min_text_similarity
         self.min_intersection_ratio_for_similar_text = (
             min_intersection_ratio_for_similar_text
@@ -46,6 +69,8 @@ class SphereOCRDuplicationDetectionEngine:
             min_intersection_ratio_for_overlapping_text
         )
         self.min_intersection_ratio = min_intersection_ratio
+        self.intersection_mode = intersection_mode
+        self.spherical_area = spherical_area
 
     def __sphere_ocr_to_polygon(self, sphere_ocr: SphereOCRResult) -> Polygon:
         bounding_box = {
@@ -108,15 +133,161 @@ class SphereOCRDuplicationDetectionEngine:
             return None
         return intersection
 
+    def __pitch_to_y(self, pitch: np.ndarray) -> np.ndarray:
+        if self.spherical_area:
+            # Lambert cylindrical equal-area projection
+            return np.sin(np.radians(pitch))
+        pitch = np.clip(pitch, -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE)
+        return np.log(np.tan(np.pi / 4 + np.radians(pitch) / 2))
+
+    def __to_box_arrays(self, ocr_results: List[SphereOCRResult] | SphereOCRBatch):
+        """
+        Get the projected (left, right, bottom, top) edges of the boxes, and
+        which of them straddle the ±180° seam.
+
+        Longitude maps linearly to x (its scale cancels out in the ratios),
+        latitude through the projection to y. Boxes entirely past the seam are
+        wrapped around like EPSG:3857 does.
+        """
+        if isinstance(ocr_results, SphereOCRBatch):
+            yaw, pitch = ocr_results.yaw, ocr_results.pitch
+            width, height = ocr_results.width, ocr_results.height
+        else:
+            yaw = np.array([r.yaw for r in ocr_results], dtype=np.float64)
+            pitch = np.array([r.pitch for r in ocr_results], dtype=np.float64)
+            width = np.array([r.width for r in ocr_results], dtype=np.float64)
+            height = np.array([r.height for r in ocr_results], dtype=np.float64)
+
+        left = yaw - width / 2
+        right = yaw + width / 2
+        shift = np.where(right < -180, 360.0, np.where(left > 180, -360.0, 0.0))
+        left += shift
+        right += shift
+        crosses_seam = (left < -180) | (right > 180)
+
+        bottom = self.__pitch_to_y(pitch - height / 2)
+        top = self.__pitch_to_y(pitch + height / 2)
+        return left, right, bottom, top, crosses_seam
+
+    def __get_intersection_ratios(
+        self,
+        ocr_results_1: List[SphereOCRResult],
+        boxes_1,
+        index_1: np.ndarray,
+        ocr_results_2: List[SphereOCRResult],
+        boxes_2,
+        index_2: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Intersection ratios of the pairs (index_1, index_2) of two box arrays,
+        broadcast like NumPy indexes: pass (n, 1) and (1, m) indexes for a
+        matrix, or two (k,) indexes for a list of pairs.
+        """
+        left_1, right_1, bottom_1, top_1, seam_1 = (a[index_1] for a in boxes_1)
+        left_2, right_2, bottom_2, top_2, seam_2 = (a[index_2] for a in boxes_2)
+
+        area_1 = (right_1 - left_1) * (top_1 - bottom_1)
+        area_2 = (right_2 - left_2) * (top_2 - bottom_2)
+
+        intersection_width = np.minimum(right_1, right_2) - np.maximum(left_1, left_2)
+        intersection_height = np.minimum(top_1, top_2) - np.maximum(bottom_1, bottom_2)
+        intersection_area = np.clip(intersection_width, 0, None) * np.clip(
+            intersection_height, 0, None
+        )
+
+        min_area = np.minimum(area_1, area_2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = np.where(min_area > 0, intersection_area / min_area, 0.0)
+
+        # Pairs with a box straddling the seam fall back to the geometric path
+        seam = seam_1 | seam_2
+        index_1, index_2 = np.broadcast_arrays(index_1, index_2)
+        for position in zip(*np.nonzero(seam)):
+            intersection = self.__intersect_ocr_results(
+                ocr_results_1[index_1[position]], ocr_results_2[index_2[position]]
+            )
+            ratios[position] = (
+                0.0 if intersection is None else intersection.intersection_ratio
+            )
+
+        return ratios
+
+    def get_intersection_ratio_matrix(
+        self,
+        ocr_results_1: List[SphereOCRResult],
+        ocr_results_2: List[SphereOCRResult],
+    ) -> np.ndarray:
+        """
+        Get the intersection ratio (intersection area / smaller area) of every
+        pair of boxes of two lists, 0 for pairs that don't intersect.
+
+        The boxes are axis-aligned in yaw / pitch, so they stay axis-aligned once
+        projected and their intersection is computed in closed form for all pairs
+        in one broadcast. Pairs with a box straddling the ±180° seam fall back to
+        the geometric path.
+
+        Returns:
+            np.ndarray: (len(ocr_results_1), len(ocr_results_2)) ratios
+        """
+        n, m = len(ocr_results_1), len(ocr_results_2)
+        if n == 0 or m == 0:
+            return np.zeros((n, m), dtype=np.float64)
+
+        return self.__get_intersection_ratios(
+            ocr_results_1,
+            self.__to_box_arrays(ocr_results_1),
+            np.arange(n)[:, None],
+            ocr_results_2,
+            self.__to_box_arrays(ocr_results_2),
+            np.arange(m)[None, :],
+        )
+
+    def __get_intersection_ratio(
+        self, ocr_results_1: SphereOCRResult, ocr_results_2: SphereOCRResult
+    ) -> float | None:
+        if self.intersection_mode == IntersectionMode.ANALYTIC:
+            return float(
+                self.get_intersection_ratio_matrix([ocr_results_1], [ocr_results_2])[
+                    0, 0
+                ]
+            )
+
+        intersection = self.__intersect_ocr_results(ocr_results_1, ocr_results_2)
+        if intersection is None:
+            return None
+        return intersection.intersection_ratio
+
     def __get_texts_similarity(self, text_1: str, text_2: str) -> float:
-        return textdistance.levenshtein.normalized_similarity(text_1, text_2)
+        return get_text_similarity(text_1, text_2)
 
     def __get_texts_overlap(self, text_1: str, text_2: str) -> float:
-        return textdistance.overlap.normalized_similarity(text_1, text_2)
+        return get_text_overlap(text_1, text_2)
 
     def check_duplication(
-        self, ocr_results_1: SphereOCRResult, ocr_results_2: SphereOCRResult
+        self,
+        ocr_results_1: SphereOCRResult,
+        ocr_results_2: SphereOCRResult,
+        intersection_ratio: float | None = None,
     ) -> bool:
+        """
+        intersection_ratio: if already known (e.g. from
+            `get_intersection_ratio_matrix`), it is not computed again
+        """
+        # Reject pairs that don't intersect enough before comparing their texts,
+        # unless the intersection is the expensive part (geometric mode)
+        if (
+            intersection_ratio is None
+            and self.intersection_mode == IntersectionMode.ANALYTIC
+        ):
+            intersection_ratio = self.__get_intersection_ratio(
+                ocr_results_1, ocr_results_2
+            )
+        if (
+            intersection_ratio is not None
+            and intersection_ratio < self.min_intersection_ratio
+        ):
+            return False
+
         text_similarity = self.__get_texts_similarity(
             ocr_results_1.text, ocr_results_2.text
         )
@@ -129,26 +300,27 @@ class SphereOCRDuplicationDetectionEngine:
         ):
             return False
 
-        intersection = self.__intersect_ocr_results(ocr_results_1, ocr_results_2)
-        if intersection is None:
+        if intersection_ratio is None:
+            intersection_ratio = self.__get_intersection_ratio(
+                ocr_results_1, ocr_results_2
+            )
+        if intersection_ratio is None:
             return False
 
-        if intersection.intersection_ratio < self.min_intersection_ratio:
+        if intersection_ratio < self.min_intersection_ratio:
             return False
 
         # Check overlap
         if (
             text_overlap >= self.min_text_overlap
-            and intersection.intersection_ratio
-            >= self.min_intersection_ratio_for_overlapping_text
+            and intersection_ratio >= self.min_intersection_ratio_for_overlapping_text
         ):
             return True
 
         # Check similarity
         if (
             text_similarity >= self.min_text_similarity
-            and intersection.intersection_ratio
-            >= self.min_intersection_ratio_for_similar_text
+            and intersection_ratio >= self.min_intersection_ratio_for_similar_text
         ):
             return True
 
@@ -182,10 +354,19 @@ class SphereOCRDuplicationDetectionEngine:
     ) -> bool:
 
         duplications = []
-        for i, ocr_result_0 in enumerate(ocr_results_0):
-            for j, ocr_result_1 in enumerate(ocr_results_1):
-                if self.check_duplication(ocr_result_0, ocr_result_1):
-                    duplications.append([i, j])
+        if self.intersection_mode == IntersectionMode.ANALYTIC:
+            # Only pairs that intersect enough can be duplicates, check their texts
+            ratios = self.get_intersection_ratio_matrix(ocr_results_0, ocr_results_1)
+            for i, j in zip(*np.nonzero(ratios >= self.min_intersection_ratio)):
+                if self.check_duplication(
+                    ocr_results_0[i], ocr_results_1[j], float(ratios[i, j])
+                ):
+                    duplications.append([int(i), int(j)])
+        else:
+            for i, ocr_result_0 in enumerate(ocr_results_0):
+                for j, ocr_result_1 in enumerate(ocr_results_1):
+                    if self.check_duplication(ocr_result_0, ocr_result_1):
+                        duplications.append([i, j])
 
         indices_to_remove_from_ocr_results_0 = []
         indices_to_remove_from_ocr_results_1 = []
@@ -224,3 +405,171 @@ class SphereOCRDuplicationDetectionEngine:
             ocr_results_1.pop(index)
 
         return ocr_results_0, ocr_results_1
+
+    def __get_candidate_pairs(self, boxes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the pairs (i < j) of boxes that overlap, with a sort and sweep over
+        their left edges: each overlapping pair has one box starting inside the
+        other, so it is found by a binary search in the sorted left edges.
+        O(n log n + k) for n boxes and k overlapping pairs.
+        """
+        left, right, bottom, top, crosses_seam = boxes
+        n = len(left)
+
+        order = np.argsort(left, kind="stable")
+        sorted_left = left[order]
+        ends = np.searchsorted(sorted_left, right[order], side="left")
+        counts = np.maximum(ends - np.arange(n) - 1, 0)
+
+        first = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        index_1 = order[first]
+        index_2 = order[first + 1 + offsets]
+
+        overlaps_vertically = np.minimum(top[index_1], top[index_2]) > np.maximum(
+            bottom[index_1], bottom[index_2]
+        )
+        index_1 = index_1[overlaps_vertically]
+        index_2 = index_2[overlaps_vertically]
+
+        # Boxes straddling the seam also overlap boxes on the other side of it
+        for seam_index in np.nonzero(crosses_seam)[0]:
+            overlaps_horizontally = np.zeros(n, dtype=bool)
+            for shift in (-360.0, 0.0, 360.0):
+                overlaps_horizontally |= (left < right[seam_index] + shift) & (
+                    right > left[seam_index] + shift
+                )
+            overlapping = np.nonzero(
+                overlaps_horizontally
+                & (
+                    np.minimum(top, top[seam_index])
+                    > np.maximum(bottom, bottom[seam_index])
+                )
+            )[0]
+            index_1 = np.concatenate([index_1, np.full(len(overlapping), seam_index)])
+            index_2 = np.concatenate([index_2, overlapping])
+
+        pairs = np.stack(
+            [np.minimum(index_1, index_2), np.maximum(index_1, index_2)], axis=1
+        )
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs = np.unique(pairs, axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def remove_duplications(
+        self, ocr_results_for_each_perspective: List[List[SphereOCRResult]]
+    ) -> List[SphereOCRResult]:
+        """
+        Remove the duplications among all the OCR results of a panorama at once,
+        whatever perspectives they come from.
+
+        Candidate pairs are the overlapping boxes of different perspectives
+        (see `__get_candidate_pairs`), duplicated pairs are merged into clusters
+        with a union-find, and each cluster keeps a single result elected like
+        `remove_duplication_for_two_lists` does: the longest text, then the
+        highest confidence. Unlike chaining `remove_duplication_for_two_lists`
+        over adjacent perspectives, the result does not depend on the order of
+        the perspectives.
+
+        Returns:
+            List[SphereOCRResult]: the remaining results, in their original order
+        """
+        ocr_results = []
+        perspective_indices = []
+        for perspective_index, perspective_ocr_results in enumerate(
+            ocr_results_for_each_perspective
+        ):
+            ocr_results.extend(perspective_ocr_results)
+            perspective_indices.extend(
+                [perspective_index] * len(perspective_ocr_results)
+            )
+
+        if len(ocr_results) < 2:
+            return list(ocr_results)
+
+        kept_indices = self.__get_kept_indices(
+            ocr_results, np.array(perspective_indices)
+        )
+        return [ocr_results[i] for i in kept_indices]
+
+    def remove_batch_duplications(self, batch: SphereOCRBatch) -> SphereOCRBatch:
+        """
+        Same as `remove_duplications`, for the results of all the perspectives
+        of a panorama in a single batch (see `perspective_index`). The boxes
+        are read from the batch arrays without building a result per box.
+
+        Returns:
+            SphereOCRBatch: the remaining results, in their original order
+        """
+        if len(batch) < 2:
+            return batch
+        return batch.select(self.__get_kept_indices(batch, batch.perspective_index))
+
+    def __get_kept_indices(
+        self,
+        ocr_results: List[SphereOCRResult] | SphereOCRBatch,
+        perspective_indices: np.ndarray,
+    ) -> List[int]:
+        n = len(ocr_results)
+        boxes = self.__to_box_arrays(ocr_results)
+        index_1, index_2 = self.__get_candidate_pairs(boxes)
+
+        # Results of the same perspective are different detections
+        different_perspectives = (
+            perspective_indices[index_1] != perspective_indices[index_2]
+        )
+        index_1 = index_1[different_perspectives]
+        index_2 = index_2[different_perspectives]
+
+        if self.intersection_mode == IntersectionMode.ANALYTIC:
+            ratios = self.__get_intersection_ratios(
+                ocr_results, boxes, index_1, ocr_results, boxes, index_2
+            )
+        else:
+            ratios = np.array(
+                [
+                    self.__get_intersection_ratio(ocr_results[i], ocr_results[j]) or 0.0
+                    for i, j in zip(index_1, index_2)
+                ],
+                dtype=np.float64,
+            )
+
+        parents = list(range(n))
+
+        def find(i: int) -> int:
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for i, j, ratio in zip(index_1, index_2, ratios):
+            if ratio < self.min_intersection_ratio:
+                continue
+            if self.check_duplication(ocr_results[i], ocr_results[j], float(ratio)):
+                root_1, root_2 = find(int(i)), find(int(j))
+                if root_1 != root_2:
+                    parents[root_2] = root_1
+
+        clusters = {}
+        for i in range(n):
+            clusters.setdefault(find(i), []).append(i)
+
+        if isinstance(ocr_results, SphereOCRBatch):
+            texts, confidences = ocr_results.texts, ocr_results.confidence.tolist()
+        else:
+            texts = [r.text for r in ocr_results]
+            confidences = [r.confidence for r in ocr_results]
+
+        kept_indices = [
+            # favor the longer text, then the higher confidence, then the first one
+            max(
+                cluster,
+                key=lambda i: (len(texts[i]), confidences[i], -i),
+            )
+            for cluster in clusters.values()
+        ]
+        kept_indices.sort()
+
+        return kept_indices
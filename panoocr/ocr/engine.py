@@ -1,8 +1,28 @@
+import time
 from enum import Enum
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from abc import ABC, abstractmethod
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
 from .models import FlatOCRResult
+from .threads import ThreadConfig, parse_thread_config, apply_thread_config
+
+
+# Keys of `Image.info` holding the FOV of a perspective image, for engines whose
+# processing depends on its angular resolution. Set by `set_image_fov`, they
+# stay with the image through `CachedOCREngine` and the inference server
+FOV_INFO_KEYS = ("horizontal_fov", "vertical_fov")
+
+
+def set_image_fov(image: Image.Image, horizontal_fov: float, vertical_fov: float):
+    image.info[FOV_INFO_KEYS[0]] = horizontal_fov
+    image.info[FOV_INFO_KEYS[1]] = vertical_fov
+
+
+def get_image_fov(image: Image.Image) -> Tuple[float, float] | None:
+    """Returns the horizontal and vertical FOV set with `set_image_fov`, if any"""
+    if not all(key in image.info for key in FOV_INFO_KEYS):
+        return None
+    return tuple(float(image.info[key]) for key in FOV_INFO_KEYS)
 
 
 class OCREngineType(Enum):
@@ -11,13 +31,63 @@ class OCREngineType(Enum):
     PADDLEOCR = "paddleocr"
     TROCR = "trocr"
     FLORENCE = "florence2"
+    ONNX = "onnx"
+    REMOTE = "remote"
 
 
 class OCREngine(ABC):
+    # Number of images `recognize_batch` works best with, engines that run a
+    # batched model set it from their config
+    preferred_batch_size: int = 1
+    # Set by `configure_threads` from the config
+    thread_config: ThreadConfig = ThreadConfig()
+
     @abstractmethod
     def __init__(self, config: Dict[str, Any]) -> None:
         pass
 
+    def configure_threads(self, config: Dict[str, Any]) -> ThreadConfig:
+        """
+        Apply the `threads` and `cpu_affinity` keys of an engine config. Engines
+        call it before importing their framework, then size the framework's
+        own pools from `thread_config.threads`.
+        """
+        self.thread_config = parse_thread_config(config)
+        apply_thread_config(self.thread_config)
+        return self.thread_config
+
     @abstractmethod
     def recognize(self, image: Image.Image = None) -> List[FlatOCRResult]:
         pass
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """
+        Recognize several images, e.g. all the perspectives of a panorama.
+        Engines with a batched model override it to run them in one inference,
+        this default recognizes the images one after the other.
+
+        Returns:
+            List[List[FlatOCRResult]]: the results of each image, in order
+        """
+        return [self.recognize(image) for image in images]
+
+    def warmup(self, image_size: int = 1024) -> float:
+        """
+        Recognize a rendered text once, so the lazy initialization of the
+        framework (allocations, graph optimization, kernel selection) happens
+        before the first panorama instead of during it.
+
+        Returns:
+            float: seconds the warm-up took
+        """
+        image = Image.new("RGB", (image_size, image_size), (255, 255, 255))
+        ImageDraw.Draw(image).text(
+            (image_size // 8, image_size // 2),
+            "WARM UP",
+            fill=(0, 0, 0),
+            font=ImageFont.load_default(size=image_size // 10),
+        )
+
+        current_time = time.time()
+        self.recognize_batch([image])
+        return time.time() - current_time
@@ -0,0 +1,260 @@
+from enum import Enum
+from typing import List, Dict, Any, Tuple
+from ..engine import OCREngine, get_image_fov
+from ..models import FlatOCRResult, BoundingBox
+from PIL import Image
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Config keys that change how an engine runs but not its results, so workers
+# with other batch sizes, threads or CPUs share their cached results
+EXECUTION_CONFIG_KEYS = [
+    "model_root",
+    "offline",
+    "threads",
+    "cpu_affinity",
+    "num_threads",
+    "intra_op_threads",
+    "inter_op_threads",
+    "enable_memory_arena",
+    "batch_size",
+    "recognition_batch_size",
+    "detection_batch_size",
+    "address",
+    "authkey",
+]
+
+
+def get_engine_key(engine: OCREngine, engine_config: Dict[str, Any]) -> str:
+    """Engine class and config, results of another engine or config never match"""
+    from .remote_engine import RemoteOCREngine
+
+    # The results are those of the server's engine, wherever it listens
+    if isinstance(engine, RemoteOCREngine):
+        return engine.server_engine_key
+
+    engine_config = {
+        key: value
+        for key, value in engine_config.items()
+        if key not in EXECUTION_CONFIG_KEYS and not key.startswith("report_")
+    }
+    return json.dumps(
+        [type(engine).__name__, engine_config],
+        sort_keys=True,
+        default=lambda value: value.value if isinstance(value, Enum) else str(value),
+    )
+
+
+def get_image_hash(image: Image.Image) -> str:
+    """Hash of the pixels of an image, with its mode, size and FOV"""
+    image_hash = hashlib.blake2b(digest_size=16)
+    image_hash.update(f"{image.mode}:{image.width}x{image.height}".encode())
+    fov = get_image_fov(image)
+    if fov is not None:
+        image_hash.update(f"fov:{fov[0]}x{fov[1]}".encode())
+    image_hash.update(image.tobytes())
+    return image_hash.hexdigest()
+
+
+def flat_ocr_result_from_dict(ocr_result_dict: Dict[str, Any]) -> FlatOCRResult:
+    return FlatOCRResult(
+        text=ocr_result_dict["text"],
+        confidence=ocr_result_dict["confidence"],
+        bounding_box=BoundingBox(**ocr_result_dict["bounding_box"]),
+        engine=ocr_result_dict["engine"],
+    )
+
+
+class CachedOCREngine(OCREngine):
+    """
+    Wraps an OCR engine and caches its results by the pixels of the images, so
+    perspectives seen before (retries, re-runs with other dedup settings,
+    overlapping perspective sets) are not recognized again.
+
+    Results are stored as JSON in an SQLite file. When their total size goes
+    over `max_bytes`, the least recently used results are evicted.
+    """
+
+    engine: OCREngine
+    engine_key: str
+    max_bytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, config: Dict[str, Any] = {}) -> None:
+        """
+        Config:
+            engine: the OCREngine to cache
+            engine_config: config the engine was created with, part of the key
+            path: SQLite file of the cache
+            max_bytes: size of the cached results before eviction
+        """
+        engine = config.get("engine")
+        if isinstance(engine, OCREngine):
+            self.engine = engine
+        else:
+            raise ValueError("engine must be an OCREngine")
+
+        path = config.get("path")
+        if not isinstance(path, str):
+            raise ValueError("path must be a string")
+
+        max_bytes = config.get("max_bytes", DEFAULT_CACHE_MAX_BYTES)
+        if isinstance(max_bytes, int) and max_bytes > 0:
+            self.max_bytes = max_bytes
+        else:
+            raise ValueError("max_bytes must be a positive integer")
+
+        self.engine_key = get_engine_key(engine, config.get("engine_config", {}))
+        self.preferred_batch_size = engine.preferred_batch_size
+
+        self.hits = 0
+        self.misses = 0
+        # Recognition time of the misses, to estimate the time the hits saved
+        self.recognition_time = 0.0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                key TEXT PRIMARY KEY,
+                results TEXT,
+                size_bytes INTEGER,
+                last_access REAL
+            )
+        """)
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_results_last_access ON ocr_results(last_access)"
+        )
+        self._connection.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+    @property
+    def saved_time(self) -> float:
+        """Estimated recognition time saved by the hits, in seconds"""
+        if self.misses == 0:
+            return 0.0
+        return self.hits * self.recognition_time / self.misses
+
+    def report(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%}), saved ~{self.saved_time:.1f}s"
+
+    def warmup(self, image_size: int = 1024) -> float:
+        """Warm up the cached engine, the warm-up image is not cached"""
+        return self.engine.warmup(image_size)
+
+    def __get_key(self, image: Image.Image) -> str:
+        image_hash = hashlib.blake2b(digest_size=16)
+        image_hash.update(self.engine_key.encode())
+        image_hash.update(get_image_hash(image).encode())
+        return image_hash.hexdigest()
+
+    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """Recognize the images missing from the cache in one batch"""
+        keys = [self.__get_key(image) for image in images]
+        flat_ocr_results_for_each_image = [self.__get(key) for key in keys]
+
+        missing_indices = [
+            i
+            for i, flat_ocr_results in enumerate(flat_ocr_results_for_each_image)
+            if flat_ocr_results is None
+        ]
+        with self._lock:
+            self.hits += len(images) - len(missing_indices)
+            self.misses += len(missing_indices)
+
+        if missing_indices:
+            current_time = time.time()
+            recognized = self.engine.recognize_batch(
+                [images[i] for i in missing_indices]
+            )
+            with self._lock:
+                self.recognition_time += time.time() - current_time
+
+            for i, flat_ocr_results in zip(missing_indices, recognized):
+                flat_ocr_results_for_each_image[i] = flat_ocr_results
+            self.__put(
+                [(keys[i], flat_ocr_results_for_each_image[i]) for i in missing_indices]
+            )
+
+        return flat_ocr_results_for_each_image
+
+    def __get(self, key: str) -> List[FlatOCRResult] | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT results FROM ocr_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE ocr_results SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._connection.commit()
+
+        return [flat_ocr_result_from_dict(entry) for entry in json.loads(row[0])]
+
+    def __put(self, entries: List[Tuple[str, List[FlatOCRResult]]]) -> None:
+        rows = []
+        for key, flat_ocr_results in entries:
+            results = json.dumps(
+                [flat_ocr_result.to_dict() for flat_ocr_result in flat_ocr_results]
+            )
+            rows.append((key, results, len(results), time.time()))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO ocr_results VALUES (?, ?, ?, ?)", rows
+            )
+            self._connection.commit()
+
+        self.evict()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM ocr_results"
+            ).fetchone()
+        return row[0]
+
+    def evict(self) -> None:
+        """Remove the least recently used results until the cache fits `max_bytes`"""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, size_bytes FROM ocr_results ORDER BY last_access"
+            ).fetchall()
+
+            evicted_keys = []
+            for key, size_bytes in rows:
+                if excess <= 0:
+                    break
+                evicted_keys.append((key,))
+                excess -= size_bytes
+
+            self._connection.executemany(
+                "DELETE FROM ocr_results WHERE key = ?", evicted_keys
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
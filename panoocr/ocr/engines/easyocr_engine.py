@@ -2,6 +2,7 @@ from enum import Enum
 from typing import List, Dict, Any
 from ..engine import OCREngine
 from ..models import FlatOCRResult, BoundingBox
+from ..model_store import parse_model_store
 from dataclasses import dataclass
 from PIL import Image
 import numpy as np
@@ -94,12 +95,15 @@ class EasyOCRLanguageCode(Enum):
 
 
 DEFAULT_LANGUAGE_PREFERENCE = [EasyOCRLanguageCode.ENGLISH]
+DEFAULT_BATCH_SIZE = 8
 
 
 class EasyOCREngine(OCREngine):
     language_preference: List[str]
 
     def __init__(self, config: Dict[str, Any] = {}) -> None:
+        self.configure_threads(config)
+        self.model_store = parse_model_store(config)
 
         # Parse language preference
         language_perference = config.get(
@@ -112,14 +116,59 @@ class EasyOCREngine(OCREngine):
         except KeyError:
             raise ValueError("Unsupported language code")
 
+        # Parse batch size
+        batch_size = config.get("batch_size", DEFAULT_BATCH_SIZE)
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.preferred_batch_size = batch_size
+        else:
+            raise ValueError("batch_size must be a positive integer")
+
         import easyocr
 
-        self.reader = easyocr.Reader(self.language_preference, gpu=True)
+        if self.thread_config.threads is not None:
+            import torch
+
+            torch.set_num_threads(self.thread_config.threads)
+
+        # Raises FileNotFoundError for a missing model when downloads are disabled
+        self.reader = easyocr.Reader(
+            self.language_preference,
+            gpu=True,
+            model_storage_directory=self.model_store.get_path("easyocr"),
+            download_enabled=not self.model_store.offline,
+        )
 
     def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
         image_array = np.array(image)
         annotations = self.reader.readtext(image_array)
+        return self.__to_flat_ocr_results(annotations, image)
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """
+        Run `readtext_batched` on the images, grouped by size since the
+        detector stacks the images of a batch into one tensor.
+        """
+        flat_ocr_results_for_each_image = [None] * len(images)
+
+        indices_for_each_size = {}
+        for index, image in enumerate(images):
+            indices_for_each_size.setdefault(image.size, []).append(index)
+
+        for indices in indices_for_each_size.values():
+            annotations_for_each_image = self.reader.readtext_batched(
+                [np.array(images[index]) for index in indices],
+                batch_size=self.preferred_batch_size,
+            )
+            for index, annotations in zip(indices, annotations_for_each_image):
+                flat_ocr_results_for_each_image[index] = self.__to_flat_ocr_results(
+                    annotations, images[index]
+                )
+
+        return flat_ocr_results_for_each_image
 
+    def __to_flat_ocr_results(
+        self, annotations: List, image: Image.Image
+    ) -> List[FlatOCRResult]:
         easy_ocr_results = []
 
         for annotation in annotations:
@@ -1,26 +1,130 @@
+import time
 from enum import Enum
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from ..engine import OCREngine
 from ..models import FlatOCRResult, BoundingBox
+from ..model_store import parse_model_store
 from dataclasses import dataclass
 from PIL import Image
 import numpy as np
 
+DEFAULT_BATCH_SIZE = 4
+
+
+class Florence2PerformanceProfile(Enum):
+    # beam search in full precision, the most accurate
+    ACCURATE = "accurate"
+    # greedy decoding, int8 linear layers and a cached prompt, for CPU-only nodes
+    CPU = "cpu"
+
+
+PROFILE_CONFIGS = {
+    Florence2PerformanceProfile.ACCURATE: {
+        "num_beams": 3,
+        "max_new_tokens": 1024,
+        "quantize": False,
+        "cache_prompt": False,
+        "report_throughput": False,
+    },
+    Florence2PerformanceProfile.CPU: {
+        "num_beams": 1,
+        "max_new_tokens": 1024,
+        "quantize": True,
+        "cache_prompt": True,
+        "report_throughput": True,
+    },
+}
+
 
 class Florence2OCREngine(OCREngine):
+    profile: Florence2PerformanceProfile
+    num_beams: int
+    max_new_tokens: int
+    quantize: bool
+    cache_prompt: bool
+    num_threads: int | None
+    report_throughput: bool
+
     def __init__(self, config: Dict[str, Any] = {}) -> None:
+        """
+        Config:
+            profile: Florence2PerformanceProfile, defaults for the options below
+            num_beams: 1 for greedy decoding
+            max_new_tokens: maximum tokens generated per image
+            quantize: dynamic int8 quantization of the linear layers (CPU only)
+            cache_prompt: tokenize and embed the prompt once instead of per call
+            num_threads: torch.set_num_threads, defaults to `threads`
+            report_throughput: print tokens/sec and images/sec after each batch
+            batch_size: images per `generate` call in `recognize_batch`
+            model_root, offline: model store the weights are downloaded to
+        """
+        self.configure_threads(config)
+        self.model_store = parse_model_store(config)
+
+        self.profile = config.get("profile", Florence2PerformanceProfile.ACCURATE)
+        if not isinstance(self.profile, Florence2PerformanceProfile):
+            raise ValueError("profile must be a Florence2PerformanceProfile")
+        profile_config = {**PROFILE_CONFIGS[self.profile], **config}
+
+        batch_size = config.get("batch_size", DEFAULT_BATCH_SIZE)
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.preferred_batch_size = batch_size
+        else:
+            raise ValueError("batch_size must be a positive integer")
+
+        for key in ["num_beams", "max_new_tokens"]:
+            value = profile_config[key]
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError(f"{key} must be a positive integer")
+        self.num_beams = profile_config["num_beams"]
+        self.max_new_tokens = profile_config["max_new_tokens"]
+
+        for key in ["quantize", "cache_prompt", "report_throughput"]:
+            if not isinstance(profile_config[key], bool):
+                raise ValueError(f"{key} must be a boolean")
+        self.quantize = profile_config["quantize"]
+        self.cache_prompt = profile_config["cache_prompt"]
+        self.report_throughput = profile_config["report_throughput"]
+
+        self.num_threads = config.get("num_threads", self.thread_config.threads)
+        if self.num_threads is not None and (
+            not isinstance(self.num_threads, int) or self.num_threads <= 0
+        ):
+            raise ValueError("num_threads must be a positive integer")
+
+        import torch
         from transformers import AutoProcessor, AutoModelForCausalLM
 
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+
         self.device = self.get_best_device()
         self.dtype = self.get_torch_dtype()
 
+        model_path = self.model_store.get_huggingface_model(
+            "microsoft/Florence-2-large"
+        )
         self.model = AutoModelForCausalLM.from_pretrained(
-            "microsoft/Florence-2-large", torch_dtype=self.dtype, trust_remote_code=True
+            model_path, torch_dtype=self.dtype, trust_remote_code=True
         ).to(self.device)
+        self.model.eval()
+        if self.quantize:
+            if str(self.device) != "cpu":
+                raise ValueError("quantize is only supported on CPU")
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
         self.processor = AutoProcessor.from_pretrained(
-            "microsoft/Florence-2-large", trust_remote_code=True
+            model_path, trust_remote_code=True
         )
         self.prompt = "<OCR_WITH_REGION>"
+        # Embeddings of the prompt tokens, computed on the first call
+        self.__prompt_embeds = None
+
+        self.recognized_images = 0
+        self.generated_tokens = 0
+        self.generation_time = 0.0
 
     def get_best_device(self):
         import torch
@@ -40,21 +144,98 @@ class Florence2OCREngine(OCREngine):
 
         return torch.float32
 
-    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
-        inputs = self.processor(text=self.prompt, images=image, return_tensors="pt").to(
-            self.device, self.dtype
-        )
-        generated_ids = self.model.generate(
-            input_ids=inputs["input_ids"],
-            pixel_values=inputs["pixel_values"],
-            max_new_tokens=1024,
-            num_beams=3,
-            do_sample=False,
+    def get_throughput(self) -> Tuple[float, float]:
+        """
+        Returns:
+            Tuple[float, float]: generated tokens per second and images per
+            second, since the engine was created
+        """
+        if self.generation_time == 0:
+            return 0.0, 0.0
+        return (
+            self.generated_tokens / self.generation_time,
+            self.recognized_images / self.generation_time,
         )
 
-        generated_text = self.processor.batch_decode(
-            generated_ids, skip_special_tokens=False
-        )[0]
+    def __generate(self, images: List[Image.Image]):
+        import torch
+
+        generation_config = {
+            "max_new_tokens": self.max_new_tokens,
+            "num_beams": self.num_beams,
+            "do_sample": False,
+        }
+
+        with torch.inference_mode():
+            if not self.cache_prompt or self.__prompt_embeds is None:
+                inputs = self.processor(
+                    text=[self.prompt] * len(images),
+                    images=images,
+                    return_tensors="pt",
+                ).to(self.device, self.dtype)
+                if self.cache_prompt:
+                    self.__prompt_embeds = self.model.get_input_embeddings()(
+                        inputs["input_ids"][:1]
+                    )
+                return self.model.generate(
+                    input_ids=inputs["input_ids"],
+                    pixel_values=inputs["pixel_values"],
+                    **generation_config,
+                )
+
+            # Same as Florence-2's generate, with the prompt embedded once:
+            # only the images go through the processor and the vision encoder
+            pixel_values = self.processor.image_processor(
+                images, return_tensors="pt"
+            )["pixel_values"].to(self.device, self.dtype)
+            image_features = self.model._encode_image(pixel_values)
+            inputs_embeds, _ = self.model._merge_input_ids_with_image_features(
+                image_features, self.__prompt_embeds.expand(len(images), -1, -1)
+            )
+            return self.model.language_model.generate(
+                input_ids=None,
+                inputs_embeds=inputs_embeds,
+                use_cache=True,
+                **generation_config,
+            )
+
+    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """Generate the text of `preferred_batch_size` images per model call"""
+        flat_ocr_results_for_each_image = []
+        for begin in range(0, len(images), self.preferred_batch_size):
+            batch_images = images[begin : begin + self.preferred_batch_size]
+
+            current_time = time.time()
+            generated_ids = self.__generate(batch_images)
+            self.generation_time += time.time() - current_time
+            self.recognized_images += len(batch_images)
+            # the first token of each sequence is the decoder start token
+            self.generated_tokens += int(
+                (generated_ids[:, 1:] != self.processor.tokenizer.pad_token_id).sum()
+            )
+
+            generated_texts = self.processor.batch_decode(
+                generated_ids, skip_special_tokens=False
+            )
+            for generated_text, image in zip(generated_texts, batch_images):
+                flat_ocr_results_for_each_image.append(
+                    self.__parse_generated_text(generated_text, image)
+                )
+
+        if self.report_throughput:
+            tokens_per_second, images_per_second = self.get_throughput()
+            print(
+                f"Florence-2: {tokens_per_second:.1f} tokens/sec, {images_per_second:.2f} images/sec"
+            )
+
+        return flat_ocr_results_for_each_image
+
+    def __parse_generated_text(
+        self, generated_text: str, image: Image.Image
+    ) -> List[FlatOCRResult]:
         parsed_answer = self.processor.post_process_generation(
             generated_text,
             task="<OCR_WITH_REGION>",
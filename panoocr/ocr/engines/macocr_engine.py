@@ -39,6 +39,7 @@ class MacOCREngine(OCREngine):
     recognition_level: str
 
     def __init__(self, config: Dict[str, Any] = {}) -> None:
+        self.configure_threads(config)
 
         # Parse language preference
         language_perference = config.get(
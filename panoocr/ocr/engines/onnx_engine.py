@@ -0,0 +1,459 @@
+from enum import Enum
+from typing import List, Dict, Any, Tuple
+from ..engine import OCREngine
+from ..models import FlatOCRResult, BoundingBox
+from ..model_store import parse_model_store
+from dataclasses import dataclass
+from PIL import Image
+import numpy as np
+import cv2
+import os
+
+
+class ONNXGraphOptimizationLevel(Enum):
+    DISABLE = "ORT_DISABLE_ALL"
+    BASIC = "ORT_ENABLE_BASIC"
+    EXTENDED = "ORT_ENABLE_EXTENDED"
+    ALL = "ORT_ENABLE_ALL"
+
+
+# PP-OCR detection and recognition models exported with paddle2onnx, and the
+# character dictionary of the recognition model, in this directory of the store
+MODEL_STORE_DIR = "onnx"
+DETECTION_MODEL_FILENAME = "det.onnx"
+RECOGNITION_MODEL_FILENAME = "rec.onnx"
+CHARACTER_DICT_FILENAME = "dict.txt"
+
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_RECOGNITION_BATCH_SIZE = 32
+# 0 lets onnxruntime use all the physical cores
+DEFAULT_INTRA_OP_THREADS = 0
+DEFAULT_INTER_OP_THREADS = 0
+DEFAULT_GRAPH_OPTIMIZATION_LEVEL = ONNXGraphOptimizationLevel.ALL
+DEFAULT_ENABLE_MEMORY_ARENA = True
+
+# Same pre and post processing as PaddleOCR's defaults (det_limit_side_len,
+# det_db_thresh, det_db_box_thresh, det_db_unclip_ratio, drop_score and
+# rec_image_shape)
+DETECTION_MAX_SIDE = 960
+DETECTION_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+DETECTION_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+BINARY_THRESHOLD = 0.3
+BOX_THRESHOLD = 0.6
+UNCLIP_RATIO = 1.5
+MAX_CANDIDATES = 1000
+MIN_BOX_SIDE = 3
+DROP_SCORE = 0.5
+RECOGNITION_HEIGHT = 48
+RECOGNITION_WIDTH = 320
+
+
+class ONNXOCREngine(OCREngine):
+    model_dir: str
+    intra_op_threads: int
+    inter_op_threads: int
+    graph_optimization_level: ONNXGraphOptimizationLevel
+    enable_memory_arena: bool
+
+    def __init__(self, config: Dict[str, Any] = {}) -> None:
+        """
+        Config:
+            model_dir: directory with det.onnx, rec.onnx and dict.txt, defaults
+                to onnx/ in the model store
+            model_root: directory of the model store
+            intra_op_threads: threads used inside an operator, defaults to
+                `threads`, 0 for all cores
+            inter_op_threads: threads used across operators, 0 for the default
+            graph_optimization_level: ONNXGraphOptimizationLevel
+            enable_memory_arena: reuse allocations across runs
+            batch_size: images per detection run in `recognize_batch`
+            recognition_batch_size: crops per recognition run
+        """
+        self.configure_threads(config)
+        self.model_store = parse_model_store(config)
+
+        model_dir = config.get("model_dir", self.model_store.get_path(MODEL_STORE_DIR))
+        if isinstance(model_dir, str):
+            self.model_dir = model_dir
+        else:
+            raise ValueError("model_dir must be a string")
+
+        # Exported models are never downloaded, check them before loading any
+        for filename in [
+            DETECTION_MODEL_FILENAME,
+            RECOGNITION_MODEL_FILENAME,
+            CHARACTER_DICT_FILENAME,
+        ]:
+            if not os.path.exists(os.path.join(self.model_dir, filename)):
+                raise FileNotFoundError(
+                    f"Model not found: {os.path.join(self.model_dir, filename)}"
+                )
+
+        for key, default in [
+            (
+                "intra_op_threads",
+                self.thread_config.threads or DEFAULT_INTRA_OP_THREADS,
+            ),
+            ("inter_op_threads", DEFAULT_INTER_OP_THREADS),
+        ]:
+            value = config.get(key, default)
+            if not isinstance(value, int) or value < 0:
+                raise ValueError(f"{key} must be a non-negative integer")
+            setattr(self, key, value)
+
+        graph_optimization_level = config.get(
+            "graph_optimization_level", DEFAULT_GRAPH_OPTIMIZATION_LEVEL
+        )
+        if isinstance(graph_optimization_level, ONNXGraphOptimizationLevel):
+            self.graph_optimization_level = graph_optimization_level
+        else:
+            raise ValueError(
+                "graph_optimization_level must be an ONNXGraphOptimizationLevel"
+            )
+
+        enable_memory_arena = config.get(
+            "enable_memory_arena", DEFAULT_ENABLE_MEMORY_ARENA
+        )
+        if isinstance(enable_memory_arena, bool):
+            self.enable_memory_arena = enable_memory_arena
+        else:
+            raise ValueError("enable_memory_arena must be a boolean")
+
+        batch_size = config.get("batch_size", DEFAULT_BATCH_SIZE)
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.preferred_batch_size = batch_size
+        else:
+            raise ValueError("batch_size must be a positive integer")
+
+        recognition_batch_size = config.get(
+            "recognition_batch_size", DEFAULT_RECOGNITION_BATCH_SIZE
+        )
+        if isinstance(recognition_batch_size, int) and recognition_batch_size > 0:
+            self.recognition_batch_size = recognition_batch_size
+        else:
+            raise ValueError("recognition_batch_size must be a positive integer")
+
+        # Index 0 is the CTC blank, PaddleOCR appends the space character. Every
+        # line is a character, including whitespace ones like the space of
+        # en_dict.txt, or the indices would shift
+        with open(
+            os.path.join(self.model_dir, CHARACTER_DICT_FILENAME), encoding="utf-8"
+        ) as f:
+            self.characters = ["blank"] + [line.rstrip("\r\n") for line in f] + [" "]
+
+        self.detection_session = self.__create_session(DETECTION_MODEL_FILENAME)
+        self.recognition_session = self.__create_session(RECOGNITION_MODEL_FILENAME)
+
+        output_size = self.recognition_session.get_outputs()[0].shape[-1]
+        if isinstance(output_size, int) and output_size != len(self.characters):
+            raise ValueError(
+                f"{CHARACTER_DICT_FILENAME} has {len(self.characters) - 2} characters, the recognition model expects {output_size - 2}"
+            )
+
+    def __create_session(self, filename: str):
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = self.intra_op_threads
+        session_options.inter_op_num_threads = self.inter_op_threads
+        session_options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, self.graph_optimization_level.value
+        )
+        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        session_options.enable_cpu_mem_arena = self.enable_memory_arena
+        session_options.enable_mem_pattern = self.enable_memory_arena
+
+        return ort.InferenceSession(
+            os.path.join(self.model_dir, filename),
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """
+        Detect the text of images of the same size in one run, then recognize
+        the crops of all the images together in runs of `recognition_batch_size`
+        """
+        # PP-OCR models are trained on BGR images, like PaddleOCR reads them
+        image_arrays = [
+            np.ascontiguousarray(np.array(image.convert("RGB"))[:, :, ::-1])
+            for image in images
+        ]
+
+        crops = []
+        crop_boxes = []
+        crop_image_indices = []
+        for image_index, boxes in enumerate(self.__detect(image_arrays)):
+            for box in boxes:
+                crops.append(get_rotate_crop_image(image_arrays[image_index], box))
+                crop_boxes.append(box)
+                crop_image_indices.append(image_index)
+
+        onnx_ocr_results_for_each_image = [[] for _ in images]
+        for box, image_index, (text, confidence) in zip(
+            crop_boxes, crop_image_indices, self.__recognize_crops(crops)
+        ):
+            if confidence < DROP_SCORE:
+                continue
+            image = images[image_index]
+            onnx_ocr_results_for_each_image[image_index].append(
+                ONNXOCRResult(
+                    text=text,
+                    confidence=confidence,
+                    bounding_box=box.tolist(),
+                    image_width=image.width,
+                    image_height=image.height,
+                )
+            )
+
+        return [
+            [onnx_ocr_result.to_flat() for onnx_ocr_result in onnx_ocr_results]
+            for onnx_ocr_results in onnx_ocr_results_for_each_image
+        ]
+
+    # MARK: Detection
+
+    def __detect(self, image_arrays: List[np.ndarray]) -> List[List[np.ndarray]]:
+        """
+        Returns:
+            List[List[np.ndarray]]: the 4x2 boxes of each image, top to bottom
+            and left to right
+        """
+        inputs = [get_detection_input(image_array) for image_array in image_arrays]
+        input_name = self.detection_session.get_inputs()[0].name
+
+        # Perspectives of a panorama share their size, so they stack into one run
+        indices_for_each_shape = {}
+        for i, (detection_input, _) in enumerate(inputs):
+            indices_for_each_shape.setdefault(detection_input.shape, []).append(i)
+
+        boxes_for_each_image = [[] for _ in image_arrays]
+        for indices in indices_for_each_shape.values():
+            for begin in range(0, len(indices), self.preferred_batch_size):
+                batch_indices = indices[begin : begin + self.preferred_batch_size]
+                probability_maps = self.detection_session.run(
+                    None,
+                    {input_name: np.stack([inputs[i][0] for i in batch_indices])},
+                )[0]
+                for i, probability_map in zip(batch_indices, probability_maps):
+                    boxes_for_each_image[i] = get_boxes_from_probability_map(
+                        probability_map[0],
+                        inputs[i][1],
+                        image_arrays[i].shape[:2],
+                    )
+
+        return boxes_for_each_image
+
+    # MARK: Recognition
+
+    def __recognize_crops(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        """CTC recognition of crops sorted by aspect ratio, so batches pad little"""
+        recognitions = [("", 0.0)] * len(crops)
+        order = np.argsort([crop.shape[1] / crop.shape[0] for crop in crops])
+        input_name = self.recognition_session.get_inputs()[0].name
+
+        for begin in range(0, len(crops), self.recognition_batch_size):
+            batch_indices = order[begin : begin + self.recognition_batch_size]
+            max_ratio = max(
+                RECOGNITION_WIDTH / RECOGNITION_HEIGHT,
+                max(crops[i].shape[1] / crops[i].shape[0] for i in batch_indices),
+            )
+            width = int(RECOGNITION_HEIGHT * max_ratio)
+            batch = np.stack(
+                [get_recognition_input(crops[i], width) for i in batch_indices]
+            )
+            probabilities = self.recognition_session.run(None, {input_name: batch})[0]
+            for i, recognition in zip(batch_indices, self.__ctc_decode(probabilities)):
+                recognitions[i] = recognition
+
+        return recognitions
+
+    def __ctc_decode(self, probabilities: np.ndarray) -> List[Tuple[str, float]]:
+        """Greedy CTC decoding of (batch, steps, characters) probabilities"""
+        indices = probabilities.argmax(axis=2)
+        max_probabilities = probabilities.max(axis=2)
+
+        recognitions = []
+        for sequence, sequence_probabilities in zip(indices, max_probabilities):
+            # drop repeated characters and blanks
+            keep = sequence != 0
+            keep[1:] &= sequence[1:] != sequence[:-1]
+            text = "".join(self.characters[index] for index in sequence[keep])
+            confidence = (
+                float(sequence_probabilities[keep].mean()) if keep.any() else 0.0
+            )
+            recognitions.append((text, confidence))
+        return recognitions
+
+
+def get_detection_input(
+    image_array: np.ndarray,
+) -> Tuple[np.ndarray, Tuple[float, float]]:
+    """
+    Resize so the longest side fits DETECTION_MAX_SIDE and both sides are
+    multiples of 32, then normalize to a CHW float array.
+
+    Returns:
+        Tuple[np.ndarray, Tuple[float, float]]: the input and the (height,
+        width) ratios from the input back to the image
+    """
+    height, width = image_array.shape[:2]
+    ratio = min(1.0, DETECTION_MAX_SIDE / max(height, width))
+    resized_height = max(int(round(height * ratio / 32) * 32), 32)
+    resized_width = max(int(round(width * ratio / 32) * 32), 32)
+
+    resized = cv2.resize(image_array, (resized_width, resized_height))
+    normalized = (resized.astype(np.float32) / 255 - DETECTION_MEAN) / DETECTION_STD
+    return normalized.transpose(2, 0, 1), (
+        height / resized_height,
+        width / resized_width,
+    )
+
+
+def get_boxes_from_probability_map(
+    probability_map: np.ndarray,
+    ratios: Tuple[float, float],
+    image_shape: Tuple[int, int],
+) -> List[np.ndarray]:
+    """DB post processing, the boxes are in the coordinates of the image"""
+    height_ratio, width_ratio = ratios
+    image_height, image_width = image_shape
+
+    bitmap = (probability_map > BINARY_THRESHOLD).astype(np.uint8)
+    contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours[:MAX_CANDIDATES]:
+        rect = cv2.minAreaRect(contour)
+        if min(rect[1]) < MIN_BOX_SIDE:
+            continue
+        box = order_box_points(cv2.boxPoints(rect))
+        if get_box_score(probability_map, box) < BOX_THRESHOLD:
+            continue
+
+        # Unclip: offset the rectangle by area * ratio / perimeter on each side
+        (center_x, center_y), (width, height), angle = rect
+        distance = width * height * UNCLIP_RATIO / (2 * (width + height))
+        width, height = width + 2 * distance, height + 2 * distance
+        if min(width, height) < MIN_BOX_SIDE + 2:
+            continue
+        box = order_box_points(
+            cv2.boxPoints(((center_x, center_y), (width, height), angle))
+        )
+
+        box[:, 0] = np.clip(np.round(box[:, 0] * width_ratio), 0, image_width)
+        box[:, 1] = np.clip(np.round(box[:, 1] * height_ratio), 0, image_height)
+        boxes.append(box)
+
+    # top to bottom, then left to right within a line
+    return sorted(boxes, key=lambda box: (box[0][1] // 10, box[0][0]))
+
+
+def order_box_points(points: np.ndarray) -> np.ndarray:
+    """Order 4 points as top left, top right, bottom right, bottom left"""
+    points = points[np.argsort(points[:, 0])]
+    left = points[:2][np.argsort(points[:2, 1])]
+    right = points[2:][np.argsort(points[2:, 1])]
+    return np.array([left[0], right[0], right[1], left[1]], dtype=np.float32)
+
+
+def get_box_score(probability_map: np.ndarray, box: np.ndarray) -> float:
+    """Mean probability inside the box"""
+    height, width = probability_map.shape
+    left = int(np.clip(np.floor(box[:, 0].min()), 0, width - 1))
+    right = int(np.clip(np.ceil(box[:, 0].max()), 0, width - 1))
+    top = int(np.clip(np.floor(box[:, 1].min()), 0, height - 1))
+    bottom = int(np.clip(np.ceil(box[:, 1].max()), 0, height - 1))
+
+    mask = np.zeros((bottom - top + 1, right - left + 1), dtype=np.uint8)
+    cv2.fillPoly(mask, [(box - [left, top]).astype(np.int32)], 1)
+    return cv2.mean(probability_map[top : bottom + 1, left : right + 1], mask)[0]
+
+
+def get_rotate_crop_image(image_array: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """Warp a box to an upright crop, vertical text is rotated to horizontal"""
+    crop_width = int(
+        max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3]))
+    )
+    crop_height = int(
+        max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2]))
+    )
+    crop_width, crop_height = max(crop_width, 1), max(crop_height, 1)
+    target = np.array(
+        [[0, 0], [crop_width, 0], [crop_width, crop_height], [0, crop_height]],
+        dtype=np.float32,
+    )
+    crop = cv2.warpPerspective(
+        image_array,
+        cv2.getPerspectiveTransform(box.astype(np.float32), target),
+        (crop_width, crop_height),
+        borderMode=cv2.BORDER_REPLICATE,
+        flags=cv2.INTER_CUBIC,
+    )
+    if crop_height / crop_width >= 1.5:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+def get_recognition_input(crop: np.ndarray, width: int) -> np.ndarray:
+    """Resize to RECOGNITION_HEIGHT keeping the aspect ratio, pad right to width"""
+    height, crop_width = crop.shape[:2]
+    resized_width = min(width, int(np.ceil(RECOGNITION_HEIGHT * crop_width / height)))
+    resized = cv2.resize(crop, (resized_width, RECOGNITION_HEIGHT))
+    normalized = (resized.astype(np.float32) / 255 - 0.5) / 0.5
+
+    recognition_input = np.zeros((3, RECOGNITION_HEIGHT, width), dtype=np.float32)
+    recognition_input[:, :, :resized_width] = normalized.transpose(2, 0, 1)
+    return recognition_input
+
+
+@dataclass
+class ONNXOCRResult:
+    text: str
+    bounding_box: List[List[float]]
+    confidence: float
+    image_width: int
+    image_height: int
+
+    def to_flat(self):
+        left = min(
+            self.bounding_box[0][0],
+            self.bounding_box[1][0],
+            self.bounding_box[2][0],
+            self.bounding_box[3][0],
+        )
+        right = max(
+            self.bounding_box[0][0],
+            self.bounding_box[1][0],
+            self.bounding_box[2][0],
+            self.bounding_box[3][0],
+        )
+        bottom = max(
+            self.bounding_box[0][1],
+            self.bounding_box[1][1],
+            self.bounding_box[2][1],
+            self.bounding_box[3][1],
+        )
+        top = min(
+            self.bounding_box[0][1],
+            self.bounding_box[1][1],
+            self.bounding_box[2][1],
+            self.bounding_box[3][1],
+        )
+
+        return FlatOCRResult(
+            text=self.text,
+            confidence=self.confidence,
+            bounding_box=BoundingBox(
+                left=left / self.image_width,
+                top=top / self.image_height,
+                right=right / self.image_width,
+                bottom=bottom / self.image_height,
+                width=(right - left) / self.image_width,
+                height=(bottom - top) / self.image_height,
+            ),
+            engine="ONNX_OCR",
+        )
@@ -1,7 +1,10 @@
+import math
+import time
 from enum import Enum
-from typing import List, Dict, Any
-from ..engine import OCREngine
+from typing import List, Dict, Any, Tuple
+from ..engine import OCREngine, get_image_fov
 from ..models import FlatOCRResult, BoundingBox
+from ..model_store import ModelArtifact, parse_model_store
 from dataclasses import dataclass
 from PIL import Image
 import numpy as np
@@ -18,6 +21,65 @@ class PaddleOCRLanguageCode(Enum):
 
 DEFAULT_LANGUAGE_PREFERENCE = PaddleOCRLanguageCode.ENGLISH
 DEFAULT_RECOGNIZE_UPSIDE_DOWN = False
+DEFAULT_BATCH_SIZE = 16
+# Crops per inference of the recognition model (PaddleOCR's rec_batch_num)
+DEFAULT_RECOGNITION_BATCH_SIZE = 32
+
+# Fixed sliding window detection, pass it as the `slice` config to use it for
+# every image instead of deriving the slicing from the perspectives
+SLICE = {
+    "horizontal_stride": 300,
+    "vertical_stride": 500,
+    "merge_x_thres": 50,
+    "merge_y_thres": 35,
+}
+
+# FOV of DEFAULT_IMAGE_PERSPECTIVES
+DEFAULT_FOV = 45
+# Smallest text to detect, as an angle of the panorama
+DEFAULT_MIN_TEXT_HEIGHT_DEGREES = 0.3
+# Text height in pixels the DB detector still finds after scaling the image down
+MIN_DETECTABLE_TEXT_HEIGHT = 8
+# The SLICE merge thresholds as angles, at the 2048px of the default perspectives
+MERGE_X_DEGREES = SLICE["merge_x_thres"] * DEFAULT_FOV / 2048
+MERGE_Y_DEGREES = SLICE["merge_y_thres"] * DEFAULT_FOV / 2048
+# Tiles per inference of the detection model
+DEFAULT_DETECTION_BATCH_SIZE = 8
+
+
+def get_slice_config(
+    image_width: int,
+    image_height: int,
+    horizontal_fov: float = DEFAULT_FOV,
+    vertical_fov: float = DEFAULT_FOV,
+    detection_limit_side_len: float = 960,
+    min_text_height_degrees: float = DEFAULT_MIN_TEXT_HEIGHT_DEGREES,
+) -> Dict[str, int]:
+    """
+    Slicing of a perspective, in the format of SLICE.
+
+    The detector scales images down to `detection_limit_side_len` and never up,
+    so a tile can be as large as the limit times the downscaling the smallest
+    text can take at the resolution of the perspective. Each side is split in
+    the fewest equal tiles under that size, views where one tile is enough are
+    not sliced.
+    """
+
+    def get_stride(size: int, fov: float) -> int:
+        text_height = size / fov * min_text_height_degrees
+        max_tile_size = detection_limit_side_len * max(
+            1.0, text_height / MIN_DETECTABLE_TEXT_HEIGHT
+        )
+        tile_count = math.ceil(size / max_tile_size)
+        return math.ceil(size / tile_count)
+
+    return {
+        "horizontal_stride": get_stride(image_width, horizontal_fov),
+        "vertical_stride": get_stride(image_height, vertical_fov),
+        "merge_x_thres": round(MERGE_X_DEGREES * image_width / horizontal_fov),
+        "merge_y_thres": round(MERGE_Y_DEGREES * image_height / vertical_fov),
+    }
+
 
 PP_OCR_V4_SERVER = {
     "detection_model": "https://paddleocr.bj.bcebos.com/models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer.tar",
@@ -27,6 +89,24 @@ PP_OCR_V4_SERVER = {
     "cls_model": "https://paddleocr.bj.bcebos.com/dygraph_v2.0/ch/ch_ppocr_mobile_v2.0_cls_slim_infer.tar",
 }
 
+PP_OCR_V4_SERVER_ARTIFACTS = {
+    "detection": ModelArtifact(
+        name="PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer",
+        url=PP_OCR_V4_SERVER["detection_model"],
+        extract=True,
+    ),
+    "recognition": ModelArtifact(
+        name="PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer",
+        url=PP_OCR_V4_SERVER["recognition_model"],
+        extract=True,
+    ),
+    "cls": ModelArtifact(
+        name="PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer",
+        url=PP_OCR_V4_SERVER["cls_model"],
+        extract=True,
+    ),
+}
+
 
 class PaddleOCREngine(OCREngine):
     language_preference: str
@@ -34,6 +114,14 @@ class PaddleOCREngine(OCREngine):
     use_v4_server: bool
 
     def __init__(self, config: Dict[str, Any] = {}) -> None:
+        """
+        Config:
+            model_root: directory of the model store, PaddleOCR's own models
+                are kept under paddleocr/ and the v4 server models under PP-OCRv4/
+            offline: fail if a model is missing instead of downloading it
+        """
+        self.configure_threads(config)
+        self.model_store = parse_model_store(config)
 
         # Parse language preference
         language_perference = config.get(
@@ -60,140 +148,353 @@ class PaddleOCREngine(OCREngine):
         else:
             raise ValueError("use_v4_server must be a boolean")
 
+        batch_size = config.get("batch_size", DEFAULT_BATCH_SIZE)
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.preferred_batch_size = batch_size
+        else:
+            raise ValueError("batch_size must be a positive integer")
+
+        recognition_batch_size = config.get(
+            "recognition_batch_size", DEFAULT_RECOGNITION_BATCH_SIZE
+        )
+        if isinstance(recognition_batch_size, int) and recognition_batch_size > 0:
+            self.recognition_batch_size = recognition_batch_size
+        else:
+            raise ValueError("recognition_batch_size must be a positive integer")
+
+        # Parse slicing
+        self.slice = config.get("slice", None)
+        if self.slice is not None and not set(SLICE) <= set(self.slice):
+            raise ValueError(f"slice must have the keys {list(SLICE)}")
+
+        # FOV of the images without one set with `set_image_fov`, to derive
+        # the slicing from their resolution
+        horizontal_fov = config.get("horizontal_fov", DEFAULT_FOV)
+        if isinstance(horizontal_fov, (int, float)) and horizontal_fov > 0:
+            self.horizontal_fov = horizontal_fov
+        else:
+            raise ValueError("horizontal_fov must be a positive number")
+
+        vertical_fov = config.get("vertical_fov", DEFAULT_FOV)
+        if isinstance(vertical_fov, (int, float)) and vertical_fov > 0:
+            self.vertical_fov = vertical_fov
+        else:
+            raise ValueError("vertical_fov must be a positive number")
+
+        min_text_height_degrees = config.get(
+            "min_text_height_degrees", DEFAULT_MIN_TEXT_HEIGHT_DEGREES
+        )
+        if (
+            isinstance(min_text_height_degrees, (int, float))
+            and min_text_height_degrees > 0
+        ):
+            self.min_text_height_degrees = min_text_height_degrees
+        else:
+            raise ValueError("min_text_height_degrees must be a positive number")
+
+        detection_batch_size = config.get(
+            "detection_batch_size", DEFAULT_DETECTION_BATCH_SIZE
+        )
+        if isinstance(detection_batch_size, int) and detection_batch_size > 0:
+            self.detection_batch_size = detection_batch_size
+        else:
+            raise ValueError("detection_batch_size must be a positive integer")
+
+        report_timing = config.get("report_timing", False)
+        if isinstance(report_timing, bool):
+            self.report_timing = report_timing
+        else:
+            raise ValueError("report_timing must be a boolean")
+
+        self.detected_megapixels = 0.0
+        self.detected_tiles = 0
+        self.detection_time = 0.0
+        self.recognition_time = 0.0
+        # Slicing of each image size
+        self.__slice_configs = {}
+
         from paddleocr import PaddleOCR
 
+        # Inference threads when running on CPU
+        thread_config = {}
+        if self.thread_config.threads is not None:
+            thread_config["cpu_threads"] = self.thread_config.threads
+
         if not self.use_v4_server:
+            # PaddleOCR downloads its models of the language into these
+            # directories when they are empty
+            model_dirs = {
+                "det_model_dir": f"paddleocr/det/{self.language_preference}",
+                "rec_model_dir": f"paddleocr/rec/{self.language_preference}",
+                "cls_model_dir": "paddleocr/cls",
+            }
+            if self.model_store.offline:
+                for model_dir in model_dirs.values():
+                    self.model_store.require(f"{model_dir}/inference.pdmodel")
+
             self.ocr = PaddleOCR(
                 use_angle_cls=self.recognize_upside_down,
                 lang=self.language_preference,
                 use_gpu=True,
+                rec_batch_num=self.recognition_batch_size,
+                **{
+                    key: self.model_store.get_path(model_dir)
+                    for key, model_dir in model_dirs.items()
+                },
+                **thread_config,
             )
         else:
-            # if use v4 server, download the model
-            self.__download_v4_server_models()
+            model_dirs = {
+                key: self.model_store.fetch(artifact)
+                for key, artifact in PP_OCR_V4_SERVER_ARTIFACTS.items()
+            }
 
             self.ocr = PaddleOCR(
                 use_angle_cls=self.recognize_upside_down,
                 # lang=self.language_preference,
-                det_model_dir="./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer",
+                det_model_dir=model_dirs["detection"],
                 det_algorithm="DB",
-                rec_model_dir="./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer",
+                rec_model_dir=model_dirs["recognition"],
                 rec_algorithm="CRNN",
-                cls_model_dir="./models/PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer",
+                cls_model_dir=model_dirs["cls"],
                 use_gpu=True,
+                rec_batch_num=self.recognition_batch_size,
+                **thread_config,
             )
 
-    def __download_v4_server_models(self):
-        import os
-        import requests
-        import tarfile
-
-        if not os.path.exists("PP-OCRv4"):
-            os.makedirs("PP-OCRv4")
-
-        if not os.path.exists("./models/PP-OCRv4/chinese"):
-            os.makedirs("./models/PP-OCRv4/chinese")
+    def get_slice_config(
+        self,
+        image_width: int,
+        image_height: int,
+        fov: Tuple[float, float] | None = None,
+    ) -> Dict[str, int]:
+        """fov: horizontal and vertical FOV of the image, defaults to the config's"""
+        if self.slice is not None:
+            return self.slice
+
+        if fov is None:
+            fov = (self.horizontal_fov, self.vertical_fov)
+        key = (image_width, image_height, fov)
+        if key not in self.__slice_configs:
+            self.__slice_configs[key] = get_slice_config(
+                image_width,
+                image_height,
+                horizontal_fov=fov[0],
+                vertical_fov=fov[1],
+                detection_limit_side_len=self.ocr.args.det_limit_side_len,
+                min_text_height_degrees=self.min_text_height_degrees,
+            )
+        return self.__slice_configs[key]
+
+    def get_time_per_megapixel(self) -> Tuple[float, float]:
+        """
+        Returns:
+            Tuple[float, float]: detection and recognition time in milliseconds
+            per megapixel, since the engine was created
+        """
+        if self.detected_megapixels == 0:
+            return 0.0, 0.0
+        return (
+            self.detection_time * 1000 / self.detected_megapixels,
+            self.recognition_time * 1000 / self.detected_megapixels,
+        )
 
-        if not os.path.exists(
-            "./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer.tar"
-        ):
-            print("Downloading detection model")
-            r = requests.get(PP_OCR_V4_SERVER["detection_model"], allow_redirects=True)
-            open(
-                "./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer.tar", "wb"
-            ).write(r.content)
-
-        if not os.path.exists("./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer"):
-            print("Extracting detection model")
-            with tarfile.open(
-                "./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_server_infer.tar"
-            ) as tar:
-                tar.extractall("./models/PP-OCRv4/chinese")
-
-        if not os.path.exists(
-            "./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer.tar"
+    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
+        return self.recognize_batch([image])[0]
+
+    def __detect_tiles(
+        self, tiles: List[np.ndarray], tile_shapes: List[Tuple[int, int]]
+    ) -> List[np.ndarray]:
+        """
+        Run the detector on the tiles, `detection_batch_size` tiles of the same
+        slicing per inference. Edge tiles are padded to the full tile size.
+
+        Returns:
+            List[np.ndarray]: the boxes of each tile, in tile coordinates
+        """
+        from ppocr.data import transform
+
+        detector = self.ocr.text_detector
+        if (
+            detector.det_algorithm not in ["DB", "DB++"]
+            or detector.args.det_box_type != "quad"
         ):
-            print("Downloading recognition model")
-            r = requests.get(
-                PP_OCR_V4_SERVER["recognition_model"], allow_redirects=True
-            )
-            open(
-                "./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer.tar", "wb"
-            ).write(r.content)
-        if not os.path.exists("./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer"):
-            print("Extracting recognition model")
-            with tarfile.open(
-                "./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_server_infer.tar"
-            ) as tar:
-                tar.extractall("./models/PP-OCRv4/chinese")
-
-        if not os.path.exists("./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_teacher.yml"):
-            print("Downloading detection yml")
-            r = requests.get(PP_OCR_V4_SERVER["detection_yml"], allow_redirects=True)
-            open("./models/PP-OCRv4/chinese/ch_PP-OCRv4_det_teacher.yml", "wb").write(
-                r.content
-            )
+            return [detector(tile, use_slice=True)[0] for tile in tiles]
+
+        indices_for_each_shape = {}
+        for i, tile_shape in enumerate(tile_shapes):
+            indices_for_each_shape.setdefault(tile_shape, []).append(i)
+
+        boxes_for_each_tile = [None] * len(tiles)
+        for (tile_height, tile_width), indices in indices_for_each_shape.items():
+            for begin in range(0, len(indices), self.detection_batch_size):
+                batch_indices = indices[begin : begin + self.detection_batch_size]
+
+                inputs = []
+                shapes = []
+                for i in batch_indices:
+                    padded_tile = np.zeros(
+                        (tile_height, tile_width, 3), dtype=tiles[i].dtype
+                    )
+                    padded_tile[: tiles[i].shape[0], : tiles[i].shape[1]] = tiles[i]
+                    detection_input, shape = transform(
+                        {"image": padded_tile}, detector.preprocess_op
+                    )
+                    inputs.append(detection_input)
+                    shapes.append(shape)
+                inputs = np.stack(inputs)
+
+                # Same inference as `TextDetector.predict`, with a batch
+                if detector.use_onnx:
+                    outputs = detector.predictor.run(
+                        detector.output_tensors, {detector.input_tensor.name: inputs}
+                    )
+                else:
+                    detector.input_tensor.copy_from_cpu(inputs)
+                    detector.predictor.run()
+                    outputs = [
+                        output_tensor.copy_to_cpu()
+                        for output_tensor in detector.output_tensors
+                    ]
+
+                post_results = detector.postprocess_op(
+                    {"maps": outputs[0]}, np.stack(shapes)
+                )
+                for i, post_result in zip(batch_indices, post_results):
+                    boxes_for_each_tile[i] = np.asarray(
+                        detector.filter_tag_det_res(
+                            post_result["points"], tiles[i].shape
+                        ),
+                        dtype=np.float32,
+                    )
 
-        if not os.path.exists("./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_hgnet.yml"):
-            print("Downloading recognition yml")
-            r = requests.get(PP_OCR_V4_SERVER["recognition_yml"], allow_redirects=True)
-            open("./models/PP-OCRv4/chinese/ch_PP-OCRv4_rec_hgnet.yml", "wb").write(
-                r.content
+        return boxes_for_each_tile
+
+    def __detect(
+        self,
+        image_arrays: List[np.ndarray],
+        fovs: List[Tuple[float, float] | None],
+    ) -> List[List[np.ndarray]]:
+        """
+        Sliding window detection like `PaddleOCR.ocr(..., slice=...)`, with the
+        slicing of each image from `get_slice_config` and the tiles of all the
+        images detected together.
+        """
+        from tools.infer.utility import slice_generator, merge_fragmented
+        from tools.infer.predict_system import sorted_boxes
+
+        slice_configs = []
+        tiles = []
+        tile_shapes = []
+        tile_origins = []
+        for image_index, image_array in enumerate(image_arrays):
+            slice_config = self.get_slice_config(
+                image_array.shape[1], image_array.shape[0], fovs[image_index]
             )
+            slice_configs.append(slice_config)
+            for tile, v_start, h_start in slice_generator(
+                image_array,
+                horizontal_stride=slice_config["horizontal_stride"],
+                vertical_stride=slice_config["vertical_stride"],
+            ):
+                tiles.append(tile)
+                tile_shapes.append(
+                    (
+                        min(slice_config["vertical_stride"], image_array.shape[0]),
+                        min(slice_config["horizontal_stride"], image_array.shape[1]),
+                    )
+                )
+                tile_origins.append((image_index, v_start, h_start))
+        self.detected_tiles += len(tiles)
 
-        if not os.path.exists(
-            "./models/PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer.tar"
-        ):
-            print("Downloading cls model")
-            r = requests.get(PP_OCR_V4_SERVER["cls_model"], allow_redirects=True)
-            open(
-                "./models/PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer.tar",
-                "wb",
-            ).write(r.content)
-        if not os.path.exists(
-            "./models/PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer"
+        boxes_for_each_image = [[] for _ in image_arrays]
+        for boxes, (image_index, v_start, h_start) in zip(
+            self.__detect_tiles(tiles, tile_shapes), tile_origins
         ):
-            print("Extracting cls model")
-            with tarfile.open(
-                "./models/PP-OCRv4/chinese/ch_ppocr_mobile_v2.0_cls_slim_infer.tar"
-            ) as tar:
-                tar.extractall("./models/PP-OCRv4/chinese")
+            if boxes.size:
+                boxes[:, :, 0] += h_start
+                boxes[:, :, 1] += v_start
+                boxes_for_each_image[image_index].append(boxes)
 
-    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
-        image_array = np.array(image)
-        slice = {
-            "horizontal_stride": 300,
-            "vertical_stride": 500,
-            "merge_x_thres": 50,
-            "merge_y_thres": 35,
-        }
-        annotations = self.ocr.ocr(image_array, cls=True, slice=slice)
-        paddle_ocr_results = []
-
-        for annotation in annotations:
-            if not isinstance(annotation, list):
+        for image_index, slice_boxes in enumerate(boxes_for_each_image):
+            if not slice_boxes:
                 continue
+            boxes = merge_fragmented(
+                boxes=np.concatenate(slice_boxes),
+                x_threshold=slice_configs[image_index]["merge_x_thres"],
+                y_threshold=slice_configs[image_index]["merge_y_thres"],
+            )
+            boxes_for_each_image[image_index] = sorted_boxes(boxes)
+        return boxes_for_each_image
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """
+        Detect the tiles of all the images together, then classify and
+        recognize the crops of all the images together, so the recognition
+        model runs on full batches of `recognition_batch_size` crops instead of
+        the few crops of a single view.
+        """
+        from tools.infer.utility import get_rotate_crop_image, get_minarea_rect_crop
+
+        image_arrays = [np.array(image) for image in images]
+
+        current_time = time.time()
+        boxes_for_each_image = self.__detect(
+            image_arrays, [get_image_fov(image) for image in images]
+        )
+        self.detection_time += time.time() - current_time
+        self.detected_megapixels += sum(
+            image.width * image.height / 1e6 for image in images
+        )
 
-            for res in annotation:
-                boundingbox = res[0]
-                text = res[1][0]
-                confidence = res[1][1]
-                paddle_ocr_results.append(
+        crops = []
+        crop_boxes = []
+        crop_image_indices = []
+        for image_index, boxes in enumerate(boxes_for_each_image):
+            image_array = image_arrays[image_index]
+            for box in boxes:
+                if self.ocr.args.det_box_type == "quad":
+                    crops.append(get_rotate_crop_image(image_array, box.copy()))
+                else:
+                    crops.append(get_minarea_rect_crop(image_array, box.copy()))
+                crop_boxes.append(box)
+                crop_image_indices.append(image_index)
+
+        paddle_ocr_results_for_each_image = [[] for _ in images]
+        if crops:
+            current_time = time.time()
+            if self.ocr.use_angle_cls:
+                crops, _, _ = self.ocr.text_classifier(crops)
+            recognitions, _ = self.ocr.text_recognizer(crops)
+            self.recognition_time += time.time() - current_time
+
+            for box, image_index, (text, confidence) in zip(
+                crop_boxes, crop_image_indices, recognitions
+            ):
+                if confidence < self.ocr.drop_score:
+                    continue
+                image = images[image_index]
+                paddle_ocr_results_for_each_image[image_index].append(
                     PaddleOCRResult(
                         text=text,
                         confidence=confidence,
-                        bounding_box=boundingbox,
+                        bounding_box=box.tolist(),
                         image_width=image.width,
                         image_height=image.height,
                         use_v4_server=(self.use_v4_server),
                     )
                 )
 
-        flat_ocr_results = [
-            paddle_ocr_result.to_flat() for paddle_ocr_result in paddle_ocr_results
-        ]
+        if self.report_timing:
+            detection_ms, recognition_ms = self.get_time_per_megapixel()
+            print(
+                f"PaddleOCR: {self.detected_tiles} tiles, {detection_ms:.0f} ms/MP detection, {recognition_ms:.0f} ms/MP recognition"
+            )
 
-        return flat_ocr_results
+        return [
+            [paddle_ocr_result.to_flat() for paddle_ocr_result in paddle_ocr_results]
+            for paddle_ocr_results in paddle_ocr_results_for_each_image
+        ]
 
 
 @dataclass
@@ -0,0 +1,76 @@
+from typing import List, Dict, Any
+from ..engine import OCREngine
+from ..models import FlatOCRResult
+from ..inference_server import (
+    DEFAULT_ADDRESS,
+    parse_address,
+    load_authkey,
+    check_authkey,
+)
+from PIL import Image
+import threading
+
+
+class RemoteOCREngine(OCREngine):
+    """Client of an `OCRInferenceServer`, recognizes images with its engine"""
+
+    address: str
+    batch_size: int
+
+    def __init__(self, config: Dict[str, Any] = {}) -> None:
+        """
+        Config:
+            address: Unix socket path or host:port of the server
+            authkey: key the server was started with, defaults to `load_authkey`
+            batch_size: images per request, defaults to the server's batch size
+            threads, cpu_affinity: applied to this process, which still runs e2p
+        """
+        self.configure_threads(config)
+
+        address = config.get("address", DEFAULT_ADDRESS)
+        if isinstance(address, str):
+            self.address = address
+        else:
+            raise ValueError("address must be a string")
+
+        authkey = config.get("authkey", None)
+        if authkey is None:
+            authkey = load_authkey()
+        elif isinstance(authkey, bytes):
+            check_authkey(authkey)
+        else:
+            raise ValueError("authkey must be bytes")
+
+        from multiprocessing.connection import Client
+
+        self._lock = threading.Lock()
+        self._connection = Client(parse_address(self.address), authkey=authkey)
+
+        info = self.__request(("info",))
+        self.server_engine = info["engine"]
+        # Engine and config of the server, for the key of `CachedOCREngine`
+        self.server_engine_key = info["engine_key"]
+
+        batch_size = config.get("batch_size", info["preferred_batch_size"])
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.preferred_batch_size = batch_size
+        else:
+            raise ValueError("batch_size must be a positive integer")
+
+    def __request(self, request):
+        with self._lock:
+            self._connection.send(request)
+            status, response = self._connection.recv()
+        if status != "ok":
+            raise RuntimeError(f"OCR inference server error: {response}")
+        return response
+
+    def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images: List[Image.Image]) -> List[List[FlatOCRResult]]:
+        """The server may batch the images together with those of other clients"""
+        return self.__request(("recognize", images))
+
+    def close(self) -> None:
+        self._connection.close()
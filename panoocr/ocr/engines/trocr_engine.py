@@ -2,6 +2,7 @@ from enum import Enum
 from typing import List, Dict, Any
 from ..engine import OCREngine
 from ..models import FlatOCRResult, BoundingBox
+from ..model_store import parse_model_store
 from dataclasses import dataclass
 from PIL import Image
 import numpy as np
@@ -18,6 +19,8 @@ class TrOCREngine(OCREngine):
     model: str
 
     def __init__(self, config: Dict[str, Any] = {}) -> None:
+        self.configure_threads(config)
+        self.model_store = parse_model_store(config)
 
         # Parse model
         model = config.get("model", DEFAULT_MODEL)
@@ -29,8 +32,14 @@ class TrOCREngine(OCREngine):
 
         from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 
-        self.processor = TrOCRProcessor.from_pretrained(self.model)
-        self.model = VisionEncoderDecoderModel.from_pretrained(self.model)
+        if self.thread_config.threads is not None:
+            import torch
+
+            torch.set_num_threads(self.thread_config.threads)
+
+        model_path = self.model_store.get_huggingface_model(self.model)
+        self.processor = TrOCRProcessor.from_pretrained(model_path)
+        self.model = VisionEncoderDecoderModel.from_pretrained(model_path)
 
     def recognize(self, image: Image.Image) -> List[FlatOCRResult]:
         pixel_values = self.processor(images=image, return_tensors="pt").pixel_values
@@ -0,0 +1,241 @@
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Connection
+from typing import Any, Dict, List, Tuple
+from PIL import Image
+from .engine import OCREngine
+from .engines.cached_engine import get_engine_key
+
+# Unix socket path, or host:port for TCP on localhost
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# Requests are pickled, so a client knowing the key can run code in the
+# server. The key is read from this variable, or else from the key file, which
+# the server generates readable by its user only
+AUTHKEY_ENVIRONMENT_VARIABLE = "PANOOCR_OCR_SERVER_AUTHKEY"
+DEFAULT_AUTHKEY_PATH = "~/.panoocr/ocr-server.key"
+MIN_AUTHKEY_LENGTH = 16
+DEFAULT_MAX_WAIT_SECONDS = 0.02
+DEFAULT_REPORT_INTERVAL = 30
+
+# Stops the batching loop
+_STOP = object()
+
+
+def load_authkey(path: str = DEFAULT_AUTHKEY_PATH, create: bool = False) -> bytes:
+    """
+    Key shared by the server and its clients, from AUTHKEY_ENVIRONMENT_VARIABLE
+    or the key file at `path`.
+
+    create: generate the key file if it doesn't exist (the server does, the
+        clients of the same user then read it)
+    """
+    authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE)
+    if authkey is not None:
+        return check_authkey(authkey.encode())
+
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        if not create:
+            raise FileNotFoundError(
+                f"No OCR server key: set {AUTHKEY_ENVIRONMENT_VARIABLE} or start the server to create {path}"
+            )
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        try:
+            file_descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(file_descriptor, "w") as f:
+                f.write(secrets.token_hex(32))
+            print(f"Generated the OCR server key in {path}")
+        except FileExistsError:
+            # Created by another process in the meantime
+            pass
+
+    if os.name == "posix" and os.stat(path).st_mode & 0o077:
+        raise PermissionError(
+            f"{path} is readable by other users, restrict it with chmod 600"
+        )
+    with open(path) as f:
+        return check_authkey(f.read().strip().encode())
+
+
+def check_authkey(authkey: bytes) -> bytes:
+    if len(authkey) < MIN_AUTHKEY_LENGTH:
+        raise ValueError(
+            f"The OCR server key must be at least {MIN_AUTHKEY_LENGTH} bytes long"
+        )
+    return authkey
+
+
+def parse_address(address: str) -> str | Tuple[str, int]:
+    """`host:port` for TCP, anything else is the path of a Unix socket"""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class OCRInferenceServer:
+    """
+    Hosts one OCR engine for many local clients (see `RemoteOCREngine`), so
+    the model is loaded once instead of once per worker process.
+
+    Every connection is served by its own thread, which queues the images of
+    each request. A single thread takes the queued images of all clients and
+    recognizes them in batches of up to `max_batch_size`, waiting at most
+    `max_wait_seconds` after the first image for a batch to fill up.
+    """
+
+    engine: OCREngine
+    address: str | Tuple[str, int]
+    max_batch_size: int
+    max_wait_seconds: float
+
+    def __init__(
+        self,
+        engine: OCREngine,
+        address: str = DEFAULT_ADDRESS,
+        max_batch_size: int | None = None,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+        authkey: bytes | None = None,
+        report_interval: float = DEFAULT_REPORT_INTERVAL,
+        engine_config: Dict[str, Any] = {},
+    ):
+        """
+        max_batch_size: images per `recognize_batch`, defaults to the engine's preferred batch size
+        authkey: defaults to `load_authkey`, which generates the key file if needed
+        engine_config: config the engine was created with, so clients caching
+            the results key them on the server's engine
+        """
+        self.engine = engine
+        self.engine_key = get_engine_key(engine, engine_config)
+        self.address = parse_address(address)
+        self.max_batch_size = max_batch_size or engine.preferred_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.authkey = (
+            load_authkey(create=True) if authkey is None else check_authkey(authkey)
+        )
+        self.report_interval = report_interval
+
+        self.recognized_images = 0
+        self.batches = 0
+        self.recognition_time = 0.0
+
+        self._queue = queue.Queue()
+        self._listener = None
+
+    def report(self) -> str:
+        if self.batches == 0:
+            return "no batches yet"
+        return f"{self.recognized_images} images in {self.batches} batches (average {self.recognized_images / self.batches:.1f}), {self.recognized_images / self.recognition_time:.2f} images/sec"
+
+    def serve_forever(self) -> None:
+        """Accept clients in the background and run the batches on this thread"""
+        self._listener = Listener(self.address, authkey=self.authkey)
+        print(f"OCR inference server listening on {self.address}")
+        threading.Thread(target=self.__accept, name="accept", daemon=True).start()
+        try:
+            self.__run_batches()
+        finally:
+            self._listener.close()
+
+    def stop(self) -> None:
+        self._queue.put(_STOP)
+
+    def __accept(self) -> None:
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                # closed by `serve_forever`
+                break
+            except Exception as e:
+                print(f"Rejected client: {e}")
+                continue
+            threading.Thread(
+                target=self.__serve, args=(connection,), daemon=True
+            ).start()
+
+    def __serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+
+                command = request[0]
+                if command == "info":
+                    connection.send(
+                        (
+                            "ok",
+                            {
+                                "engine": type(self.engine).__name__,
+                                "engine_key": self.engine_key,
+                                "preferred_batch_size": self.max_batch_size,
+                            },
+                        )
+                    )
+                elif command == "recognize":
+                    try:
+                        connection.send(("ok", self.__recognize(request[1])))
+                    except Exception as e:
+                        connection.send(("error", str(e)))
+                else:
+                    connection.send(("error", f"Unknown command: {command}"))
+
+    def __recognize(self, images: List[Image.Image]):
+        futures = []
+        for image in images:
+            future = Future()
+            self._queue.put((image, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def __run_batches(self) -> None:
+        last_report_time = time.time()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            # Wait a little for other clients, then run whatever was queued
+            batch = [item]
+            deadline = time.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            current_time = time.time()
+            try:
+                flat_ocr_results_for_each_image = self.engine.recognize_batch(
+                    [image for image, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.recognition_time += time.time() - current_time
+            self.recognized_images += len(batch)
+            self.batches += 1
+
+            for (_, future), flat_ocr_results in zip(
+                batch, flat_ocr_results_for_each_image
+            ):
+                future.set_result(flat_ocr_results)
+
+            if time.time() - last_report_time > self.report_interval:
+                print(f"OCR inference server: {self.report()}")
+                last_report_time = time.time()
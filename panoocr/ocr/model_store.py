@@ -0,0 +1,230 @@
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict
+
+# Defaults of the `model_root` and `offline` engine config keys, so air-gapped
+# nodes can be set up once in their environment
+DEFAULT_MODEL_ROOT = os.environ.get("PANOOCR_MODEL_ROOT", "./models")
+DEFAULT_OFFLINE = os.environ.get("PANOOCR_OFFLINE", "0").lower() in ["1", "true"]
+
+# Written next to each artifact, with the sha256 of each of its files
+CHECKSUMS_FILENAME = ".checksums.json"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ModelArtifact:
+    # Path of the artifact relative to the root of the store
+    name: str
+    url: str
+    # sha256 of the downloaded file, None to trust the first download
+    sha256: str | None = None
+    # Extract the tar archive into a directory instead of keeping the file
+    extract: bool = False
+
+
+def get_file_sha256(path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_directory_checksums(directory: str) -> Dict[str, str]:
+    checksums = {}
+    for parent, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(parent, filename)
+            relative_path = os.path.relpath(path, directory)
+            if relative_path != CHECKSUMS_FILENAME:
+                checksums[relative_path] = get_file_sha256(path)
+    return checksums
+
+
+class ModelStore:
+    """
+    Model files of the engines under one root directory.
+
+    Artifacts are downloaded in chunks to a temporary file next to their
+    destination, checked against their sha256 and moved in place with an
+    atomic rename, so an interrupted download or a concurrent worker never
+    leaves a partial model behind. The checksums of the files are recorded
+    with the artifact and checked again when it is loaded.
+
+    In offline mode nothing is downloaded, a missing artifact raises
+    FileNotFoundError before any model is loaded.
+    """
+
+    root: str
+    offline: bool
+
+    def __init__(self, root: str = DEFAULT_MODEL_ROOT, offline: bool = DEFAULT_OFFLINE):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.offline = offline
+
+        if self.offline:
+            # Also keeps transformers from checking for updates of remote code
+            os.environ["HF_HUB_OFFLINE"] = "1"
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def require(self, name: str) -> str:
+        """Path of files provided by hand (e.g. exported models), which must exist"""
+        path = self.get_path(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model not found: {path}")
+        return path
+
+    def fetch(self, artifact: ModelArtifact) -> str:
+        """
+        Returns:
+            str: path of the file, or of the directory of an extracted archive
+        """
+        path = self.get_path(artifact.name)
+        if os.path.exists(path):
+            self.verify(path)
+            return path
+
+        if self.offline:
+            raise FileNotFoundError(
+                f"Model not found in offline mode: {path}, copy it from a model root where it was downloaded ({artifact.url})"
+            )
+
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        download_path = self.__download(artifact, parent)
+        try:
+            if artifact.extract:
+                self.__extract_and_move(download_path, path)
+            else:
+                with open(path + ".sha256", "w") as f:
+                    f.write(get_file_sha256(download_path))
+                os.replace(download_path, path)
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+        return path
+
+    def verify(self, path: str) -> None:
+        """Check the files of an artifact against the checksums recorded when it was downloaded"""
+        if os.path.isdir(path):
+            checksums_path = os.path.join(path, CHECKSUMS_FILENAME)
+            if not os.path.exists(checksums_path):
+                # Placed by hand or by an older version, nothing to check against
+                return
+            with open(checksums_path) as f:
+                checksums = json.load(f)
+            if get_directory_checksums(path) != checksums:
+                raise RuntimeError(
+                    f"Model is corrupted: {path}, delete it to download it again"
+                )
+        elif os.path.exists(path + ".sha256"):
+            with open(path + ".sha256") as f:
+                sha256 = f.read().strip()
+            if get_file_sha256(path) != sha256:
+                raise RuntimeError(
+                    f"Model is corrupted: {path}, delete it to download it again"
+                )
+
+    def __download(self, artifact: ModelArtifact, directory: str) -> str:
+        import requests
+
+        print(f"Downloading {artifact.url}")
+        file_hash = hashlib.sha256()
+        file_descriptor, download_path = tempfile.mkstemp(
+            dir=directory, suffix=".download"
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as f, requests.get(
+                artifact.url, stream=True, allow_redirects=True, timeout=60
+            ) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    file_hash.update(chunk)
+        except BaseException:
+            os.remove(download_path)
+            raise
+
+        sha256 = file_hash.hexdigest()
+        if artifact.sha256 is not None and sha256 != artifact.sha256:
+            os.remove(download_path)
+            raise RuntimeError(
+                f"Checksum mismatch for {artifact.url}: expected {artifact.sha256}, got {sha256}"
+            )
+        return download_path
+
+    def __extract_and_move(self, archive_path: str, path: str) -> None:
+        extract_directory = tempfile.mkdtemp(
+            dir=os.path.dirname(path), suffix=".extract"
+        )
+        try:
+            with tarfile.open(archive_path) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(extract_directory, filter="data")
+                else:
+                    tar.extractall(extract_directory)
+
+            # Archives usually hold a single directory named like the artifact
+            entries = os.listdir(extract_directory)
+            content_directory = extract_directory
+            if len(entries) == 1 and os.path.isdir(
+                os.path.join(extract_directory, entries[0])
+            ):
+                content_directory = os.path.join(extract_directory, entries[0])
+
+            with open(os.path.join(content_directory, CHECKSUMS_FILENAME), "w") as f:
+                json.dump(get_directory_checksums(content_directory), f, indent=2)
+
+            try:
+                os.rename(content_directory, path)
+            except OSError:
+                # Another worker moved the same artifact in place first
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(extract_directory, ignore_errors=True)
+
+    def get_huggingface_model(self, repo_id: str, revision: str | None = None) -> str:
+        """
+        Download a Hugging Face model into the store, in offline mode only the
+        copy already in the store is used.
+
+        Returns:
+            str: local directory to pass to `from_pretrained`
+        """
+        from huggingface_hub import snapshot_download
+
+        try:
+            return snapshot_download(
+                repo_id,
+                revision=revision,
+                cache_dir=self.get_path("huggingface"),
+                local_files_only=self.offline,
+            )
+        except Exception as e:
+            if self.offline:
+                raise FileNotFoundError(
+                    f"Model not found in offline mode: {repo_id} in {self.get_path('huggingface')}"
+                ) from e
+            raise
+
+
+def parse_model_store(config: Dict[str, Any]) -> ModelStore:
+    """Read the `model_root` and `offline` keys shared by the engine configs"""
+    model_root = config.get("model_root", DEFAULT_MODEL_ROOT)
+    if not isinstance(model_root, str):
+        raise ValueError("model_root must be a string")
+
+    offline = config.get("offline", DEFAULT_OFFLINE)
+    if not isinstance(offline, bool):
+        raise ValueError("offline must be a boolean")
+
+    return ModelStore(root=model_root, offline=offline)
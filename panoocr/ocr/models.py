@@ -3,7 +3,7 @@ from dataclasses import dataclass
 import math
 
 
-@dataclass
+@dataclass(slots=True)
 class BoundingBox:
     # distance form the top-left corner of the image
     left: float
@@ -14,7 +14,7 @@ class BoundingBox:
     height: float
 
 
-@dataclass
+@dataclass(slots=True)
 class FlatOCRResult:
     text: str
     confidence: float
@@ -136,7 +136,7 @@ class FlatOCRResult:
 
 
 
-@dataclass
+@dataclass(slots=True)
 class SphereOCRResult:
     text: str
     confidence: float
@@ -0,0 +1,121 @@
+from enum import Enum
+from typing import List
+from PIL import Image
+import numpy as np
+import cv2
+
+
+class TextPresenceMethod(Enum):
+    # share of cells of the downscaled view dense in Canny edges
+    EDGE_DENSITY = "edge_density"
+    # share of the downscaled view covered by character-shaped MSER regions
+    MSER = "mser"
+
+
+# Scores below these skip recognition, low enough to keep small signs
+DEFAULT_THRESHOLDS = {
+    TextPresenceMethod.EDGE_DENSITY: 0.01,
+    TextPresenceMethod.MSER: 0.002,
+}
+# Views are scored on a thumbnail, text is still visible as strokes at this size
+DEFAULT_MAX_SIDE = 256
+CELL_SIZE = 8
+# A cell with more edge pixels than this looks like strokes, not a flat surface
+MIN_CELL_EDGE_DENSITY = 0.1
+CANNY_LOW_THRESHOLD = 50
+CANNY_HIGH_THRESHOLD = 150
+# Character-shaped MSER regions, in pixels of the thumbnail
+MSER_MIN_AREA = 8
+MSER_MAX_AREA = 800
+MSER_MIN_ASPECT_RATIO = 0.1
+MSER_MAX_ASPECT_RATIO = 2.5
+
+
+class TextPresencePrefilter:
+    """
+    Cheap stage in front of the OCR engine: scores how likely a perspective
+    contains text, so views of road, sky or empty facade skip recognition.
+    """
+
+    method: TextPresenceMethod
+    threshold: float
+    max_side: int
+
+    def __init__(
+        self,
+        method=TextPresenceMethod.EDGE_DENSITY,
+        threshold: float | None = None,
+        max_side=DEFAULT_MAX_SIDE,
+    ):
+        """
+        threshold: minimum score to recognize a view, defaults per method
+        """
+        if not isinstance(method, TextPresenceMethod):
+            raise ValueError("method must be a TextPresenceMethod")
+        self.method = method
+        self.threshold = DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+        self.max_side = max_side
+
+        self.scored_count = 0
+        self.skipped_count = 0
+
+    @property
+    def skip_rate(self) -> float:
+        if self.scored_count == 0:
+            return 0.0
+        return self.skipped_count / self.scored_count
+
+    def score(self, image: Image.Image) -> float:
+        """Score between 0 and 1, higher when the view likely contains text"""
+        thumbnail = image.convert("L")
+        thumbnail.thumbnail((self.max_side, self.max_side), Image.BILINEAR)
+        gray = np.asarray(thumbnail)
+
+        if self.method == TextPresenceMethod.EDGE_DENSITY:
+            return self.__score_edge_density(gray)
+        return self.__score_mser(gray)
+
+    def __score_edge_density(self, gray: np.ndarray) -> float:
+        edges = cv2.Canny(gray, CANNY_LOW_THRESHOLD, CANNY_HIGH_THRESHOLD)
+        height = gray.shape[0] // CELL_SIZE * CELL_SIZE
+        width = gray.shape[1] // CELL_SIZE * CELL_SIZE
+        if height == 0 or width == 0:
+            return 0.0
+
+        cell_densities = (
+            (edges[:height, :width] > 0)
+            .reshape(height // CELL_SIZE, CELL_SIZE, width // CELL_SIZE, CELL_SIZE)
+            .mean(axis=(1, 3))
+        )
+        return float((cell_densities >= MIN_CELL_EDGE_DENSITY).mean())
+
+    def __score_mser(self, gray: np.ndarray) -> float:
+        mser = cv2.MSER_create(min_area=MSER_MIN_AREA, max_area=MSER_MAX_AREA)
+        _, boxes = mser.detectRegions(gray)
+        if len(boxes) == 0:
+            return 0.0
+
+        boxes = np.asarray(boxes)
+        aspect_ratios = boxes[:, 2] / boxes[:, 3]
+        characters = boxes[
+            (aspect_ratios >= MSER_MIN_ASPECT_RATIO)
+            & (aspect_ratios <= MSER_MAX_ASPECT_RATIO)
+        ]
+
+        covered = np.zeros(gray.shape, dtype=bool)
+        for x, y, width, height in characters:
+            covered[y : y + height, x : x + width] = True
+        return float(covered.mean())
+
+    def filter(self, images: List[Image.Image]) -> List[bool]:
+        """
+        Returns:
+            List[bool]: whether each image should be recognized
+        """
+        keep = [self.score(image) >= self.threshold for image in images]
+        self.scored_count += len(keep)
+        self.skipped_count += keep.count(False)
+        return keep
+
+    def report(self) -> str:
+        return f"threshold {self.threshold:g}, skipped {self.skipped_count}/{self.scored_count} views ({self.skip_rate:.0%})"
@@ -0,0 +1,141 @@
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+ENCODED_TEXT_CACHE_SIZE = 4096
+
+
+class EncodedText:
+    """
+    A string pre-encoded for the similarity functions below: the bit masks of
+    the positions of each character (for Myers' algorithm) and the count of
+    each character (for the overlap coefficient).
+    """
+
+    __slots__ = ("text", "length", "peq", "counts")
+
+    text: str
+    length: int
+    peq: Dict[str, int]
+    counts: Counter
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.peq = {}
+        for i, character in enumerate(text):
+            self.peq[character] = self.peq.get(character, 0) | (1 << i)
+        self.counts = Counter(text)
+
+
+@lru_cache(maxsize=ENCODED_TEXT_CACHE_SIZE)
+def encode_text(text: str) -> EncodedText:
+    return EncodedText(text)
+
+
+def levenshtein_distance(text_1: EncodedText, text_2: EncodedText) -> int:
+    """
+    Levenshtein distance with Myers' bit-parallel algorithm (in Hyyrö's
+    formulation): the DP column of `text_1` is held in the bits of two integers,
+    so each character of `text_2` costs a handful of integer operations.
+    Python integers have arbitrary precision, so there is no 64 character limit.
+    """
+    m = text_1.length
+    if m == 0:
+        return text_2.length
+    if text_2.length == 0:
+        return m
+
+    mask = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    peq = text_1.peq
+
+    positive_vector = mask
+    negative_vector = 0
+    distance = m
+
+    for character in text_2.text:
+        eq = peq.get(character, 0)
+        xv = eq | negative_vector
+        xh = (
+            (((eq & positive_vector) + positive_vector) & mask) ^ positive_vector
+        ) | eq
+        horizontal_positive = negative_vector | (~(xh | positive_vector) & mask)
+        horizontal_negative = positive_vector & xh
+
+        if horizontal_positive & last_bit:
+            distance += 1
+        elif horizontal_negative & last_bit:
+            distance -= 1
+
+        horizontal_positive = ((horizontal_positive << 1) | 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive_vector = horizontal_negative | (~(xv | horizontal_positive) & mask)
+        negative_vector = horizontal_positive & xv
+
+    return distance
+
+
+def levenshtein_similarity(text_1: EncodedText, text_2: EncodedText) -> float:
+    """Same as `textdistance.levenshtein.normalized_similarity`"""
+    maximum = max(text_1.length, text_2.length)
+    if maximum == 0:
+        return 1.0
+    if text_1.text == text_2.text:
+        return 1.0
+    return 1 - levenshtein_distance(text_1, text_2) / maximum
+
+
+def overlap_similarity(text_1: EncodedText, text_2: EncodedText) -> float:
+    """
+    Same as `textdistance.overlap.normalized_similarity`: the size of the
+    multiset intersection of the characters over the length of the shorter text.
+    """
+    if text_1.text == text_2.text:
+        return 1.0
+    if text_1.length == 0 or text_2.length == 0:
+        return 0.0
+
+    counts_1, counts_2 = text_1.counts, text_2.counts
+    if len(counts_1) > len(counts_2):
+        counts_1, counts_2 = counts_2, counts_1
+    intersection = sum(
+        min(count, counts_2[character])
+        for character, count in counts_1.items()
+        if character in counts_2
+    )
+    return intersection / min(text_1.length, text_2.length)
+
+
+def get_text_similarity(text_1: str, text_2: str) -> float:
+    return levenshtein_similarity(encode_text(text_1), encode_text(text_2))
+
+
+def get_text_overlap(text_1: str, text_2: str) -> float:
+    return overlap_similarity(encode_text(text_1), encode_text(text_2))
+
+
+def get_similarity_matrices(
+    texts_1: List[str], texts_2: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the Levenshtein similarity and the overlap of every pair of texts of
+    two lists. Each text is encoded once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (len(texts_1), len(texts_2)) similarity
+        and overlap matrices
+    """
+    encoded_1 = [encode_text(text) for text in texts_1]
+    encoded_2 = [encode_text(text) for text in texts_2]
+
+    similarity = np.empty((len(encoded_1), len(encoded_2)), dtype=np.float64)
+    overlap = np.empty((len(encoded_1), len(encoded_2)), dtype=np.float64)
+    for i, text_1 in enumerate(encoded_1):
+        for j, text_2 in enumerate(encoded_2):
+            similarity[i, j] = levenshtein_similarity(text_1, text_2)
+            overlap[i, j] = overlap_similarity(text_1, text_2)
+
+    return similarity, overlap
@@ -0,0 +1,89 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+# Read by OpenMP, MKL, OpenBLAS and numexpr when they start their pools. Pools
+# already started (e.g. OpenBLAS, loaded with numpy) keep their size, so to
+# size those the variables must be set before the process imports numpy
+THREAD_ENVIRONMENT_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+@dataclass
+class ThreadConfig:
+    # Threads of each pool, None keeps the libraries' defaults (all cores)
+    threads: int | None = None
+    # CPUs the process runs on, None for all of them
+    cpu_affinity: List[int] | None = None
+
+
+def parse_thread_config(config: Dict[str, Any]) -> ThreadConfig:
+    """Read the `threads` and `cpu_affinity` keys shared by the engine configs"""
+    threads = config.get("threads", None)
+    if threads is not None and (not isinstance(threads, int) or threads <= 0):
+        raise ValueError("threads must be a positive integer")
+
+    cpu_affinity = config.get("cpu_affinity", None)
+    if cpu_affinity is not None:
+        if not all(isinstance(cpu, int) and cpu >= 0 for cpu in cpu_affinity):
+            raise ValueError("cpu_affinity must be a list of CPU indices")
+        cpu_affinity = list(cpu_affinity)
+
+    # Pinned to fewer CPUs than threads, the threads would only compete
+    if threads is None and cpu_affinity:
+        threads = len(cpu_affinity)
+
+    return ThreadConfig(threads=threads, cpu_affinity=cpu_affinity)
+
+
+def apply_thread_config(thread_config: ThreadConfig) -> None:
+    """
+    Pin the process and size the OpenMP/MKL and OpenCV pools. Frameworks with
+    their own setting (torch, paddle, onnxruntime) are sized by the engines.
+    """
+    if thread_config.cpu_affinity:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, thread_config.cpu_affinity)
+        else:
+            print("cpu_affinity is not supported on this platform, ignoring it")
+
+    if thread_config.threads is not None:
+        for variable in THREAD_ENVIRONMENT_VARIABLES:
+            os.environ[variable] = str(thread_config.threads)
+
+        import cv2
+
+        cv2.setNumThreads(thread_config.threads)
+
+
+def get_available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(workers: int, cpus: List[int] | None = None) -> List[List[int]]:
+    """
+    Split the CPUs into `workers` contiguous groups of nearly equal size, so
+    worker processes don't share cores. With more workers than CPUs, workers
+    share single CPUs round robin.
+    """
+    if cpus is None:
+        cpus = get_available_cpus()
+    if workers <= 0:
+        raise ValueError("workers must be a positive integer")
+
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+
+    partitions = []
+    begin = 0
+    for i in range(workers):
+        end = begin + len(cpus) // workers + (1 if i < len(cpus) % workers else 0)
+        partitions.append(cpus[begin:end])
+        begin = end
+    return partitions
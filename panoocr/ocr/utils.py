@@ -31,6 +31,16 @@ def create_ocr_engine(engine_type: OCREngineType, config: Any) -> OCREngine:
 
         print("Initializing OCR Engine: Florence2")
         return Florence2OCREngine(config)
+    elif engine_type == OCREngineType.ONNX:
+        from .engines.onnx_engine import ONNXOCREngine
+
+        print("Initializing OCR Engine: ONNX Runtime")
+        return ONNXOCREngine(config)
+    elif engine_type == OCREngineType.REMOTE:
+        from .engines.remote_engine import RemoteOCREngine
+
+        print("Initializing OCR Engine: Remote")
+        return RemoteOCREngine(config)
     else:
         raise ValueError(f"Unsupported OCR engine type: {engine_type}")
 
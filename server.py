@@ -211,13 +211,23 @@ async def search_ocr(
     page: int = 1,
     page_size: int = 50,
     min_confidence: Optional[float] = None,
+    group_by_entity: bool = False,
 ):
-    """Search through OCR results and return matching entries with panorama information."""
+    """Search through OCR results and return matching entries with panorama information.
+
+    With `group_by_entity`, return one row per sign entity (see 3-cluster-signs.py)
+    instead of one row per OCR result, shown with the entity's elected OCR result.
+    An entity matches if any of its OCR results does, so the spelling variants
+    merged into it find it too.
+    """
     conn = None
     try:
         conn = get_db()
         cursor = conn.cursor()
 
+        if group_by_entity:
+            return search_sign_entities(cursor, query, page, page_size, min_confidence)
+
         # Base query to join OCR results with panorama information
         base_query = """
             SELECT 
@@ -278,6 +288,72 @@ async def search_ocr(
             conn.close()
 
 
+def search_sign_entities(
+    cursor,
+    query: str,
+    page: int,
+    page_size: int,
+    min_confidence: Optional[float],
+):
+    # Same columns as the OCR results, plus the entity
+    base_query = """
+        SELECT
+            ocr.id,
+            ocr.pano_id,
+            entity.text,
+            entity.confidence,
+            ocr.yaw,
+            ocr.pitch,
+            ocr.width,
+            ocr.height,
+            ocr.engine,
+            sp.lat,
+            sp.lon,
+            sp.heading,
+            sp.pitch as panorama_pitch,
+            sp.roll,
+            sp.date,
+            sp.copyright,
+            entity.id as entity_id,
+            entity.lat as entity_lat,
+            entity.lon as entity_lon,
+            entity.hit_count,
+            entity.pano_count
+        FROM sign_entity entity
+        JOIN ocr_result ocr ON entity.ocr_id = ocr.id
+        JOIN search_panoramas sp ON ocr.pano_id = sp.pano_id
+        WHERE EXISTS (
+            SELECT 1 FROM ocr_result member
+            WHERE member.entity_id = entity.id AND member.text LIKE ?
+        )
+    """
+
+    if min_confidence is not None:
+        base_query += " AND entity.confidence >= ?"
+        params = [f"%{query}%", min_confidence]
+    else:
+        params = [f"%{query}%"]
+
+    count_query = f"SELECT COUNT(*) as total FROM ({base_query})"
+    cursor.execute(count_query, params)
+    total = cursor.fetchone()["total"]
+
+    offset = (page - 1) * page_size
+    query = base_query + " ORDER BY entity.confidence DESC LIMIT ? OFFSET ?"
+    cursor.execute(query, params + [page_size, offset])
+
+    rows = cursor.fetchall()
+    results = [dict(row) for row in rows]
+
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size,
+        "data": results,
+    }
+
+
 @app.get("/api/ocr-streetview-url/{pano_id}")
 async def get_ocr_streetview_url(pano_id: str, ocr_id: int):
     """Generate a Google Street View URL for an OCR result, taking into account OCR coordinates."""
@@ -1,8 +1,25 @@
 from .model import StreetViewProcessResult
+import panoocr as po
+import time
+import random
+import string
 import sqlite3
 from typing import List
 from enum import Enum
 
+# How long a worker owns the panoramas it claimed before others can reclaim them
+DEFAULT_LEASE_SECONDS = 30 * 60
+
+# Lock timeout of the connections of the workers, they write concurrently so
+# they wait for the lock instead of failing with "database is locked"
+DATABASE_TIMEOUT_SECONDS = 30
+
+# Characters of pano ids (URL-safe base64), in SQLite's sort order
+PANO_ID_ALPHABET = "".join(sorted(string.ascii_letters + string.digits + "-_"))
+
+# Same predicate as the partial index, SQLite only uses the index if it matches
+WITHOUT_OCR = "(computed_ocr = 0 or computed_ocr is NULL)"
+
 
 def setup_database(db_path: str = "gsv.db"):
     """Setup the database with required tables"""
@@ -41,24 +58,131 @@ def setup_database(db_path: str = "gsv.db"):
             "ALTER TABLE search_panoramas ADD COLUMN download_attempted INTEGER DEFAULT 0"
         )
 
+    # Add lease columns used to share the work between OCR workers
+    if "claimed_by" not in columns:
+        cursor.execute("ALTER TABLE search_panoramas ADD COLUMN claimed_by TEXT")
+    if "lease_expires" not in columns:
+        cursor.execute("ALTER TABLE search_panoramas ADD COLUMN lease_expires REAL")
+
+    # Only index the panoramas left to OCR, so batches are found without
+    # scanning the ones that are done
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_search_panoramas_without_ocr ON search_panoramas(pano_id) WHERE {WITHOUT_OCR}"
+    )
+
     conn.commit()
     conn.close()
 
 
+def get_random_pano_id_start() -> str:
+    """
+    Random point to start reading pano ids from. Pano ids are random, so
+    batches read from there are spread all over the map.
+    """
+    return "".join(random.choice(PANO_ID_ALPHABET) for _ in range(2))
+
+
+def get_n_pano_id_where(
+    connection,
+    condition: str,
+    n: int,
+    parameters: tuple = (),
+) -> List[str]:
+    """
+    Get n pano_id of search_panoramas matching `condition`, starting from a
+    random pano_id and wrapping around, so with a partial index on pano_id
+    matching `condition` each batch only reads n index entries.
+
+    parameters: values of the placeholders of `condition`
+    """
+    start = get_random_pano_id_start()
+    cur = connection.cursor()
+    cur.execute(
+        f"SELECT pano_id FROM search_panoramas WHERE {condition} AND pano_id >= ? ORDER BY pano_id LIMIT ?",
+        (*parameters, start, n),
+    )
+    res = cur.fetchall()
+    if len(res) < n:
+        cur.execute(
+            f"SELECT pano_id FROM search_panoramas WHERE {condition} AND pano_id < ? ORDER BY pano_id LIMIT ?",
+            (*parameters, start, n - len(res)),
+        )
+        res += cur.fetchall()
+    return [r[0] for r in res]
+
+
 def get_n_pano_id_without_ocr(
     connection,
     n: int,
+    unclaimed_at: float | None = None,
 ) -> List[str]:
-    # get n random panorama_id that has computed_ocr = False
+    """
+    unclaimed_at: only return panoramas whose lease expired at that time
+    """
+    # get n panorama_id that has computed_ocr = False
+    if unclaimed_at is None:
+        return get_n_pano_id_where(connection, WITHOUT_OCR, n)
+    return get_n_pano_id_where(
+        connection,
+        f"{WITHOUT_OCR} AND (lease_expires IS NULL OR lease_expires < ?)",
+        n,
+        (unclaimed_at,),
+    )
+
+
+def claim_pano_ids_without_ocr(
+    connection,
+    worker_id: str,
+    n: int,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> List[str]:
+    """
+    Claim up to n panoramas without OCR for `worker_id`. Panoramas whose lease
+    expired (e.g. their worker crashed) can be claimed again.
+
+    The batch is read with `get_n_pano_id_without_ocr`, then claimed in a
+    single UPDATE ... RETURNING statement that checks the lease again, so
+    concurrent workers that read the same panoramas never both claim one.
+    """
+    now = time.time()
+    pano_ids = get_n_pano_id_without_ocr(connection, n, unclaimed_at=now)
+    if len(pano_ids) == 0:
+        return []
+
     cur = connection.cursor()
     cur.execute(
-        "SELECT pano_id FROM search_panoramas WHERE (computed_ocr = 0 or computed_ocr is NULL) ORDER BY RANDOM() LIMIT ?",
-        (n,),
+        f"""
+        UPDATE search_panoramas SET claimed_by = ?, lease_expires = ?
+        WHERE pano_id IN ({", ".join("?" * len(pano_ids))})
+        AND {WITHOUT_OCR} AND (lease_expires IS NULL OR lease_expires < ?)
+        RETURNING pano_id
+        """,
+        (worker_id, now + lease_seconds, *pano_ids, now),
     )
     res = cur.fetchall()
+    connection.commit()
     return [r[0] for r in res]
 
 
+def renew_lease(
+    connection,
+    panorama_id: str,
+    worker_id: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> bool:
+    """
+    Extend the lease of a claimed panorama before working on it.
+    Returns False if the lease expired and another worker claimed it since.
+    """
+    cur = connection.cursor()
+    cur.execute(
+        "UPDATE search_panoramas SET lease_expires = ? WHERE pano_id = ? AND claimed_by = ?",
+        (time.time() + lease_seconds, panorama_id, worker_id),
+    )
+    connection.commit()
+    return cur.rowcount > 0
+
+
 def add_one_to_download_count(panorama_id: str, connection):
     cur = connection.cursor()
     cur.execute(
@@ -68,6 +192,28 @@ def add_one_to_download_count(panorama_id: str, connection):
     connection.commit()
 
 
+def get_ocr_result_rows(
+    panorama_id: str,
+    sphere_ocr_results: List[po.SphereOCRResult] | po.SphereOCRBatch,
+) -> List[tuple]:
+    """Rows of the ocr_result table, read column by column from a batch"""
+    if isinstance(sphere_ocr_results, po.SphereOCRBatch):
+        return sphere_ocr_results.to_rows(panorama_id)
+    return [
+        (
+            panorama_id,
+            sphere_ocr_result.text,
+            sphere_ocr_result.confidence,
+            sphere_ocr_result.yaw,
+            sphere_ocr_result.pitch,
+            sphere_ocr_result.width,
+            sphere_ocr_result.height,
+            sphere_ocr_result.engine,
+        )
+        for sphere_ocr_result in sphere_ocr_results
+    ]
+
+
 def insert_ocr_result(
     connection,
     streetview_process_result: StreetViewProcessResult,
@@ -96,25 +242,18 @@ def insert_ocr_result(
         # Start a new transaction
         cur = connection.cursor()
 
-        # INSERT OCR RESULTS
-        for sphere_ocr_result in streetview_process_result.all_sphere_ocr_results:
-            cur.execute(
-                "INSERT INTO ocr_result (pano_id, text, confidence, yaw, pitch, width, height, engine) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    streetview_process_result.panorama_id,
-                    sphere_ocr_result.text,
-                    sphere_ocr_result.confidence,
-                    sphere_ocr_result.yaw,
-                    sphere_ocr_result.pitch,
-                    sphere_ocr_result.width,
-                    sphere_ocr_result.height,
-                    sphere_ocr_result.engine,
-                ),
-            )
-
-        # SET computed_ocr = True
+        # INSERT OCR RESULTS, all at once
+        cur.executemany(
+            "INSERT INTO ocr_result (pano_id, text, confidence, yaw, pitch, width, height, engine) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            get_ocr_result_rows(
+                streetview_process_result.panorama_id,
+                streetview_process_result.all_sphere_ocr_results,
+            ),
+        )
+
+        # SET computed_ocr = True, and release the lease
         cur.execute(
-            "UPDATE search_panoramas SET computed_ocr = 1 WHERE pano_id = ?",
+            "UPDATE search_panoramas SET computed_ocr = 1, claimed_by = NULL, lease_expires = NULL WHERE pano_id = ?",
             (streetview_process_result.panorama_id,),
         )
 
@@ -1,6 +1,7 @@
 import os
 import json
-from typing import List
+from io import BytesIO
+from typing import Dict, List, Tuple
 from PIL import Image
 import panoocr as po
 from dataclasses import dataclass
@@ -9,7 +10,7 @@ from dataclasses import dataclass
 @dataclass
 class StreetViewProcessResult:
     panorama_id: str
-    all_sphere_ocr_results: List[po.SphereOCRResult]
+    all_sphere_ocr_results: List[po.SphereOCRResult] | po.SphereOCRBatch
     streetview_image: Image.Image
     download_time: float
     e2p_time: float
@@ -33,3 +34,37 @@ class StreetViewProcessResult:
         # save streetview image
         streetview_image_filename = f"{filename}.jpg"
         self.streetview_image.save(os.path.join(directory, streetview_image_filename))
+
+
+@dataclass
+class PanoramaTiles:
+    """
+    Downloaded tiles of a panorama, kept as the JPEG bytes the server sent so
+    the panorama cache stores exactly the pixels a download would give.
+    """
+
+    # JPEG bytes of each tile, by its (x, y) index in the full panorama
+    tiles: Dict[Tuple[int, int], bytes]
+    tile_width: int
+    tile_height: int
+    zoom: int
+    # Whether `zoom` is the highest zoom level of the panorama
+    is_max_zoom: bool
+    # Size of the stitched image, the band of rows if the panorama is cropped
+    width: int
+    height: int
+    crop: po.PanoramaCrop | None = None
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(len(tile_bytes) for tile_bytes in self.tiles.values())
+
+    def stitch(self) -> Image.Image:
+        top = 0 if self.crop is None else self.crop.top
+        panorama_pil_image = Image.new("RGB", (self.width, self.height))
+        for (x, y), tile_bytes in self.tiles.items():
+            with Image.open(BytesIO(tile_bytes)) as tile:
+                panorama_pil_image.paste(
+                    im=tile, box=(x * self.tile_width, y * self.tile_height - top)
+                )
+        return panorama_pil_image
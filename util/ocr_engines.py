@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Tuple
+import panoocr as po
+from panoocr.ocr.inference_server import DEFAULT_ADDRESS
+from panoocr.ocr.model_store import DEFAULT_MODEL_ROOT, DEFAULT_OFFLINE
+
+OCR_ENGINE_NAMES = ["macocr", "florence2", "paddleocr", "easyocr", "onnx", "remote"]
+
+
+def get_ocr_engine_config(
+    ocr_engine_name: str,
+    batch_size: int | None = None,
+    florence_profile: po.Florence2PerformanceProfile = po.Florence2PerformanceProfile.ACCURATE,
+    onnx_model_dir: str | None = None,
+    onnx_threads: int | None = None,
+    server_address: str = DEFAULT_ADDRESS,
+    model_root: str = DEFAULT_MODEL_ROOT,
+    offline: bool = DEFAULT_OFFLINE,
+    threads: int | None = None,
+    cpu_affinity: List[int] | None = None,
+) -> Tuple[po.OCREngineType, Dict[str, Any]]:
+    """
+    The engine type and config the scripts create an engine with, shared by
+    `2-pano-ocr.py` and the inference server it can connect to.
+
+    batch_size: perspectives per model call of batched engines, None for the engine's default
+    threads, cpu_affinity: thread pools and CPUs of the process, None for all cores
+    model_root, offline: model store of the engines that download models
+    """
+    batch_config = {} if batch_size is None else {"batch_size": batch_size}
+    model_store_config = {"model_root": model_root, "offline": offline}
+    thread_config = {}
+    if threads is not None:
+        thread_config["threads"] = threads
+    if cpu_affinity is not None:
+        thread_config["cpu_affinity"] = cpu_affinity
+
+    if ocr_engine_name == "macocr":
+        return po.OCREngineType.MACOCR, {
+            "language_preference": [
+                po.MacOCRLanguageCode.ENGLISH_US,
+            ],
+            "recognition_level": po.MacOCRRecognitionLevel.ACCURATE,
+            **thread_config,
+        }
+    elif ocr_engine_name == "florence2":
+        return po.OCREngineType.FLORENCE, {
+            "profile": florence_profile,
+            **batch_config,
+            **model_store_config,
+            **thread_config,
+        }
+    elif ocr_engine_name == "paddleocr":
+        return po.OCREngineType.PADDLEOCR, {
+            "language_preference": po.PaddleOCRLanguageCode.ENGLISH,
+            "recognize_upside_down": False,
+            "use_v4_server": True,
+            **batch_config,
+            **model_store_config,
+            **thread_config,
+        }
+    elif ocr_engine_name == "easyocr":
+        return po.OCREngineType.EASYOCR, {
+            **batch_config,
+            **model_store_config,
+            **thread_config,
+        }
+    elif ocr_engine_name == "onnx":
+        onnx_config = {}
+        if onnx_model_dir is not None:
+            onnx_config["model_dir"] = onnx_model_dir
+        if onnx_threads is not None:
+            onnx_config["intra_op_threads"] = onnx_threads
+        return po.OCREngineType.ONNX, {
+            **onnx_config,
+            **batch_config,
+            **model_store_config,
+            **thread_config,
+        }
+    elif ocr_engine_name == "remote":
+        return po.OCREngineType.REMOTE, {
+            "address": server_address,
+            **batch_config,
+            **thread_config,
+        }
+    else:
+        raise ValueError("Invalid OCR engine")
@@ -0,0 +1,260 @@
+import os
+import time
+import sqlite3
+import zipfile
+import threading
+from typing import Tuple
+from PIL import Image
+import panoocr as po
+from panoocr.image.coverage import pitch_range_to_rows
+from .model import PanoramaTiles
+
+DEFAULT_CACHE_MAX_BYTES = 50 * 1024 * 1024 * 1024
+
+
+class PanoramaCache:
+    """
+    On-disk cache of downloaded panoramas, keyed by pano_id + zoom.
+
+    Panoramas are stored in `directory` as uncompressed zips of the tiles as
+    downloaded, so a cached panorama has the same pixels as a downloaded one,
+    with an SQLite index next to them recording their size, crop and last
+    access time. When the total size goes over `max_bytes`, the least recently
+    used panoramas are evicted. The index is shared by every process using the
+    same directory.
+    """
+
+    directory: str
+    max_bytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(self.directory, "index.db"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS panoramas (
+                pano_id TEXT,
+                zoom INTEGER,
+                full_width INTEGER,
+                full_height INTEGER,
+                top INTEGER,
+                bottom INTEGER,
+                path TEXT,
+                size_bytes INTEGER,
+                last_access REAL,
+                tile_width INTEGER,
+                tile_height INTEGER,
+                is_max_zoom INTEGER DEFAULT 0,
+                PRIMARY KEY (pano_id, zoom)
+            )
+        """)
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_panoramas_last_access ON panoramas(last_access)"
+        )
+        self._connection.commit()
+
+    def __get_path(self, pano_id: str, zoom: int) -> str:
+        # Spread the files over subdirectories to keep directory listings small
+        return os.path.join(self.directory, pano_id[:2], f"{pano_id}_z{zoom}.zip")
+
+    def get(
+        self,
+        pano_id: str,
+        zoom: int | None = None,
+        min_width: int | None = None,
+        pitch_range: Tuple[float, float] | None = None,
+    ) -> Tuple[Image.Image, po.PanoramaCrop | None] | None:
+        """
+        Look up a panorama either by `zoom` or by the smallest panorama at least
+        `min_width` wide. A panorama downloaded at its highest zoom level also
+        matches higher zooms and wider `min_width`, since downloading again
+        would give the same image. If `pitch_range` is given, a cropped panorama
+        covering it is accepted, otherwise only full panoramas are returned.
+
+        Returns:
+            Tuple[Image.Image, PanoramaCrop | None] | None: the panorama and its
+            crop, or None on a miss
+        """
+        if zoom is None and min_width is None:
+            raise ValueError("Either zoom or min_width is required")
+
+        with self._lock:
+            if zoom is not None:
+                rows = self._connection.execute(
+                    "SELECT zoom, full_width, full_height, top, bottom, path, tile_width, tile_height FROM panoramas WHERE pano_id = ? AND (zoom = ? OR (is_max_zoom = 1 AND zoom < ?))",
+                    (pano_id, zoom, zoom),
+                ).fetchall()
+            else:
+                rows = self._connection.execute(
+                    "SELECT zoom, full_width, full_height, top, bottom, path, tile_width, tile_height FROM panoramas WHERE pano_id = ? AND (full_width >= ? OR is_max_zoom = 1) ORDER BY full_width",
+                    (pano_id, min_width),
+                ).fetchall()
+
+        for (
+            entry_zoom,
+            full_width,
+            full_height,
+            top,
+            bottom,
+            path,
+            tile_width,
+            tile_height,
+        ) in rows:
+            is_full = top == 0 and bottom == full_height
+            if pitch_range is None:
+                if not is_full:
+                    continue
+            else:
+                required_top, required_bottom = pitch_range_to_rows(
+                    pitch_range, full_height
+                )
+                if top > required_top or bottom < required_bottom:
+                    continue
+
+            crop = None
+            if not is_full:
+                crop = po.PanoramaCrop(
+                    full_width=full_width,
+                    full_height=full_height,
+                    top=top,
+                    bottom=bottom,
+                )
+
+            try:
+                tiles = {}
+                with zipfile.ZipFile(path) as tile_zip:
+                    for name in tile_zip.namelist():
+                        x, y = os.path.splitext(name)[0].split("_")
+                        tiles[(int(x), int(y))] = tile_zip.read(name)
+                image = PanoramaTiles(
+                    tiles=tiles,
+                    tile_width=tile_width,
+                    tile_height=tile_height,
+                    zoom=entry_zoom,
+                    is_max_zoom=False,
+                    width=full_width,
+                    height=bottom - top,
+                    crop=crop,
+                ).stitch()
+            except (FileNotFoundError, OSError, zipfile.BadZipFile):
+                self.__remove(pano_id, entry_zoom)
+                continue
+
+            with self._lock:
+                self._connection.execute(
+                    "UPDATE panoramas SET last_access = ? WHERE pano_id = ? AND zoom = ?",
+                    (time.time(), pano_id, entry_zoom),
+                )
+                self._connection.commit()
+                self.hits += 1
+            return image, crop
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, pano_id: str, panorama_tiles: PanoramaTiles) -> None:
+        path = self.__get_path(pano_id, panorama_tiles.zoom)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Tiles are already JPEGs, they are stored as they are. Write to a
+        # temporary file and rename, so readers never see partial files
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as tile_zip:
+            for (x, y), tile_bytes in panorama_tiles.tiles.items():
+                tile_zip.writestr(f"{x}_{y}.jpg", tile_bytes)
+        os.replace(tmp_path, path)
+
+        crop = panorama_tiles.crop
+        if crop is None:
+            full_width, full_height = panorama_tiles.width, panorama_tiles.height
+            top, bottom = 0, full_height
+        else:
+            full_width, full_height = crop.full_width, crop.full_height
+            top, bottom = crop.top, crop.bottom
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO panoramas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    pano_id,
+                    panorama_tiles.zoom,
+                    full_width,
+                    full_height,
+                    top,
+                    bottom,
+                    path,
+                    os.path.getsize(path),
+                    time.time(),
+                    panorama_tiles.tile_width,
+                    panorama_tiles.tile_height,
+                    int(panorama_tiles.is_max_zoom),
+                ),
+            )
+            self._connection.commit()
+
+        self.evict()
+
+    def contains(self, pano_id: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM panoramas WHERE pano_id = ? LIMIT 1", (pano_id,)
+            ).fetchone()
+        return row is not None
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM panoramas"
+            ).fetchone()
+        return row[0]
+
+    def evict(self) -> None:
+        """Remove the least recently used panoramas until the cache fits `max_bytes`"""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT pano_id, zoom, size_bytes FROM panoramas ORDER BY last_access"
+            ).fetchall()
+
+        for pano_id, zoom, size_bytes in rows:
+            if excess <= 0:
+                break
+            self.__remove(pano_id, zoom)
+            excess -= size_bytes
+
+    def __remove(self, pano_id: str, zoom: int) -> None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path FROM panoramas WHERE pano_id = ? AND zoom = ?",
+                (pano_id, zoom),
+            ).fetchone()
+        if row is not None:
+            try:
+                os.remove(row[0])
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM panoramas WHERE pano_id = ? AND zoom = ?",
+                (pano_id, zoom),
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
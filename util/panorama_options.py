@@ -0,0 +1,38 @@
+import argparse
+from typing import List
+import panoocr as po
+
+PERSPECTIVE_SETS = {
+    "default": po.DEFAULT_IMAGE_PERSPECTIVES,
+    "zoomed-in": po.ZOOMED_IN_IMAGE_PERSPECTIVES,
+    "zoomed-out": po.ZOOMED_OUT_IMAGE_PERSPECTIVES,
+    "zoomed-out-60": po.ZOOMED_OUT_IMAGE_PERSPECTIVES_60,
+}
+
+
+def add_panorama_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Options deciding which pixels of a panorama are downloaded, shared by
+    `2-pano-ocr.py` and `1e-prefetch-panoramas.py` so prefetched panoramas are
+    the ones the OCR workers look up in the cache.
+    """
+    parser.add_argument(
+        "--perspectives",
+        choices=list(PERSPECTIVE_SETS),
+        default="default",
+        help="Perspective set projected from each panorama",
+    )
+    parser.add_argument(
+        "--crop-panorama",
+        action="store_true",
+        help="Only download the tile rows sampled by the perspectives, skipping sky and ground",
+    )
+    parser.add_argument(
+        "--adaptive-zoom",
+        action="store_true",
+        help="Download the lowest zoom level that still meets the resolution of the perspectives",
+    )
+
+
+def get_perspectives(name: str) -> List[po.PerspectiveMetadata]:
+    return PERSPECTIVE_SETS[name]
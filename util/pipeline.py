@@ -0,0 +1,393 @@
+import time
+import queue
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Tuple
+from PIL import Image
+import panoocr as po
+from .model import StreetViewProcessResult
+from .db_operations import (
+    insert_ocr_result,
+    add_one_to_download_count,
+    renew_lease,
+    DEFAULT_LEASE_SECONDS,
+    DATABASE_TIMEOUT_SECONDS,
+)
+from .streetview_ocr import (
+    project_perspectives,
+    recognize_perspectives,
+    remove_duplications,
+)
+
+# Marks the end of the input, passed down from stage to stage
+_END = object()
+
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_E2P_WORKERS = 1
+DEFAULT_DOWNLOAD_TIMEOUT = 5
+DEFAULT_REPORT_INTERVAL = 10
+
+
+@dataclass
+class PipelineConfig:
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS
+    e2p_workers: int = DEFAULT_E2P_WORKERS
+    # Threads used by each e2p worker to project the perspectives of a panorama
+    e2p_threads: int | None = None
+    # Maximum number of items waiting in front of each stage
+    download_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    e2p_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    ocr_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    duplication_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    writer_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    download_timeout: float = DEFAULT_DOWNLOAD_TIMEOUT
+    report_interval: float = DEFAULT_REPORT_INTERVAL
+    plan_dir: str | None = None
+    # Set when the panoramas were claimed with `claim_pano_ids_without_ocr`
+    worker_id: str | None = None
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+
+
+@dataclass
+class PanoramaJob:
+    """A panorama moving through the pipeline, filled in by each stage"""
+
+    pano_id: str
+    panorama_pil_image: Image.Image | None = None
+    panorama_crop: po.PanoramaCrop | None = None
+    perspective_images: List[po.PerspectiveImage] = field(default_factory=list)
+    all_sphere_ocr_results_for_each_perspective: List[po.SphereOCRBatch] = field(
+        default_factory=list
+    )
+    result: StreetViewProcessResult | None = None
+    download_time: float = 0
+    e2p_time: float = 0
+    ocr_time: float = 0
+    duplication_removal_time: float = 0
+
+
+class PipelineStage:
+    """
+    A pool of worker threads taking items from `input_queue`, processing them
+    with `function` and putting the results in `output_queue`. Queues are
+    bounded, so a slow stage blocks the stages in front of it instead of
+    letting work pile up in memory.
+
+    `function` returns None to drop an item (e.g. a failed download).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        input_queue: queue.Queue,
+        output_queue: queue.Queue | None,
+        workers: int = 1,
+    ):
+        self.name = name
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.workers = max(1, workers)
+
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.queue_samples = 0
+        self.queue_occupancy_sum = 0
+
+        self._lock = threading.Lock()
+        self._running_workers = self.workers
+        self._threads = [
+            threading.Thread(target=self.__work, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def sample_queue(self) -> None:
+        with self._lock:
+            self.queue_samples += 1
+            self.queue_occupancy_sum += self.input_queue.qsize()
+
+    def __work(self) -> None:
+        while True:
+            item = self.input_queue.get()
+            if item is _END:
+                break
+
+            begin_time = time.time()
+            try:
+                output = self.function(item)
+            except Exception as e:
+                print(f"{self.name}\tError: {e}")
+                output = None
+            elapsed_time = time.time() - begin_time
+
+            with self._lock:
+                self.busy_time += elapsed_time
+                if output is None:
+                    self.failed += 1
+                else:
+                    self.processed += 1
+
+            if output is not None and self.output_queue is not None:
+                self.output_queue.put(output)
+
+        with self._lock:
+            self._running_workers -= 1
+            is_last_worker = self._running_workers == 0
+        if not is_last_worker:
+            # Let the other workers of this stage see the end too
+            self.input_queue.put(_END)
+        elif self.output_queue is not None:
+            self.output_queue.put(_END)
+
+
+class OCRPipeline:
+    """
+    Staged version of `download_and_ocr_google_streetview_from_id` for batches
+    of panoramas:
+
+        download (pool) -> e2p (pool) -> OCR -> duplication removal -> DB writer
+
+    Each stage runs on its own threads and the stages are connected by bounded
+    queues, so the OCR engine keeps working while the next panoramas are being
+    downloaded and projected. OCR runs on a single thread since the engines are
+    not thread-safe, and the DB writer owns its own SQLite connection.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        download_panorama: Callable[[str], Tuple[Image.Image, po.PanoramaCrop | None]],
+        perspectives: List[po.PerspectiveMetadata],
+        ocr_engine: po.OCREngine,
+        duplication_detection_engine: po.SphereOCRDuplicationDetectionEngine,
+        config: PipelineConfig | None = None,
+        on_result: Callable[[StreetViewProcessResult], None] | None = None,
+        text_prefilter: po.TextPresencePrefilter | None = None,
+    ):
+        """
+        download_panorama: returns the panorama of a pano_id and its crop (or None)
+        on_result: called by the DB writer after each result is inserted
+        text_prefilter: skips recognition of the perspectives it rejects
+        """
+        self.database_path = database_path
+        self.download_panorama = download_panorama
+        self.perspectives = perspectives
+        self.ocr_engine = ocr_engine
+        self.duplication_detection_engine = duplication_detection_engine
+        self.config = config or PipelineConfig()
+        self.on_result = on_result
+        self.text_prefilter = text_prefilter
+
+        self._connection = None
+
+        download_queue = queue.Queue(maxsize=self.config.download_queue_depth)
+        e2p_queue = queue.Queue(maxsize=self.config.e2p_queue_depth)
+        ocr_queue = queue.Queue(maxsize=self.config.ocr_queue_depth)
+        duplication_queue = queue.Queue(maxsize=self.config.duplication_queue_depth)
+        writer_queue = queue.Queue(maxsize=self.config.writer_queue_depth)
+
+        self.input_queue = download_queue
+        self.stages = [
+            PipelineStage(
+                "download",
+                self.__download,
+                download_queue,
+                e2p_queue,
+                self.config.download_workers,
+            ),
+            PipelineStage(
+                "e2p", self.__e2p, e2p_queue, ocr_queue, self.config.e2p_workers
+            ),
+            PipelineStage("ocr", self.__ocr, ocr_queue, duplication_queue),
+            PipelineStage(
+                "dup", self.__remove_duplications, duplication_queue, writer_queue
+            ),
+            PipelineStage("write", self.__write, writer_queue, None),
+        ]
+
+    ########################################
+    # Stages
+    ########################################
+
+    def __download(self, job: PanoramaJob) -> PanoramaJob | None:
+        output = {}
+
+        def download():
+            try:
+                output["panorama"] = self.download_panorama(job.pano_id)
+            except Exception as e:
+                output["error"] = e
+
+        # SIGALRM only works on the main thread, so the download runs on its
+        # own daemon thread and is abandoned if it doesn't finish in time
+        current_time = time.time()
+        thread = threading.Thread(target=download, daemon=True)
+        thread.start()
+        thread.join(self.config.download_timeout)
+        job.download_time = time.time() - current_time
+
+        if thread.is_alive():
+            print(
+                f"{job.pano_id}\tDownload timed out after {self.config.download_timeout} seconds, skipping..."
+            )
+            return None
+        if "error" in output:
+            raise output["error"]
+
+        job.panorama_pil_image, job.panorama_crop = output["panorama"]
+        return job
+
+    def __e2p(self, job: PanoramaJob) -> PanoramaJob:
+        job.perspective_images, job.e2p_time = project_perspectives(
+            job.pano_id,
+            job.panorama_pil_image,
+            self.perspectives,
+            plan_dir=self.config.plan_dir,
+            e2p_workers=self.config.e2p_threads,
+            panorama_crop=job.panorama_crop,
+        )
+        return job
+
+    def __ocr(self, job: PanoramaJob) -> PanoramaJob:
+        current_time = time.time()
+        job.all_sphere_ocr_results_for_each_perspective = []
+        batch_size = self.ocr_engine.preferred_batch_size
+        for begin in range(0, len(job.perspective_images), batch_size):
+            job.all_sphere_ocr_results_for_each_perspective += recognize_perspectives(
+                job.perspective_images[begin : begin + batch_size],
+                self.perspectives[begin : begin + batch_size],
+                self.ocr_engine,
+                first_perspective_index=begin,
+                text_prefilter=self.text_prefilter,
+            )
+        if self.text_prefilter is not None:
+            print(f"{job.pano_id}\tText prefilter: {self.text_prefilter.report()}")
+        # The views are not needed anymore, free them before the next stages
+        job.perspective_images = []
+        job.ocr_time = time.time() - current_time
+        return job
+
+    def __remove_duplications(self, job: PanoramaJob) -> PanoramaJob:
+        current_time = time.time()
+        all_sphere_ocr_results = remove_duplications(
+            job.all_sphere_ocr_results_for_each_perspective,
+            self.duplication_detection_engine,
+        )
+        job.duplication_removal_time = time.time() - current_time
+
+        job.result = StreetViewProcessResult(
+            panorama_id=job.pano_id,
+            all_sphere_ocr_results=all_sphere_ocr_results,
+            streetview_image=job.panorama_pil_image,
+            download_time=job.download_time,
+            e2p_time=job.e2p_time,
+            ocr_time=job.ocr_time,
+            duplication_removal_time=job.duplication_removal_time,
+            total_time=job.download_time
+            + job.e2p_time
+            + job.ocr_time
+            + job.duplication_removal_time,
+        )
+        return job
+
+    def __write(self, job: PanoramaJob) -> PanoramaJob:
+        if self._connection is None:
+            # Closed by `run` on the main thread once the writer is done
+            self._connection = sqlite3.connect(
+                self.database_path,
+                timeout=DATABASE_TIMEOUT_SECONDS,
+                check_same_thread=False,
+            )
+        insert_ocr_result(self._connection, job.result)
+        if self.on_result is not None:
+            self.on_result(job.result)
+        return job
+
+    ########################################
+    # Running
+    ########################################
+
+    def run(self, pano_ids: List[str]) -> None:
+        """Process a batch of panoramas, returns once all of them went through"""
+        for stage in self.stages:
+            stage.start()
+
+        begin_time = time.time()
+        stop_reporting = threading.Event()
+        reporter = threading.Thread(
+            target=self.__report_periodically,
+            args=(begin_time, stop_reporting),
+            daemon=True,
+        )
+        reporter.start()
+
+        # Count the attempt before downloading, like the serial loop does, so
+        # panoramas that keep failing can be told apart
+        connection = sqlite3.connect(
+            self.database_path, timeout=DATABASE_TIMEOUT_SECONDS
+        )
+        try:
+            for pano_id in pano_ids:
+                if self.config.worker_id is not None and not renew_lease(
+                    connection,
+                    pano_id,
+                    self.config.worker_id,
+                    self.config.lease_seconds,
+                ):
+                    print(f"{pano_id}\tLease lost to another worker, skipping...")
+                    continue
+                add_one_to_download_count(pano_id, connection)
+                # Blocks whenever the download queue is full
+                self.input_queue.put(PanoramaJob(pano_id=pano_id))
+        finally:
+            self.input_queue.put(_END)
+            connection.close()
+
+            # Also when queueing failed, so the panoramas already queued are
+            # written and no stage thread outlives the pipeline
+            for stage in self.stages:
+                stage.join()
+
+            stop_reporting.set()
+            reporter.join()
+            self.report(begin_time)
+
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __report_periodically(
+        self, begin_time: float, stop_reporting: threading.Event
+    ) -> None:
+        last_report_time = time.time()
+        # Sample queue occupancy every second, print every report_interval
+        while not stop_reporting.wait(1):
+            for stage in self.stages:
+                stage.sample_queue()
+            if time.time() - last_report_time >= self.config.report_interval:
+                self.report(begin_time)
+                last_report_time = time.time()
+
+    def report(self, begin_time: float) -> None:
+        wall_time = max(time.time() - begin_time, 0.0000001)
+        print("stage\tdone\tfailed\tpano/min\tt_avg\tbusy\tqueue")
+        for stage in self.stages:
+            average_time = stage.busy_time / max(stage.processed + stage.failed, 1)
+            # Busy time is summed over the workers of the stage
+            utilization = stage.busy_time / (wall_time * stage.workers)
+            average_queue = stage.queue_occupancy_sum / max(stage.queue_samples, 1)
+            print(
+                f"{stage.name}\t{stage.processed}\t{stage.failed}\t{60 * stage.processed / wall_time:.3f}\t\t{average_time:.1f}\t{utilization:.0%}\t{average_queue:.1f}/{stage.input_queue.maxsize}"
+            )
@@ -0,0 +1,426 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from panoocr.ocr.text_similarity import EncodedText, levenshtein_similarity
+from .gsv_url import correct_ocr_coordinates
+
+# 1 degree is approximately 111000 meters (same approximation as 1a-sample-coords.py)
+METERS_PER_DEGREE = 111000
+
+# Signs further away than this are too small to be read, so rays are cut there
+MAX_SIGN_DISTANCE_METER = 50
+# Minimum angle between two rays for their intersection to be trusted
+MIN_RAY_ANGLE_DEGREE = 2
+# Rays closer than this angle are parallel: they see the same sign if they lie
+# on the same line, give or take this distance
+PARALLEL_RAY_TOLERANCE_METER = 3
+# Minimum Levenshtein similarity of two texts to be the same sign
+TEXT_SIMILARITY_THRESHOLD = 0.8
+# Shorter texts ("P", "24", ...) are everywhere, they are never linked
+MIN_TEXT_LENGTH = 3
+# Hits of a cell are compared with the hits around it in chunks of this many
+# rows, to bound the memory of the pairwise arrays
+PAIR_CHUNK_SIZE = 256
+
+
+@dataclass
+class OCRHit:
+    ocr_id: int
+    pano_id: str
+    text: str
+    confidence: float
+    lat: float
+    lon: float
+    # Compass bearing of the hit seen from the panorama, in degrees
+    bearing: float
+
+
+@dataclass
+class SignEntity:
+    text: str
+    confidence: float
+    # Estimated position of the sign, None if the rays don't intersect
+    lat: Optional[float]
+    lon: Optional[float]
+    hit_count: int
+    pano_count: int
+    # The hit the entity is shown with
+    ocr_id: int
+    ocr_ids: List[int]
+
+
+def setup_sign_entity_tables(connection):
+    """Create the sign entity table and link OCR results to their entity"""
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sign_entity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            confidence REAL,
+            lat REAL,
+            lon REAL,
+            hit_count INTEGER,
+            pano_count INTEGER,
+            ocr_id INTEGER,
+            FOREIGN KEY (ocr_id) REFERENCES ocr_result(id)
+        )
+    """)
+
+    cursor.execute("PRAGMA table_info(ocr_result)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if "entity_id" not in columns:
+        cursor.execute(
+            "ALTER TABLE ocr_result ADD COLUMN entity_id INTEGER REFERENCES sign_entity(id)"
+        )
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ocr_result_entity_id ON ocr_result(entity_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sign_entity_confidence ON sign_entity(confidence)"
+    )
+    connection.commit()
+
+
+def get_hit_bearing(
+    ocr_yaw: float,
+    ocr_pitch: float,
+    street_view_heading: float,
+    street_view_pitch: float,
+    street_view_roll: float,
+) -> float:
+    """Compass bearing of an OCR hit, same as the heading of its Street View URL"""
+    ocr_yaw, _ = correct_ocr_coordinates(
+        ocr_yaw, ocr_pitch, street_view_pitch, street_view_roll
+    )
+    return (ocr_yaw + street_view_heading) % 360
+
+
+def load_ocr_hits(connection) -> List[OCRHit]:
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT ocr.id, ocr.pano_id, ocr.text, ocr.confidence, ocr.yaw, ocr.pitch,
+            sp.lat, sp.lon, sp.heading, sp.pitch, sp.roll
+        FROM ocr_result ocr
+        JOIN search_panoramas sp ON ocr.pano_id = sp.pano_id
+        WHERE sp.heading IS NOT NULL AND sp.pitch IS NOT NULL AND sp.roll IS NOT NULL
+        """)
+
+    hits = []
+    for row in cursor:
+        (
+            ocr_id,
+            pano_id,
+            text,
+            confidence,
+            yaw,
+            pitch,
+            lat,
+            lon,
+            heading,
+            panorama_pitch,
+            roll,
+        ) = row
+        hits.append(
+            OCRHit(
+                ocr_id=ocr_id,
+                pano_id=pano_id,
+                text=text,
+                confidence=confidence,
+                lat=lat,
+                lon=lon,
+                bearing=get_hit_bearing(yaw, pitch, heading, panorama_pitch, roll),
+            )
+        )
+    return hits
+
+
+def normalize_text(text: str) -> str:
+    return "".join(text.lower().split())
+
+
+class SignEntityClusterer:
+    """
+    Cluster the OCR hits of neighbouring panoramas that see the same sign.
+
+    Every hit is a ray on the ground plane, from its panorama along its bearing.
+    Two hits of different panoramas are the same sign if their texts are
+    similar and their rays meet in front of both panoramas, within
+    `max_sign_distance` meters. Hits are bucketed in a grid of
+    2 * `max_sign_distance` meter cells, so only hits of neighbouring cells are
+    compared. Linked hits are clustered with a union-find and each cluster's
+    position is the least squares intersection of its rays.
+    """
+
+    def __init__(
+        self,
+        max_sign_distance: float = MAX_SIGN_DISTANCE_METER,
+        min_ray_angle: float = MIN_RAY_ANGLE_DEGREE,
+        parallel_ray_tolerance: float = PARALLEL_RAY_TOLERANCE_METER,
+        text_similarity_threshold: float = TEXT_SIMILARITY_THRESHOLD,
+        min_text_length: int = MIN_TEXT_LENGTH,
+    ):
+        self.max_sign_distance = max_sign_distance
+        self.min_ray_sin = math.sin(math.radians(min_ray_angle))
+        self.parallel_ray_tolerance = parallel_ray_tolerance
+        self.text_similarity_threshold = text_similarity_threshold
+        self.min_text_length = min_text_length
+
+    def __project(self, hits: List[OCRHit]) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions in local meters (east, north) and unit ray directions"""
+        lat = np.array([hit.lat for hit in hits], dtype=np.float64)
+        lon = np.array([hit.lon for hit in hits], dtype=np.float64)
+        bearing = np.radians([hit.bearing for hit in hits])
+
+        self.__origin = (float(lat.mean()), float(lon.mean()))
+        self.__meters_per_degree_lon = METERS_PER_DEGREE * math.cos(
+            math.radians(self.__origin[0])
+        )
+
+        positions = np.stack(
+            [
+                (lon - self.__origin[1]) * self.__meters_per_degree_lon,
+                (lat - self.__origin[0]) * METERS_PER_DEGREE,
+            ],
+            axis=1,
+        )
+        directions = np.stack([np.sin(bearing), np.cos(bearing)], axis=1)
+        return positions, directions
+
+    def __unproject(self, position: np.ndarray) -> Tuple[float, float]:
+        return (
+            self.__origin[0] + position[1] / METERS_PER_DEGREE,
+            self.__origin[1] + position[0] / self.__meters_per_degree_lon,
+        )
+
+    def __get_ray_matches(
+        self,
+        positions_1: np.ndarray,
+        directions_1: np.ndarray,
+        positions_2: np.ndarray,
+        directions_2: np.ndarray,
+    ) -> np.ndarray:
+        """(n1, n2) mask of the rays that can see the same sign"""
+        cross = (
+            directions_1[:, None, 0] * directions_2[None, :, 1]
+            - directions_1[:, None, 1] * directions_2[None, :, 0]
+        )
+        offset_x = positions_2[None, :, 0] - positions_1[:, None, 0]
+        offset_y = positions_2[None, :, 1] - positions_1[:, None, 1]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance_1 = (
+                offset_x * directions_2[None, :, 1]
+                - offset_y * directions_2[None, :, 0]
+            ) / cross
+            distance_2 = (
+                offset_x * directions_1[:, None, 1]
+                - offset_y * directions_1[:, None, 0]
+            ) / cross
+
+        intersecting = (
+            (np.abs(cross) >= self.min_ray_sin)
+            & (distance_1 > 0)
+            & (distance_1 <= self.max_sign_distance)
+            & (distance_2 > 0)
+            & (distance_2 <= self.max_sign_distance)
+        )
+
+        # Parallel rays looking the same way along (almost) the same line
+        offset_across = np.abs(
+            offset_x * directions_1[:, None, 1] - offset_y * directions_1[:, None, 0]
+        )
+        same_way = (
+            directions_1[:, None, 0] * directions_2[None, :, 0]
+            + directions_1[:, None, 1] * directions_2[None, :, 1]
+        ) > 0
+        offset_along = np.hypot(offset_x, offset_y)
+        collinear = (
+            (np.abs(cross) < self.min_ray_sin)
+            & same_way
+            & (offset_across <= self.parallel_ray_tolerance)
+            & (offset_along <= self.max_sign_distance)
+        )
+
+        return intersecting | collinear
+
+    def __get_links(
+        self, hits: List[OCRHit], positions: np.ndarray, directions: np.ndarray
+    ) -> List[Tuple[int, int]]:
+        encoded_texts = [EncodedText(normalize_text(hit.text)) for hit in hits]
+        lengths = np.array([text.length for text in encoded_texts])
+        pano_ids = np.array([hit.pano_id for hit in hits])
+
+        linkable = np.flatnonzero(lengths >= self.min_text_length)
+        cell_size = 2 * self.max_sign_distance
+        cells = np.floor(positions[linkable] / cell_size).astype(np.int64)
+
+        cell_members: Dict[Tuple[int, int], np.ndarray] = {}
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        sorted_cells = cells[order]
+        boundaries = np.flatnonzero(np.any(np.diff(sorted_cells, axis=0), axis=1)) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                cell = (int(cells[group[0], 0]), int(cells[group[0], 1]))
+                cell_members[cell] = linkable[group]
+
+        max_length_difference = 1 - self.text_similarity_threshold
+
+        links = []
+        for (cell_x, cell_y), members in cell_members.items():
+            neighbours = np.concatenate(
+                [
+                    cell_members[(cell_x + dx, cell_y + dy)]
+                    for dx in (-1, 0, 1)
+                    for dy in (-1, 0, 1)
+                    if (cell_x + dx, cell_y + dy) in cell_members
+                ]
+            )
+
+            for begin in range(0, len(members), PAIR_CHUNK_SIZE):
+                chunk = members[begin : begin + PAIR_CHUNK_SIZE]
+
+                # Each pair is seen from the cells of both hits, keep it once
+                mask = chunk[:, None] < neighbours[None, :]
+                mask &= pano_ids[chunk][:, None] != pano_ids[neighbours][None, :]
+
+                # Texts of too different lengths can't reach the threshold
+                length_1 = lengths[chunk][:, None]
+                length_2 = lengths[neighbours][None, :]
+                mask &= np.abs(length_1 - length_2) <= max_length_difference * (
+                    np.maximum(length_1, length_2)
+                )
+
+                if not mask.any():
+                    continue
+
+                mask &= self.__get_ray_matches(
+                    positions[chunk],
+                    directions[chunk],
+                    positions[neighbours],
+                    directions[neighbours],
+                )
+
+                for i, j in zip(*np.nonzero(mask)):
+                    hit_1, hit_2 = int(chunk[i]), int(neighbours[j])
+                    if (
+                        levenshtein_similarity(
+                            encoded_texts[hit_1], encoded_texts[hit_2]
+                        )
+                        >= self.text_similarity_threshold
+                    ):
+                        links.append((hit_1, hit_2))
+
+        return links
+
+    def __estimate_position(
+        self, positions: np.ndarray, directions: np.ndarray
+    ) -> Optional[np.ndarray]:
+        """Point closest to all the rays, in the least squares sense"""
+        # Projections on the normal of each ray
+        projections = (
+            np.eye(2)[None, :, :] - directions[:, :, None] * directions[:, None, :]
+        )
+        a = projections.sum(axis=0)
+        b = np.einsum("nij,nj->i", projections, positions)
+
+        # Rays all (almost) parallel, the position along them is unknown
+        if np.linalg.det(a) < self.min_ray_sin**2:
+            return None
+        return np.linalg.solve(a, b)
+
+    def cluster(self, hits: List[OCRHit]) -> List[SignEntity]:
+        """
+        Cluster the hits into sign entities. Every hit belongs to exactly one
+        entity, hits that match no other are entities of their own.
+        """
+        if not hits:
+            return []
+
+        positions, directions = self.__project(hits)
+        links = self.__get_links(hits, positions, directions)
+
+        parents = list(range(len(hits)))
+
+        def find(i: int) -> int:
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for i, j in links:
+            root_1, root_2 = find(i), find(j)
+            if root_1 != root_2:
+                parents[root_2] = root_1
+
+        clusters: Dict[int, List[int]] = {}
+        for i in range(len(hits)):
+            clusters.setdefault(find(i), []).append(i)
+
+        entities = []
+        for members in clusters.values():
+            # Same election as the duplication removal within a panorama
+            elected = max(
+                members,
+                key=lambda i: (len(hits[i].text), hits[i].confidence, -i),
+            )
+
+            lat, lon = None, None
+            pano_count = len({hits[i].pano_id for i in members})
+            if pano_count > 1:
+                position = self.__estimate_position(
+                    positions[members], directions[members]
+                )
+                if position is not None:
+                    lat, lon = self.__unproject(position)
+
+            entities.append(
+                SignEntity(
+                    text=hits[elected].text,
+                    confidence=hits[elected].confidence,
+                    lat=lat,
+                    lon=lon,
+                    hit_count=len(members),
+                    pano_count=pano_count,
+                    ocr_id=hits[elected].ocr_id,
+                    ocr_ids=[hits[i].ocr_id for i in members],
+                )
+            )
+
+        return entities
+
+
+def replace_sign_entities(connection, entities: List[SignEntity]):
+    """Replace all the sign entities, and link every OCR result to its entity"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("UPDATE ocr_result SET entity_id = NULL")
+        cursor.execute("DELETE FROM sign_entity")
+
+        for entity in entities:
+            cursor.execute(
+                "INSERT INTO sign_entity (text, confidence, lat, lon, hit_count, pano_count, ocr_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entity.text,
+                    entity.confidence,
+                    entity.lat,
+                    entity.lon,
+                    entity.hit_count,
+                    entity.pano_count,
+                    entity.ocr_id,
+                ),
+            )
+            entity_id = cursor.lastrowid
+            cursor.executemany(
+                "UPDATE ocr_result SET entity_id = ? WHERE id = ?",
+                [(entity_id, ocr_id) for ocr_id in entity.ocr_ids],
+            )
+
+        connection.commit()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        connection.rollback()
+        raise
@@ -1,21 +1,317 @@
 from streetlevel import streetview
-from typing import List
+from streetlevel.streetview.streetview import (
+    _build_sized_third_party_image_url,
+    _generate_tile_list,
+    _validate_get_panorama_params,
+)
+from streetlevel.util import download_tiles
+from typing import List, Tuple
 import panoocr as po
 import os, json
 import time
+import requests
+from io import BytesIO
 from PIL import Image
 from itertools import chain
-from .model import StreetViewProcessResult
+from .model import StreetViewProcessResult, PanoramaTiles
+from .panorama_cache import PanoramaCache
+
+DEFAULT_ZOOM = 5
+
+# Same headers streetlevel sends when it downloads panorama tiles
+TILE_REQUEST_HEADERS = {
+    "Host": "streetviewpixels-pa.googleapis.com",
+    "Origin": "https://www.google.com",
+    "Referer": "https://www.google.com/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 11.0; Win64; x64; rv:151.0) Gecko/20100101 Firefox/151.0",
+}
 
 
 def flatten_2d_list_itertools(lst):
     return list(chain(*lst))
 
 
-def get_streetview_image(pano_id: str) -> Image:
+def select_zoom_level(
+    pano,
+    perspectives: List[po.PerspectiveMetadata],
+    resolution_ratio: float = 1.0,
+    max_zoom: int = DEFAULT_ZOOM,
+) -> int:
+    """
+    Pick the lowest zoom level of a panorama whose angular resolution still
+    meets the pixels per degree required by the perspectives, so we don't
+    download and decode pixels e2p can't use. Falls back to the highest
+    available zoom level if none is sharp enough.
+    """
+    max_zoom = _validate_get_panorama_params(pano, max_zoom)
+    required_width = po.get_required_panorama_width(perspectives, resolution_ratio)
+
+    for zoom in range(max_zoom + 1):
+        image_size = pano.image_sizes[zoom]
+        if image_size is not None and image_size.x >= required_width:
+            return zoom
+    return max_zoom
+
+
+def get_streetview_image(
+    pano_id: str,
+    perspectives: List[po.PerspectiveMetadata] | None = None,
+    cache: PanoramaCache | None = None,
+) -> Image:
+    """
+    perspectives: if given, download the lowest zoom level that meets their resolution
+    cache: consulted before downloading, and filled with downloaded panoramas
+    """
+    if cache is not None:
+        if perspectives is None:
+            cached = cache.get(pano_id, zoom=DEFAULT_ZOOM)
+        else:
+            cached = cache.get(
+                pano_id, min_width=po.get_required_panorama_width(perspectives)
+            )
+        if cached is not None:
+            return cached[0]
+
+    pano = streetview.find_panorama_by_id(pano_id)
+    if perspectives is None:
+        zoom = DEFAULT_ZOOM
+    else:
+        zoom = select_zoom_level(pano, perspectives)
+    panorama_tiles = download_panorama_tiles(pano, zoom)
+
+    if cache is not None:
+        cache.put(pano_id, panorama_tiles)
+    return panorama_tiles.stitch()
+
+
+def download_panorama_tiles(
+    pano,
+    zoom: int = DEFAULT_ZOOM,
+    perspectives: List[po.PerspectiveMetadata] | None = None,
+) -> PanoramaTiles:
+    """
+    Download the tiles of a panorama, like `streetview.get_panorama` but
+    without stitching them. If `perspectives` are given, only the tile rows
+    they sample are downloaded, skipping the sky and ground rows.
+
+    Third-party panoramas are not tiled, they are downloaded in full as a
+    single tile and without a crop.
+    """
+    zoom = _validate_get_panorama_params(pano, zoom)
+    is_max_zoom = zoom == len(pano.image_sizes) - 1
+
+    if pano.is_third_party:
+        response = requests.get(_build_sized_third_party_image_url(pano, zoom))
+        response.raise_for_status()
+        with Image.open(BytesIO(response.content)) as image:
+            width, height = image.size
+        return PanoramaTiles(
+            tiles={(0, 0): response.content},
+            tile_width=width,
+            tile_height=height,
+            zoom=zoom,
+            is_max_zoom=is_max_zoom,
+            width=width,
+            height=height,
+        )
+
+    full_width = pano.image_sizes[zoom].x
+    full_height = pano.image_sizes[zoom].y
+    tile_height = pano.tile_size.y
+
+    tiles = _generate_tile_list(pano, zoom)
+    crop = None
+    if perspectives is not None:
+        crop = po.get_tile_crop(
+            po.get_sampled_pitch_range(perspectives),
+            full_width,
+            full_height,
+            tile_height,
+        )
+        tiles = [
+            tile for tile in tiles if crop.top <= tile.y * tile_height < crop.bottom
+        ]
+
+    return PanoramaTiles(
+        tiles=download_tiles(tiles, headers=TILE_REQUEST_HEADERS),
+        tile_width=pano.tile_size.x,
+        tile_height=tile_height,
+        zoom=zoom,
+        is_max_zoom=is_max_zoom,
+        width=full_width,
+        height=full_height if crop is None else crop.height,
+        crop=crop,
+    )
+
+
+def get_streetview_image_cropped(
+    pano_id: str,
+    perspectives: List[po.PerspectiveMetadata],
+    zoom: int | None = DEFAULT_ZOOM,
+    cache: PanoramaCache | None = None,
+) -> Tuple[Image.Image, po.PanoramaCrop | None]:
+    """
+    zoom: zoom level to download, None to pick it from the perspectives
+    cache: consulted before downloading, and filled with downloaded panoramas
+    """
+    if cache is not None:
+        cached = cache.get(
+            pano_id,
+            zoom=zoom,
+            min_width=(
+                po.get_required_panorama_width(perspectives) if zoom is None else None
+            ),
+            pitch_range=po.get_sampled_pitch_range(perspectives),
+        )
+        if cached is not None:
+            return cached
+
     pano = streetview.find_panorama_by_id(pano_id)
-    panorama_pil_image = streetview.get_panorama(pano=pano)
-    return panorama_pil_image
+    if zoom is None:
+        zoom = select_zoom_level(pano, perspectives)
+    panorama_tiles = download_panorama_tiles(pano, zoom, perspectives)
+
+    if cache is not None:
+        cache.put(pano_id, panorama_tiles)
+    return panorama_tiles.stitch(), panorama_tiles.crop
+
+
+def download_panorama(
+    pano_id: str,
+    perspectives: List[po.PerspectiveMetadata],
+    crop_panorama: bool = False,
+    adaptive_zoom: bool = False,
+    cache: PanoramaCache | None = None,
+) -> Tuple[Image.Image, po.PanoramaCrop | None]:
+    """
+    Download a panorama the way the `--crop-panorama` and `--adaptive-zoom`
+    options of the scripts ask for.
+
+    Returns:
+        Tuple[Image.Image, PanoramaCrop | None]: the panorama, and its crop if
+        only the rows sampled by the perspectives were downloaded
+    """
+    if crop_panorama:
+        return get_streetview_image_cropped(
+            pano_id,
+            perspectives,
+            None if adaptive_zoom else DEFAULT_ZOOM,
+            cache,
+        )
+    panorama_pil_image = get_streetview_image(
+        pano_id,
+        perspectives if adaptive_zoom else None,
+        cache,
+    )
+    return panorama_pil_image, None
+
+
+def get_perspective_plans_for_panorama(
+    panorama_image: po.PanoramaImage,
+    perspectives: List[po.PerspectiveMetadata],
+    plan_dir: str | None = None,
+) -> List[po.PerspectivePlan]:
+    """Plans are computed once per panorama size and reused afterwards"""
+    if panorama_image.crop is None:
+        panorama_height, panorama_width = panorama_image.loaded_image_array.shape[:2]
+    else:
+        panorama_height = panorama_image.crop.full_height
+        panorama_width = panorama_image.crop.full_width
+
+    return po.get_perspective_plans(
+        perspectives,
+        panorama_height,
+        panorama_width,
+        plan_dir=plan_dir,
+        crop=panorama_image.crop,
+    )
+
+
+def project_perspectives(
+    pano_id: str,
+    panorama_pil_image: Image,
+    perspectives: List[po.PerspectiveMetadata],
+    plan_dir: str | None = None,
+    e2p_workers: int | None = None,
+    panorama_crop: po.PanoramaCrop | None = None,
+) -> Tuple[List[po.PerspectiveImage], float]:
+    """
+    Project every perspective of a panorama and wait for all of them.
+
+    Returns:
+        Tuple[List[PerspectiveImage], float]: the perspective images and the e2p time
+    """
+    current_time = time.time()
+    panorama_image = po.PanoramaImage(pano_id, panorama_pil_image, crop=panorama_crop)
+    perspective_plans = get_perspective_plans_for_panorama(
+        panorama_image, perspectives, plan_dir
+    )
+    perspective_images = list(
+        panorama_image.generate_perspective_images(
+            perspective_plans, workers=e2p_workers
+        )
+    )
+    # Create the PIL images here, so the OCR stage only runs OCR
+    for perspective_image in perspective_images:
+        perspective_image.get_perspective_image()
+    return perspective_images, time.time() - current_time
+
+
+def recognize_perspectives(
+    perspective_images: List[po.PerspectiveImage],
+    perspectives: List[po.PerspectiveMetadata],
+    ocr_engine: po.OCREngine,
+    first_perspective_index: int = 0,
+    text_prefilter: po.TextPresencePrefilter | None = None,
+) -> List[po.SphereOCRBatch]:
+    """
+    Recognize several perspectives with a single `recognize_batch` call.
+    `first_perspective_index` is the index of the first one in the panorama.
+    text_prefilter: perspectives it rejects are not recognized and have no results
+    """
+    images = [
+        perspective_image.get_perspective_image()
+        for perspective_image in perspective_images
+    ]
+    for image, perspective in zip(images, perspectives):
+        po.set_image_fov(image, perspective.horizontal_fov, perspective.vertical_fov)
+    if text_prefilter is None:
+        keep = [True] * len(images)
+    else:
+        keep = text_prefilter.filter(images)
+
+    recognized = iter(
+        ocr_engine.recognize_batch(
+            [image for image, is_kept in zip(images, keep) if is_kept]
+        )
+    )
+    flat_ocr_results_for_each_perspective = [
+        next(recognized) if is_kept else [] for is_kept in keep
+    ]
+    return [
+        po.flat_ocr_results_to_sphere(
+            flat_ocr_results,
+            horizontal_fov=perspective.horizontal_fov,
+            vertical_fov=perspective.vertical_fov,
+            yaw_offset=perspective.yaw_offset,
+            pitch_offset=perspective.pitch_offset,
+            perspective_index=first_perspective_index + i,
+        )
+        for i, (flat_ocr_results, perspective) in enumerate(
+            zip(flat_ocr_results_for_each_perspective, perspectives)
+        )
+    ]
+
+
+def remove_duplications(
+    sphere_ocr_batch_for_each_perspective: List[po.SphereOCRBatch],
+    duplication_detection_engine: po.SphereOCRDuplicationDetectionEngine,
+) -> po.SphereOCRBatch:
+    """Remove duplications among the results of all perspectives at once"""
+    sphere_ocr_batch = po.SphereOCRBatch.concatenate(
+        sphere_ocr_batch_for_each_perspective
+    )
+    return duplication_detection_engine.remove_batch_duplications(sphere_ocr_batch)
 
 
 def ocr_google_streetview_from_id(
@@ -24,10 +320,14 @@ def ocr_google_streetview_from_id(
     perspectives: List[po.PerspectiveMetadata],
     ocr_engine: po.OCREngine,
     duplication_detection_engine: po.SphereOCRDuplicationDetectionEngine,
+    plan_dir: str | None = None,
+    e2p_workers: int | None = None,
+    panorama_crop: po.PanoramaCrop | None = None,
+    text_prefilter: po.TextPresencePrefilter | None = None,
 ) -> StreetViewProcessResult:
     begin_time = time.time()
 
-    panorama_image = po.PanoramaImage(pano_id, panorama_pil_image)
+    panorama_image = po.PanoramaImage(pano_id, panorama_pil_image, crop=panorama_crop)
 
     perspective_count = len(perspectives)
 
@@ -37,57 +337,49 @@ def ocr_google_streetview_from_id(
 
     all_sphere_ocr_results_for_each_perspective = []
 
-    # Process each perspective
+    current_time = time.time()
+    perspective_plans = get_perspective_plans_for_panorama(
+        panorama_image, perspectives, plan_dir
+    )
+    e2p_time += time.time() - current_time
+
+    # Project all perspectives in the background, OCR them as they come in
+    perspective_images = panorama_image.generate_perspective_images(
+        perspective_plans, workers=e2p_workers
+    )
+
+    # Process the perspectives in batches of the size the engine prefers
     print(f"{pano_id}\t ({perspective_count})")
-    for i, perspective in enumerate(perspectives):
-        print(f"{i}", end=" ", flush=True)
+    batch_size = ocr_engine.preferred_batch_size
+    for begin in range(0, perspective_count, batch_size):
+        end = min(begin + batch_size, perspective_count)
+        print(" ".join(str(i) for i in range(begin, end)), end=" ", flush=True)
         # Equirectangular to Perspective
         current_time = time.time()
-        perspective_image = panorama_image.generate_perspective_image(perspective)
-        perspective_pil_image = perspective_image.get_perspective_image()
+        batch_perspective_images = [perspective_images[i] for i in range(begin, end)]
+        for perspective_image in batch_perspective_images:
+            perspective_image.get_perspective_image()
         e2p_time += time.time() - current_time
 
         # Recognize Text
         current_time = time.time()
-        flat_ocr_results = ocr_engine.recognize(perspective_pil_image)
-        sphere_ocr_results = [
-            flat_ocr_result.to_sphere(
-                horizontal_fov=perspective.horizontal_fov,
-                vertical_fov=perspective.vertical_fov,
-                yaw_offset=perspective.yaw_offset,
-                pitch_offset=perspective.pitch_offset,
-            )
-            for flat_ocr_result in flat_ocr_results
-        ]
+        all_sphere_ocr_results_for_each_perspective += recognize_perspectives(
+            batch_perspective_images,
+            perspectives[begin:end],
+            ocr_engine,
+            first_perspective_index=begin,
+            text_prefilter=text_prefilter,
+        )
         ocr_time += time.time() - current_time
-
-        all_sphere_ocr_results_for_each_perspective.append(sphere_ocr_results)
     print()
+    if text_prefilter is not None:
+        print(f"{pano_id}\tText prefilter: {text_prefilter.report()}")
     # Remove duplications
     print(f"{pano_id}\tRemoving Duplications")
     current_time = time.time()
-    for i in range(0, perspective_count):
-        first_perspective_index = i
-        second_perspective_index = 0 if i == perspective_count - 1 else i + 1
-
-        (new_ocr_results_first_frame, new_ocr_results_second_frame) = (
-            duplication_detection_engine.remove_duplication_for_two_lists(
-                all_sphere_ocr_results_for_each_perspective[first_perspective_index],
-                all_sphere_ocr_results_for_each_perspective[second_perspective_index],
-            )
-        )
-
-        all_sphere_ocr_results_for_each_perspective[first_perspective_index] = (
-            new_ocr_results_first_frame
-        )
-        all_sphere_ocr_results_for_each_perspective[second_perspective_index] = (
-            new_ocr_results_second_frame
-        )
-
-    all_sphere_ocr_results_no_duplication = flatten_2d_list_itertools(
-        all_sphere_ocr_results_for_each_perspective
+    all_sphere_ocr_results_no_duplication = remove_duplications(
+        all_sphere_ocr_results_for_each_perspective, duplication_detection_engine
     )
-
     duplication_removal_time += time.time() - current_time
 
     total_time = time.time() - begin_time
@@ -109,13 +401,20 @@ def download_and_ocr_google_streetview_from_id(
     perspectives: List[po.PerspectiveMetadata],
     ocr_engine: po.OCREngine,
     duplication_detection_engine: po.SphereOCRDuplicationDetectionEngine,
+    plan_dir: str | None = None,
+    e2p_workers: int | None = None,
+    cache: PanoramaCache | None = None,
+    text_prefilter: po.TextPresencePrefilter | None = None,
+    crop_panorama: bool = False,
+    adaptive_zoom: bool = False,
 ) -> StreetViewProcessResult:
 
     download_time = 0
     current_time = time.time()
 
-    pano = streetview.find_panorama_by_id(pano_id)
-    panorama_pil_image = streetview.get_panorama(pano=pano)
+    panorama_pil_image, panorama_crop = download_panorama(
+        pano_id, perspectives, crop_panorama, adaptive_zoom, cache
+    )
     download_time += time.time() - current_time
 
     result = ocr_google_streetview_from_id(
@@ -124,6 +423,10 @@ def download_and_ocr_google_streetview_from_id(
         perspectives,
         ocr_engine,
         duplication_detection_engine,
+        plan_dir=plan_dir,
+        e2p_workers=e2p_workers,
+        panorama_crop=panorama_crop,
+        text_prefilter=text_prefilter,
     )
 
     result.download_time = download_time